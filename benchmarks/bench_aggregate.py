@@ -0,0 +1,46 @@
+"""Aggregation of a shuffled soup of lines and arcs, 20 segments per closed
+contour, former KdTree against the joint grid of polyline.aggregate.
+
+    python benchmarks/bench_aggregate.py [contours]
+"""
+import math
+import os
+import random
+import sys
+import time
+import numpy as np
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(here, os.pardir, 'sheetah'),
+                os.path.join(here, os.pardir, 'tests')]
+import former
+import polyline as pl
+
+# the former tree recursion is as deep as the tree
+sys.setrecursionlimit(100000)
+
+def soup(contours, segments=20):
+    parts = []
+    for c in range(contours):
+        center = np.array([(c % 100) * 30., (c // 100) * 30.])
+        angles = np.linspace(0, 2 * math.pi, segments + 1)
+        points = center + 10 * np.vstack((np.cos(angles), np.sin(angles))).T
+        points[-1] = points[0]
+        for i in range(segments):
+            if i % 5:
+                parts.append(pl.line2polyline(points[i], points[i+1]))
+            else:
+                parts.append(pl.arc2polyline(center, 10., angles[i],
+                                             angles[i+1]))
+    random.Random(3).shuffle(parts)
+    return parts
+
+contours = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+for name, fun in (('former KdTree', former.aggregate),
+                  ('joint grid', pl.aggregate)):
+    parts = soup(contours)
+    start = time.perf_counter()
+    result = fun(parts)
+    print('%-14s %6d segments  %.2f s  %d contours, %d closed' % (name,
+          len(parts), time.perf_counter() - start, len(result),
+          sum(p.is_closed() for p in result)))
@@ -0,0 +1,73 @@
+"""Rapid travel against corner entries of nested parts and a plate of holes,
+by job corner cost. A corner entry starts half a radian or more sharper than
+the smoothest vertex of its cut.
+
+    python benchmarks/bench_corner_cost.py [corner cost ...]
+"""
+import math
+import os
+import sys
+import numpy as np
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, os.pardir, 'sheetah'))
+from PyQt5 import QtCore
+import job as jb
+import leads
+import nesting
+import polyline as pl
+import sequencer
+
+def rect(w, h):
+    return pl.Polyline([[0, w, w, 0], [0, 0, h, h], [0] * 4], True)
+
+def ell(w, h, t):
+    return pl.Polyline([[0, w, w, t, t, 0], [0, 0, t, t, h, h], [0] * 6], True)
+
+def disc(x, y, r):
+    return pl.Polyline([[x - r, x + r], [y, y], [1, 1]], True)
+
+def plate(holes, vertices=64):
+    k = int(math.sqrt(holes))
+    angles = np.linspace(0, 2 * math.pi, vertices, endpoint=False)
+    contours = [pl.Polyline(np.vstack((10 * i + 5 + 3 * np.cos(angles),
+                                       10 * j + 5 + 3 * np.sin(angles),
+                                       np.full(vertices, .01))), True)
+                for i in range(k) for j in range(k)]
+    return contours + [rect(10 * k, 10 * k)]
+
+def parts(count):
+    kinds = [lambda: [rect(300, 200), disc(150, 100, 40)],
+             lambda: [ell(250, 300, 80)],
+             lambda: [disc(0, 0, 90)],
+             lambda: [rect(120, 420)],
+             lambda: [rect(180, 180), disc(50, 50, 20), disc(130, 130, 20)]]
+    return [kinds[i % len(kinds)]() for i in range(count)]
+
+if __name__ == '__main__':
+    app = QtCore.QCoreApplication([])
+    jobs = [jb.Job('part %d' % i, c) for i, c in enumerate(parts(25))]
+    jobs.append(jb.Job('plate', plate(100)))
+    sheet = nesting.rect_sheet(0, 0, 900, 1320)
+    nesting.apply(jobs, nesting.nest(jobs, sheet, time_budget=1.,
+                                     processes=0))
+    cuts = [(job, i) for job in jobs for i in range(job.cut_count)]
+    plines = [job.get_cut_plines()[i] for job, i in cuts]
+    order, entries = sequencer.sequence(plines)
+    print('%d cuts, vertex entries without lead-in: travel %.0f mm'
+          % (len(cuts), sequencer.travel(plines, order, entries)))
+    for cost in [float(a) for a in sys.argv[1:]] or [0., 10., 25., 50., 100.]:
+        for job in jobs:
+            job.corner_cost = cost
+        pierces = [job.get_pierces()[i] for job, i in cuts]
+        order, entries = sequencer.sequence(plines, pierces=pierces)
+        corner_entries, turn = 0, 0.
+        for (job, i), p, e in zip(cuts, plines, entries):
+            if p.is_closed():
+                corners, _ = leads._corners(p.raw, job.exterior_clockwise)
+                corner_entries += corners[e] > corners.min() + .5
+                turn += corners[e] - corners.min()
+        print('corner cost %5.0f mm/rad: travel %5.0f mm, %2d corner '
+              'entries, %5.1f rad over the smoothest starts' % (cost,
+              sequencer.travel(plines, order, entries, pierces=pierces),
+              corner_entries, turn))
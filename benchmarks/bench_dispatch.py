@@ -0,0 +1,47 @@
+"""Dispatch of Klipper input lines, former prefix tree against the prefix
+table of InputDecisionTree, in ns per line with the call overhead removed.
+
+    python benchmarks/bench_dispatch.py
+"""
+import os
+import sys
+import timeit
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(here, os.pardir, 'sheetah'),
+                os.path.join(here, os.pardir, 'tests')]
+import former
+from controllerbase import InputDecisionTree
+
+NUMBER = 50000
+REPEAT = 15
+
+PREFIXES = ['ok', '!!', '// echo: THC_error']
+EXTRA_PREFIXES = ['// echo: ' + w for w in ('probe', 'pos', 'temp', 'fan',
+                                             'state', 'home')]
+EXTRA_PREFIXES += ['B:', 'T0:', 'echo:', 'X:', 'Unknown']
+LINES = {'ok': 'ok',
+         'thc': '// echo: THC_error 1.234 5.678 142.1 4998.0',
+         'error': '!! Move out of range',
+         'other': '// Klipper state: Ready'}
+
+def function(line):
+    pass
+
+def best(statement):
+    return min(timeit.repeat(statement, number=NUMBER,
+                             repeat=REPEAT)) / NUMBER * 1e9
+
+overhead = best(lambda: function('ok'))
+for label, prefixes in (('klipper prefixes', PREFIXES),
+                        ('%d prefixes' % (len(PREFIXES) + len(EXTRA_PREFIXES)),
+                         PREFIXES + EXTRA_PREFIXES)):
+    times = []
+    for tree_type in (former.InputDecisionTree, InputDecisionTree):
+        tree = tree_type(function)
+        for prefix in prefixes:
+            tree.append_node(prefix, function)
+        times.append({name: best(lambda: tree.process_input(line)) - overhead
+                      for name, line in LINES.items()})
+    print(label + ': ' + ', '.join('%s %.0f -> %.0f ns' % (name, times[0][name],
+          times[1][name]) for name in LINES))
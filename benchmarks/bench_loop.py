@@ -0,0 +1,40 @@
+"""Corner loops of comb shaped contours, two looped corners per tooth,
+former np.insert loop against Polyline.loop.
+
+    python benchmarks/bench_loop.py [teeth ...]
+"""
+import math
+import os
+import sys
+import time
+import numpy as np
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(here, os.pardir, 'sheetah'),
+                os.path.join(here, os.pardir, 'tests')]
+import former
+import polyline as pl
+
+KERF = 1.
+LOOP_ANGLE = 121 * math.pi / 180
+LOOP_RADIUS = 1.5
+
+def comb(teeth):
+    x = np.repeat(np.arange(2 * teeth) * 2., 2)
+    y = np.tile([0., 10., 10., 0.], teeth)
+    x = np.concatenate((x, [x[-1], 0.]))
+    y = np.concatenate((y, [-5., -5.]))
+    return np.vstack((x, y, np.zeros_like(x)))
+
+for teeth in [int(a) for a in sys.argv[1:]] or [500, 2000, 5000]:
+    contour = pl.Polyline(comb(teeth), True).offset(KERF / 2)[0]
+    start = time.perf_counter()
+    expected = former.loop(contour, LOOP_ANGLE, KERF / 2, LOOP_RADIUS)
+    insert = time.perf_counter() - start
+    start = time.perf_counter()
+    looped = contour.loop(LOOP_ANGLE, KERF / 2, LOOP_RADIUS)
+    single = time.perf_counter() - start
+    print('%5d teeth, %6d -> %6d vertices: np.insert %7.1f ms, single '
+          'allocation %5.1f ms, identical %s' % (teeth, contour.raw.shape[1],
+          looped.raw.shape[1], insert * 1e3, single * 1e3,
+          np.array_equal(looped.raw, expected.raw)))
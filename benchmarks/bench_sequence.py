@@ -0,0 +1,56 @@
+"""Cut sequencing of shuffled sheets of plates, 16 round holes and their
+exterior each, from the machine origin.
+
+    python benchmarks/bench_sequence.py [plates ...]
+"""
+import math
+import os
+import random
+import sys
+import time
+import numpy as np
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, os.pardir, 'sheetah'))
+from PyQt5 import QtCore
+import job as jb
+import polyline as pl
+import sequencer
+
+HOLES = 4
+PITCH = 10 * HOLES + 10
+
+def plate(vertices=32):
+    angles = np.linspace(0, 2 * math.pi, vertices, endpoint=False)
+    contours = [pl.Polyline(np.vstack((10 * i + 5 + 3 * np.cos(angles),
+                                       10 * j + 5 + 3 * np.sin(angles),
+                                       np.full(vertices, .01))), True)
+                for i in range(HOLES) for j in range(HOLES)]
+    side = 10. * HOLES
+    return contours + [pl.Polyline([[0, side, side, 0], [0, 0, side, side],
+                                    [0] * 4], True)]
+
+if __name__ == '__main__':
+    app = QtCore.QCoreApplication([])
+    for count in [int(a) for a in sys.argv[1:]] or [20, 100, 240]:
+        width = math.ceil(math.sqrt(count))
+        jobs = []
+        for i in range(count):
+            job = jb.Job('plate %d' % i, plate())
+            job.position = [(i % width) * PITCH + 5, (i // width) * PITCH + 5]
+            jobs.append(job)
+        random.seed(1)
+        random.shuffle(jobs)
+        plines = [p for job in jobs for p in job.get_cut_plines()]
+        pierces = [p for job in jobs for p in job.get_pierces()]
+        n = len(plines)
+        initial = sequencer.travel(plines, range(n), [0] * n, pierces=pierces)
+        for label, candidates in (('vertices', None), ('pierces', pierces)):
+            start = time.perf_counter()
+            order, entries = sequencer.sequence(plines, pierces=candidates)
+            seconds = time.perf_counter() - start
+            optimized = sequencer.travel(plines, order, entries,
+                                         pierces=candidates)
+            print('%5d cuts, %-8s %5.2f s: travel %6.0f -> %5.0f mm '
+                  '(%.0f%% saved)' % (n, label, seconds, initial, optimized,
+                                      100 * (1 - optimized / initial)))
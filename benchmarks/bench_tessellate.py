@@ -0,0 +1,34 @@
+"""Tessellation of a closed polyline of random bulges, former per segment
+loop against Polyline.to_lines.
+
+    python benchmarks/bench_tessellate.py [vertices]
+"""
+import os
+import sys
+import time
+import numpy as np
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(here, os.pardir, 'sheetah'),
+                os.path.join(here, os.pardir, 'tests')]
+import former
+import polyline as pl
+
+n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+rng = np.random.default_rng(0)
+angles = np.sort(rng.uniform(0, 2 * np.pi, n))
+radii = rng.uniform(50, 100, n)
+bulges = rng.uniform(-1.5, 1.5, n)
+bulges[rng.random(n) < .3] = 0.
+vertices = np.vstack((radii * np.cos(angles), radii * np.sin(angles), bulges))
+
+start = time.perf_counter()
+expected = former.tessellate(vertices, True)
+loop = time.perf_counter() - start
+start = time.perf_counter()
+lines = pl.Polyline(vertices, True).to_lines()
+vectorized = time.perf_counter() - start
+print('%d vertices, %d points' % (n, lines.shape[1]))
+print('former loop  %.3f s' % loop)
+print('vectorized   %.3f s' % vectorized)
+print('max deviation %.1e' % np.max(np.abs(lines - expected)))
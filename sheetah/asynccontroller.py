@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Controller engine running on an asyncio event loop.
+
+Link I/O is non-blocking and driven by the loop, which owns every piece of
+controller state, so that no mutex is needed. Public methods can be called
+from any thread, they are forwarded to the loop thread. The engine needs no
+Qt event loop, ControllerBridge gives it the Qt signals the controller UI
+expects.
+"""
+from PyQt5 import QtCore
+from abc import abstractmethod
+import asyncio
+import concurrent.futures
+import os
+import queue
+import sys
+import threading
+
+from controllerbase import CommandStream, CommunicationLogger
+
+# bytes read from the link at once
+READ_SIZE = 4096
+
+class AsyncController(CommandStream):
+    def __init__(self, project, post_processor):
+        self.project = project
+        self.post_processor = post_processor
+        self.manual_cmd_queue = queue.Queue()
+        self.com_logger = CommunicationLogger()
+        self.state = self.ST_UNCO
+        # called from the loop thread on connection and disconnection
+        self.link_state_listeners = []
+
+        self.loop = None
+        self._loop_thread = None
+        # futures of calls waiting for the loop, cancelled if it stops first
+        self._calls_lock = threading.Lock()
+        self._calls = set()
+        self._fd = None
+        self._read_buffer = b''
+        self._write_buffer = b''
+        self._send_scheduled = False
+
+    @abstractmethod
+    def _link_open(self, *args, **kwargs):
+        """Open communication link, return its non-blocking file descriptor."""
+        pass
+
+    def _link_close(self):
+        os.close(self._fd)
+
+    @abstractmethod
+    def _process_input(self, input):
+        """Parse a line from the machine controller."""
+        pass
+
+    def _encode(self, cmd):
+        return (cmd + '\n').encode('ascii')
+
+    def connect(self, *args, **kwargs):
+        """Connect to machine controller and start the loop thread."""
+        if self.is_unconnected():
+            try:
+                self._fd = self._link_open(args, kwargs)
+            except Exception as e:
+                print('Connection failed: ' + str(e), file=sys.stderr)
+                return
+            self._reset_stream()
+            self._read_buffer = b''
+            self._write_buffer = b''
+            self._send_scheduled = False
+            self.loop = asyncio.new_event_loop()
+            self.loop.add_reader(self._fd, self._on_readable)
+            self.state = self.ST_INAC
+            self._loop_thread = threading.Thread(target=self._loop_worker,
+                                                 args=(self.loop,), daemon=True)
+            self._loop_thread.start()
+            self._call(self._notify_link_state)
+
+    def disconnect(self):
+        """Close link with machine controller, from any thread. Return True
+        if the link is closed, False if the controller was not inactive.
+        """
+        thread = self._loop_thread
+        future = self._call(self._disconnect)
+        if future is None:
+            return self.is_unconnected()
+        concurrent.futures.wait([future])
+        # a cancelled call means the loop stopped on a link failure
+        disconnected = future.cancelled() or future.result()
+        if disconnected and threading.current_thread() is not thread:
+            thread.join()
+        return disconnected
+
+    def run_file(self, filename):
+        """Run a raw GCode from file."""
+        self._call(self._run_file, filename)
+
+    def run(self, dry_run):
+        """Make post-processor generate project's GCode as a list of tasks and
+        start running it. Tasks are generated on the calling thread, so that
+        link I/O goes on meanwhile.
+        """
+        if self.is_inactive():
+            tasks = self.project.generate_tasks(self.post_processor, dry_run)
+            self._call(self._run_tasks, tasks)
+
+    def stop(self):
+        """Discard any tasks and manual commands except the one running."""
+        self._call(self._stop)
+
+    def abort(self):
+        """Discard all tasks and commands, setup emergency task instead and
+        switch to safe mode to prevent any interruption of the emergency task.
+        """
+        self._call(self._abort)
+
+    def send_manual_cmd(self, cmd):
+        """Push a manual command to waiting queue and eventually kickstart it."""
+        self._call(self._send_manual_cmd, cmd)
+
+    def _loop_worker(self, loop):
+        """Loop thread, running until disconnection."""
+        loop.run_forever()
+        with self._calls_lock:
+            for future in self._calls:
+                future.cancel()
+            self._calls.clear()
+            if self.loop is loop:
+                self.loop = None
+        loop.close()
+
+    def _call(self, fun, *args):
+        """Run fun(*args) on the loop thread. Return a concurrent future of
+        its result, cancelled if the loop stops before running it, None if
+        the loop is not running.
+        """
+        future = concurrent.futures.Future()
+        with self._calls_lock:
+            loop = self.loop
+            if loop is None:
+                return None
+            if threading.current_thread() is not self._loop_thread:
+                self._calls.add(future)
+                loop.call_soon_threadsafe(self._run_call, future, fun, args)
+                return future
+        self._run_call(future, fun, args)
+        return future
+
+    def _run_call(self, future, fun, args):
+        with self._calls_lock:
+            self._calls.discard(future)
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fun(*args))
+        except BaseException as e:
+            # still reported by the loop, or raised to a loop thread caller
+            future.set_exception(e)
+            raise
+
+    def _notify_link_state(self):
+        for listener in self.link_state_listeners:
+            listener()
+
+    def _disconnect(self):
+        """Return True once the link is closed, False if the controller was
+        not inactive.
+        """
+        if not self.is_inactive():
+            return False
+        self.loop.remove_reader(self._fd)
+        self.loop.remove_writer(self._fd)
+        self._link_close()
+        self.state = self.ST_UNCO
+        self._notify_link_state()
+        self.loop.stop()
+        self.loop = None
+        return True
+
+    def _link_failed(self, message):
+        print(message, file=sys.stderr)
+        # commands can neither be sent nor acknowledged anymore
+        self._fail_started_tasks()
+        self._reset_stream()
+        self.state = self.ST_INAC
+        self._disconnect()
+
+    # INPUT ####################################################################
+    def _on_readable(self):
+        try:
+            data = os.read(self._fd, READ_SIZE)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self._link_failed('Link read failed: ' + str(e))
+            return
+        if not data:
+            self._link_failed('Link read failed: end of file')
+            return
+        lines = (self._read_buffer + data).split(b'\n')
+        self._read_buffer = lines.pop()
+        for line in lines:
+            line = line.decode('ascii', 'replace').rstrip()
+            self._process_input(line)
+            self.com_logger.log_received_data(line)
+    # !INPUT ###################################################################
+
+    # OUTPUT ###################################################################
+    def _wake_sender(self):
+        # sending right away would reenter input parsing, defer to the loop
+        if self.loop is not None and not self._send_scheduled:
+            self._send_scheduled = True
+            self.loop.call_soon(self._send)
+
+    def _send(self):
+        """Send commands while the window allows it."""
+        if self.loop is None:
+            return
+        while self.next_cmd is not None and not self._window_full():
+            self._write_buffer += self._encode(self.next_cmd)
+            self._sent()
+        self._send_scheduled = False
+        self._flush()
+
+    def _flush(self):
+        """Write as much as the link takes, the rest once it is writable."""
+        try:
+            written = os.write(self._fd, self._write_buffer) \
+                      if self._write_buffer else 0
+        except BlockingIOError:
+            written = 0
+        except OSError as e:
+            self._link_failed('Link send failed: ' + str(e))
+            return
+        self._write_buffer = self._write_buffer[written:]
+        if self._write_buffer:
+            self.loop.add_writer(self._fd, self._flush)
+        else:
+            self.loop.remove_writer(self._fd)
+    # !OUTPUT ##################################################################
+
+class ControllerBridge(QtCore.QObject):
+    """Qt face of an AsyncController, posting link_state_update to the Qt
+    event loop. Anything else is forwarded to the controller, its loggers
+    already emit signals.
+    """
+    link_state_update = QtCore.pyqtSignal()
+    def __init__(self, controller):
+        super().__init__()
+        self.controller = controller
+        controller.link_state_listeners.append(self.link_state_update.emit)
+
+    def __getattr__(self, name):
+        return getattr(self.controller, name)
@@ -0,0 +1,125 @@
+from PyQt5 import QtCore
+from functools import partial
+import numpy as np
+
+import polyline as pl
+
+class CollisionDetector(QtCore.QObject):
+    """Keep track of jobs whose cut contours overlap each other.
+
+    Jobs bounding boxes are hashed in a grid so that a job changing shape is
+    only tested against jobs in the cells it covers.
+    """
+    collision_update = QtCore.pyqtSignal()
+
+    def __init__(self, project, cell_size=50.):
+        super().__init__()
+        self.project = project
+        self._cell_size = cell_size
+        self._cells = {}
+        self._entries = {}
+        self._collisions = {}
+        self.project.job_update.connect(self.on_job_update)
+
+    def colliding(self, job):
+        return bool(self._collisions.get(job))
+
+    def collisions(self):
+        """Return list of overlapping job pairs."""
+        pairs = set()
+        for job, others in self._collisions.items():
+            for other in others:
+                if (other, job) not in pairs:
+                    pairs.add((job, other))
+        return list(pairs)
+
+    def on_job_update(self):
+        jobs = set(self.project.jobs)
+        changed = False
+        for job in [j for j in self._entries if j not in jobs]:
+            job.evaluation_ready.disconnect(self._entries[job]['slot'])
+            changed |= self._remove(job)
+        for job in [j for j in self.project.jobs if j not in self._entries]:
+            slot = partial(self.update_job, job)
+            self._entries[job] = {'slot': slot, 'plines': None, 'cells': []}
+            self._collisions[job] = set()
+            job.evaluation_ready.connect(slot)
+            changed |= self._update(job)
+        if changed:
+            self.collision_update.emit()
+
+    def update_job(self, job):
+        if self._update(job):
+            self.collision_update.emit()
+
+    def _cell_range(self, bounds):
+        first = np.floor(bounds[0] / self._cell_size).astype(int)
+        last = np.floor(bounds[1] / self._cell_size).astype(int)
+        return [(x, y) for x in range(first[0], last[0] + 1)
+                       for y in range(first[1], last[1] + 1)]
+
+    def _remove(self, job):
+        """Forget job, return True if collisions changed."""
+        entry = self._entries.pop(job)
+        for cell in entry['cells']:
+            self._cells[cell].discard(job)
+        others = self._collisions.pop(job)
+        for other in others:
+            self._collisions[other].discard(job)
+        return bool(others)
+
+    def _update(self, job):
+        """Retest job against its neighbours if its cut contours changed,
+        return True if collisions changed.
+        """
+        entry = self._entries[job]
+        if job.evaluation is None:
+            return False
+        plines = job.evaluation.cut_plines
+        if plines is entry['plines']:
+            return False
+        entry['plines'] = plines
+        contour_bounds = pl.PolylineSet(plines).bounds
+        entry['bounds'] = np.array([np.min(contour_bounds[:,0], axis=0),
+                                    np.max(contour_bounds[:,1], axis=0)])
+        for cell in entry['cells']:
+            self._cells[cell].discard(job)
+        entry['cells'] = self._cell_range(entry['bounds'])
+        neighbours = set()
+        for cell in entry['cells']:
+            jobs = self._cells.setdefault(cell, set())
+            neighbours |= jobs
+            jobs.add(job)
+
+        collisions = set()
+        for other in neighbours:
+            other_entry = self._entries[other]
+            if (np.all(entry['bounds'][0] <= other_entry['bounds'][1]) and
+                np.all(other_entry['bounds'][0] <= entry['bounds'][1]) and
+                _overlap(plines, other_entry['plines'])):
+                collisions.add(other)
+
+        previous = self._collisions[job]
+        if collisions == previous:
+            return False
+        for other in previous - collisions:
+            self._collisions[other].discard(job)
+        for other in collisions - previous:
+            self._collisions[other].add(job)
+        self._collisions[job] = collisions
+        return True
+
+def _inside_part(point, plines):
+    """Return True if point lies in the material delimited by plines, the
+    exterior being the last one.
+    """
+    exterior = plines[-1]
+    if not exterior.is_closed() or not exterior.contains(point):
+        return False
+    return not any(p.contains(point) for p in plines[:-1] if p.is_closed())
+
+def _overlap(plines_a, plines_b):
+    if pl.crossings(plines_a, plines_b).size:
+        return True
+    return (_inside_part(plines_a[-1].start, plines_b) or
+            _inside_part(plines_b[-1].start, plines_a))
@@ -4,51 +4,46 @@ from PyQt5 import QtCore, QtGui, QtWidgets
 from abc import abstractmethod
 import regex as re
 import sys, queue
+from collections import deque
 
 from job import Job, Task
 
 class InputDecisionTree:
+    """Dispatch of input lines to the function of their longest matching
+    prefix, or to default_function if none matches.
+
+    Prefixes are compiled into a table by first character, candidates of a
+    character sorted longest first, so that a line only tests the prefixes
+    it can match.
+    """
     def __init__(self, default_function=None):
-        self._prefix = ''
         self._function = default_function
-        self._children = []
-
-    def _node_create(prefix, function):
-        node = InputDecisionTree.__new__(InputDecisionTree)
-        node._prefix = prefix
-        node._function = function
-        node._children = []
-        return node
+        self._prefixes = {}
+        self._compile()
 
     def append_node(self, prefix, function):
-        node = InputDecisionTree._node_create(prefix, function)
-        pos = self
-        pos_changed = True
-        while pos_changed:
-            pos_changed = False
-            for child in pos._children:
-                if node._prefix.startswith(child._prefix):
-                    pos = child
-                    pos_changed = True
-                    break
-        node_children = [index for index, child in enumerate(pos._children)
-                         if child._prefix.startswith(node._prefix)]
-        for index in sorted(node_children, reverse=True):
-            node._children.append(pos._children.pop(index))
-        pos._children.append(node)
+        self._prefixes[prefix] = function
+        self._compile()
+
+    def _compile(self):
+        table = {}
+        for prefix, function in self._prefixes.items():
+            table.setdefault(prefix[:1], []).append((prefix, function))
+        for candidates in table.values():
+            candidates.sort(key=lambda c: -len(c[0]))
+        # an empty prefix matches lines of any first character
+        empty = table.pop('', None)
+        if empty:
+            self._function = empty[0][1]
+        self._table = table
 
     def process_input(self, input):
-        pos = self
-        pos_changed = True
-        while pos_changed:
-            pos_changed = False
-            for child in pos._children:
-                if input.startswith(child._prefix):
-                    pos = child
-                    pos_changed = True
-                    break
-        if pos._function is not None:
-            pos._function(input)
+        for prefix, function in self._table.get(input[:1], ()):
+            if input.startswith(prefix):
+                function(input)
+                return
+        if self._function is not None:
+            self._function(input)
 
 class CommunicationLogger(QtCore.QObject):
     log_available = QtCore.pyqtSignal()
@@ -78,12 +73,216 @@ class GenericThread(QtCore.QThread):
     def run(self, *args):
         self.function(*self.args, **self.kwargs)
 
-class ControllerBase(QtCore.QObject):
-    link_state_update = QtCore.pyqtSignal()
+class CommandStream:
+    """Task and command bookkeeping of a controller, whatever runs its I/O.
+
+    Commands are sent ahead of their acknowledgement, up to window_commands
+    commands and window_bytes bytes in flight, acknowledgements completing
+    them in sending order. A window of one command is stop-and-wait. The
+    engine calls _sent once next_cmd is sent, the input parser calls
+    _complete_cmd on acknowledgements, and _wake_sender is called whenever
+    next_cmd may be sent.
+    """
     ST_UNCO = 0
     ST_INAC = 1
     ST_ACTI = 2
     ST_SAFE = 3
+    window_commands = 1
+    window_bytes = 128
+
+    def _reset_stream(self):
+        self.task_list = []
+        self.cur_task = None
+        self.next_cmd = None
+        self.next_task = None
+        self.next_last = False
+        # (command, task or None if manual, size, last of task)
+        self.in_flight = deque()
+        self.in_flight_bytes = 0
+
+    @abstractmethod
+    def _wake_sender(self):
+        """Make the engine send next_cmd when the window allows it."""
+        pass
+
+    def _task_started(self, task):
+        """Called when the first command of task is sent."""
+        pass
+
+    def is_unconnected(self):
+        return self.state == self.ST_UNCO
+    def is_inactive(self):
+        return self.state == self.ST_INAC
+    def is_active(self):
+        return self.state == self.ST_ACTI
+    def in_safe_mode(self):
+        return self.state == self.ST_SAFE
+
+    def _run_file(self, filename):
+        if self.is_inactive():
+            with open(filename) as f:
+                cmd_list = f.read().splitlines()
+            if cmd_list:
+                self._kickstart(Task(cmd_list))
+
+    def _run(self, dry_run):
+        if self.is_inactive():
+            self._run_tasks(self.project.generate_tasks(self.post_processor,
+                                                        dry_run))
+
+    def _run_tasks(self, tasks):
+        if self.is_inactive():
+            self.task_list = tasks
+            try:
+                task = self.task_list.pop(0)
+            except:
+                print('No job to run.')
+            else:
+                self._kickstart(task)
+
+    def _stop(self):
+        if self.is_active():
+            self.manual_cmd_queue.queue.clear()
+            self.task_list = []
+
+    def _abort(self):
+        if self.is_active():
+            self._enter_safe_mode()
+
+    def _abort_internal(self, message):
+        """Internal version of abort, called by the input parser, with error
+        logging.
+        """
+        if self.is_active():
+            self._enter_safe_mode()
+            self.com_logger.incident.emit(message)
+
+    def _enter_safe_mode(self):
+        """Factorization of abort and _abort_internal behaviour. Commands in
+        flight cannot be recalled, their tasks fail and the emergency task
+        follows them.
+        """
+        self.manual_cmd_queue.queue.clear()
+        self._fail_started_tasks()
+        self.cur_task = None
+        self.task_list = [self.post_processor.emergency_task()]
+        self.state = self.ST_SAFE
+        self.next_cmd = None
+        self._prepare_next_cmd()
+
+    def _fail_started_tasks(self):
+        """Fail the tasks of commands in flight and the current task if one
+        of its commands was sent. A task whose first command waits for the
+        window is left untouched.
+        """
+        tasks = [task for _, task, _, _ in self.in_flight] + [self.cur_task]
+        for task in tasks:
+            if task is not None and task.started and not task.failed:
+                task.fail()
+
+    def _send_manual_cmd(self, cmd):
+        # remove leading/trailing spaces
+        cmd = re.sub(r'(^\s*)|(\s*$)', '', cmd)
+        if self.is_active():
+            self.manual_cmd_queue.put(cmd)
+        elif self.is_inactive():
+            self._kickstart(Task([cmd]))
+
+    def _cmd_size(self, cmd):
+        """Return bytes taken by cmd in the machine controller input buffer."""
+        return len(cmd) + 1
+
+    def _window_full(self):
+        """Return True when next_cmd does not fit in the window. A command
+        larger than the byte window is sent alone.
+        """
+        if not self.in_flight:
+            return False
+        return (len(self.in_flight) >= self.window_commands or
+                self.in_flight_bytes + self._cmd_size(self.next_cmd) >
+                self.window_bytes)
+
+    def _sent(self):
+        """Move next_cmd, just sent, in flight and pop the following one."""
+        self.com_logger.log_sent_data(self.next_cmd)
+        if self.next_task is not None and not self.next_task.started:
+            self.next_task.start()
+            self._task_started(self.next_task)
+        size = self._cmd_size(self.next_cmd)
+        self.in_flight.append((self.next_cmd, self.next_task, size,
+                               self.next_last))
+        self.in_flight_bytes += size
+        self.next_cmd = None
+        self._prepare_next_cmd()
+
+    def _kickstart(self, task):
+        """Wake up sender to run task."""
+        self.cur_task = task
+        self.state = self.ST_ACTI
+        self.next_cmd = None
+        self._prepare_next_cmd()
+
+    def _pop_next_cmd(self):
+        """In active mode, return manual command if one is available
+        otherwise pop next command from tasks.
+        In safe mode, only consider commands from task.
+        Return (command, task, last) with task None for a manual command and
+        last True for the last command of task, command being None if there
+        is no command at all or in another mode.
+        """
+        if self.is_active():
+            try:
+                manual_cmd = self.manual_cmd_queue.get_nowait()
+            except queue.Empty:
+                pass
+            else:
+                if self.cur_task is None:
+                    self.cur_task = Task([manual_cmd])
+                else:
+                    return manual_cmd, None, False
+        if self.is_active() or self.in_safe_mode():
+            if self.cur_task is None or self.cur_task.empty():
+                # a task is closed once its last command is acknowledged
+                try:
+                    self.cur_task = self.task_list.pop(0)
+                except IndexError:
+                    self.cur_task = None
+            if self.cur_task is not None:
+                cmd = self.cur_task.pop()
+                return cmd, self.cur_task, self.cur_task.empty()
+        return None, None, False
+
+    def _prepare_next_cmd(self):
+        """Pop next_cmd if there is none, and go inactive once nothing is
+        left to send nor in flight.
+        """
+        if self.next_cmd is None:
+            self.next_cmd, self.next_task, self.next_last = self._pop_next_cmd()
+        if (self.next_cmd is None and not self.in_flight and
+            (self.is_active() or self.in_safe_mode())):
+            self.cur_task = None
+            self.state = self.ST_INAC
+        self._wake_sender()
+
+    def _complete_cmd(self):
+        """Function to be called by input parser when the oldest command in
+        flight is completed.
+        """
+        try:
+            _, task, size, last = self.in_flight.popleft()
+        except IndexError:
+            # acknowledgement of nothing sent, such as after a reconnection
+            return
+        self.in_flight_bytes -= size
+        if last and not task.failed:
+            task.close()
+        self._prepare_next_cmd()
+
+class ControllerBase(QtCore.QObject, CommandStream):
+    """Controller with blocking link I/O run by an input and an output
+    thread.
+    """
+    link_state_update = QtCore.pyqtSignal()
     def __init__(self, project, post_processor):
         super().__init__()
         self.project = project
@@ -106,38 +305,23 @@ class ControllerBase(QtCore.QObject):
     def run_file(self, filename):
         """Run a raw GCode from file.
         """
-        if self.is_inactive():
-            with open(filename) as f:
-                cmd_list = f.read().splitlines()
-            if cmd_list:
-                self.mutex.lock()
-                self._kickstart(Task(cmd_list))
-                self.mutex.unlock()
+        self.mutex.lock()
+        self._run_file(filename)
+        self.mutex.unlock()
 
     def run(self, dry_run):
         """Make post-processor generate project's GCode as a list of tasks and
         start running it.
         """
         self.mutex.lock()
-        if self.is_inactive():
-            tasks = self.project.generate_tasks(self.post_processor, dry_run)
-            self.task_list = tasks
-            try:
-                task = self.task_list.pop(0)
-            except:
-                print('No job to run.')
-            else:
-                self._kickstart(task)
-                self.send_cond.wakeOne()
+        self._run(dry_run)
         self.mutex.unlock()
 
     def stop(self):
         """Discard any tasks and manual commands except the one running.
         """
         self.mutex.lock()
-        if self.is_active():
-            self.manual_cmd_queue.queue.clear()
-            self.task_list = []
+        self._stop()
         self.mutex.unlock()
 
     def abort(self):
@@ -145,38 +329,19 @@ class ControllerBase(QtCore.QObject):
         switch to safe mode to prevent any interruption of the emergency task.
         """
         self.mutex.lock()
-        if self.is_active():
-            self._enter_safe_mode()
+        self._abort()
         self.mutex.unlock()
 
-    def _abort_internal(self, message):
-        """Internal version of abort with mutex acquired on caller side and
-        error logging.
-        """
-        if self.is_active():
-            self._enter_safe_mode()
-            self.com_logger.incident.emit(message)
-
-    def _enter_safe_mode(self):
-        """Factorization of abort and _abort_internal behaviour.
-        """
-        self.manual_cmd_queue.queue.clear()
-        self.cur_task.fail()
-        self.task_list = [self.post_processor.emergency_task()]
-        self.state = self.ST_SAFE
-
     def send_manual_cmd(self, cmd):
         """Push a manual command to waiting queue and eventually kickstart it.
         """
         self.mutex.lock()
-        # remove leading/trailing spaces
-        cmd = re.sub(r'(^\s*)|(\s*$)', '', cmd)
-        if self.is_active():
-            self.manual_cmd_queue.put(cmd)
-        elif self.is_inactive():
-            self._kickstart(Task([cmd]))
+        self._send_manual_cmd(cmd)
         self.mutex.unlock()
 
+    def _wake_sender(self):
+        self.send_cond.wakeOne()
+
     @abstractmethod
     def _link_open(self, *args, **kwargs):
         """Open communication link."""
@@ -197,28 +362,11 @@ class ControllerBase(QtCore.QObject):
         """Sends a command and eventually adds end characters to it."""
         pass
 
-    @abstractmethod
-    def _link_busy(self):
-        """Return True when machine controller is ready for next command to be
-        sent. Implementation can use self.next_cmd if length information is
-        needed.
-        """
-        pass
-
     @abstractmethod
     def _process_input(self, input):
         """Parse a line from the machine controller."""
         pass
 
-    def is_unconnected(self):
-        return self.state == self.ST_UNCO
-    def is_inactive(self):
-        return self.state == self.ST_INAC
-    def is_active(self):
-        return self.state == self.ST_ACTI
-    def in_safe_mode(self):
-        return self.state == self.ST_SAFE
-
     def connect(self, *args, **kwargs):
         """Connect to machine controller."""
         if self.is_unconnected():
@@ -227,9 +375,7 @@ class ControllerBase(QtCore.QObject):
             except Exception as e:
                 print('Connection failed: ' + str(e), file=sys.stderr)
             else:
-                self.task_list = []
-                self.cur_task = None
-                self.next_cmd = None
+                self._reset_stream()
                 self.keep_workers = True
                 self.input_thread.start()
                 self.output_thread.start()
@@ -268,14 +414,15 @@ class ControllerBase(QtCore.QObject):
                 line = line.rstrip()
                 self.mutex.lock()
                 self._process_input(line)
-                self.com_logger.log_received_data(line)
                 self.mutex.unlock()
+                # logging queues the line, no need to hold the mutex
+                self.com_logger.log_received_data(line)
 
     def _output_worker(self):
         """Output thread working loop."""
         while self.keep_workers:
             self.mutex.lock()
-            while ((self.next_cmd is None or self._link_busy()) and
+            while ((self.next_cmd is None or self._window_full()) and
                    self.keep_workers):
                 self.send_cond.wait(self.mutex)
             if self.keep_workers:
@@ -286,53 +433,9 @@ class ControllerBase(QtCore.QObject):
                     print('Link send failed: ' + str(e), file=sys.stderr)
                     self.disconnect()
                     return
-                self.com_logger.log_sent_data(self.next_cmd)
-                self.next_cmd = None
+                self._sent()
             self.mutex.unlock()
 
-    def _kickstart(self, task):
-        """Wake up worker thread to run task."""
-        self.cur_task = task
-        self.next_cmd = self.cur_task.pop()
-        self.state = self.ST_ACTI
-        self.send_cond.wakeOne()
-
-    def _pop_next_cmd(self):
-        """In active mode, return manual command if one is available
-        otherwise pop next command from tasks.
-        In safe mode, only consider commands from task.
-        If no command at all or in another mode, return None.
-        """
-        if self.is_active():
-            try:
-                manual_cmd = self.manual_cmd_queue.get_nowait()
-            except queue.Empty:
-                pass
-            else:
-                if self.cur_task is None:
-                    self.cur_task = Task([manual_cmd])
-                else:
-                    return manual_cmd
-        if self.is_active() or self.in_safe_mode():
-            try:
-                return self.cur_task.pop()
-            except IndexError:
-                self.cur_task.close()
-                try:
-                    self.cur_task = self.task_list.pop(0)
-                except IndexError:
-                    self.cur_task = None
-                    self.state = self.ST_INAC
-                else:
-                    return self.cur_task.pop()
-        return None
-
-    def _complete_cmd(self):
-        """Function to be called by input parser when a command is completed.
-        """
-        self.next_cmd = self._pop_next_cmd()
-        self.send_cond.wakeOne()
-
 class JobErrorDialog(QtWidgets.QDialog):
     def __init__(self, msg, parent=None):
         super().__init__(parent)
@@ -2,38 +2,45 @@ import numpy as np
 import ezdxf
 import svgpathtools as svgpt
 import pathlib
+import os
+from multiprocessing import shared_memory
 
 from math import radians
 
+import instrumentation
 import polyline as pl
-from job import Job
+import workers
+from job import Job, directed
 
-def _load_polylines_dxf(filepath):
+# under this number of entities, import runs in the calling process
+PARALLEL_MIN_ENTITIES = 2000
+
+def _dxf_entities(filepath):
+    """Return dxf entities as plain tuples that can be sent to workers."""
     dwg = ezdxf.readfile(filepath)
     msp = dwg.modelspace()
-    polylines = []
+    entities = []
     for e in msp:
         if e.dxftype() == 'LINE':
-            polyline = pl.line2polyline(e.dxf.start[:2], e.dxf.end[:2])
+            entities.append(('LINE', tuple(e.dxf.start)[:2],
+                                     tuple(e.dxf.end)[:2]))
         elif e.dxftype() == 'ARC':
-            polyline = pl.arc2polyline(e.dxf.center, e.dxf.radius,
-                                       radians(e.dxf.start_angle),
-                                       radians(e.dxf.end_angle))
+            entities.append(('ARC', tuple(e.dxf.center)[:2], e.dxf.radius,
+                                    radians(e.dxf.start_angle),
+                                    radians(e.dxf.end_angle)))
         elif e.dxftype() == 'CIRCLE':
-            polyline = pl.circle2polyline(e.dxf.center, e.dxf.radius)
+            entities.append(('CIRCLE', tuple(e.dxf.center)[:2], e.dxf.radius))
         elif e.dxftype() == 'LWPOLYLINE':
             vertices = np.array(e.get_points()).transpose()[[0,1,4]]
-            polyline = pl.Polyline(vertices, e.closed)
+            entities.append(('LWPOLYLINE', vertices, e.closed))
         elif e.dxftype() == 'SPLINE':
-            polyline = pl.spline2polyline(e.dxf.degree,
-                [list(i) for i in np.array(e.control_points)[:,:2]], e.closed)
+            entities.append(('SPLINE', e.dxf.degree,
+                [list(i)[:2] for i in e.control_points], e.closed))
         else:
             raise Exception('unimplemented \"'+e.dxftype()+'\" dxf entity.')
-        polylines.append(polyline)
-
-    return polylines
+    return entities
 
-def _load_polylines_svg(filepath):
+def _svg_entities(filepath):
     px_per_inch = 96
     mm_per_inch = 25.4
     px_per_mm = px_per_inch / mm_per_inch
@@ -43,7 +50,7 @@ def _load_polylines_svg(filepath):
                                 convert_polylines_to_paths=True,
                                 convert_polygons_to_paths=True,
                                 return_svg_attributes=False)
-    polylines = []
+    entities = []
     for i in svg_items[0][0]:
         if isinstance(i, svgpt.path.Line):
             line = np.array([[svgpt.real(i.point(0.0)), svgpt.imag(i.point(0.0))],
@@ -51,63 +58,204 @@ def _load_polylines_svg(filepath):
             line /= px_per_mm
             if np.allclose(line[0], line[1]):
                 continue
-            polyline = pl.line2polyline(line[0], line[1])
+            entities.append(('LINE', line[0], line[1]))
         elif isinstance(i, svgpt.path.CubicBezier):
             control_points = np.array([[svgpt.real(i.start),    svgpt.imag(i.start)],
                                        [svgpt.real(i.control1), svgpt.imag(i.control1)],
                                        [svgpt.real(i.control2), svgpt.imag(i.control2)],
                                        [svgpt.real(i.end),      svgpt.imag(i.end)]])
             control_points /= px_per_mm
-            polyline = pl.spline2polyline(3, control_points.tolist(), False)
+            entities.append(('SPLINE', 3, control_points.tolist(), False))
         else:
             raise Exception('unknown type', i)
-        polylines.append(polyline)
-    return polylines
+    return entities
+
+def _entity2polyline(entity):
+    kind = entity[0]
+    if kind == 'LINE':
+        return pl.line2polyline(*entity[1:])
+    elif kind == 'ARC':
+        return pl.arc2polyline(*entity[1:])
+    elif kind == 'CIRCLE':
+        return pl.circle2polyline(*entity[1:])
+    elif kind == 'LWPOLYLINE':
+        return pl.Polyline(*entity[1:])
+    else:
+        return pl.spline2polyline(*entity[1:])
+
+def _convert_entities(entities):
+    """Return (vertices, closed) of the polylines converted from entities."""
+    polylines = [_entity2polyline(e) for e in entities]
+    return [(p.raw, p.is_closed()) for p in polylines]
+
+def _prepare_component(contours, kerf_width, exterior_clockwise):
+    """Check and group the (vertices, closed) contours of a component, shift
+    each group to its origin and offset it with default job parameters.
+    Return a list of (local_pos, contours) with contours a list of
+    (vertices, closed, offset_key, offset_results).
+    """
+    polylines = [pl.Polyline._init_internal(v, c) for v, c in contours]
+
+    # Check for no complex polylines (self crossing).
+    for polyline in polylines:
+        intersections = polyline.self_intersections()
+        if intersections.size:
+            # TODO show user where intersections are in the workspace
+            points = ', '.join('(%.3f, %.3f)' % tuple(p)
+                               for p in intersections.T)
+            raise Exception('Self crossing geometry found at ' + points)
+
+    # Group polylines as exterior and interior contours.
+    # Exterior is always the last in a group.
+    groups = []
+    for group in pl.group_as_contours(polylines):
+        local_pos = group[-1].bounds[0]
+        shifted = pl.PolylineSet(group).affine(-local_pos, 0, 1).polylines()
+        prepared = []
+        for i, p in enumerate(shifted):
+            if p.is_closed():
+                d = directed(p, i == len(shifted) - 1, exterior_clockwise)
+                key = pl.OffsetCache.key(d.raw, d.is_closed(), kerf_width / 2)
+                results = [(o.raw, o.is_closed())
+                           for o in d.offset(kerf_width / 2)]
+            else:
+                key, results = None, []
+            prepared.append((p.raw, p.is_closed(), key, results))
+        groups.append((local_pos, prepared))
+    return groups
+
+# SHARED MEMORY ################################################################
+class _SharedArray:
+    def __init__(self, index):
+        self.index = index
+
+def _extract_arrays(obj, arrays):
+    """Return obj with its arrays replaced by _SharedArray placeholders."""
+    if isinstance(obj, np.ndarray):
+        arrays.append(np.ascontiguousarray(obj, dtype=float))
+        return _SharedArray(len(arrays) - 1)
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_extract_arrays(o, arrays) for o in obj)
+    return obj
+
+def _insert_arrays(obj, arrays):
+    if isinstance(obj, _SharedArray):
+        return arrays[obj.index]
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_insert_arrays(o, arrays) for o in obj)
+    return obj
+
+def _run_shared(fun, *args):
+    """Run fun in a worker, its arrays come back in one shared memory block
+    instead of being pickled.
+    """
+    arrays = []
+    skeleton = _extract_arrays(fun(*args), arrays)
+    shm = shared_memory.SharedMemory(create=True,
+                                     size=max(1, sum(a.nbytes for a in arrays)))
+    layout = []
+    offset = 0
+    for a in arrays:
+        np.ndarray(a.shape, float, shm.buf, offset)[...] = a
+        layout.append((a.shape, offset))
+        offset += a.nbytes
+    shm.close()
+    return shm.name, layout, skeleton
+
+def _collect_shared(future):
+    name, layout, skeleton = future.result()
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        arrays = [np.ndarray(shape, float, shm.buf, offset).copy()
+                  for shape, offset in layout]
+    finally:
+        shm.close()
+        shm.unlink()
+    return _insert_arrays(skeleton, arrays)
+
+def _map(fun, args_list, parallel):
+    if not parallel:
+        return [fun(*args) for args in args_list]
+    futures = [workers.pool().submit(_run_shared, fun, *args)
+               for args in args_list]
+    # collect every block before raising, so that none is leaked
+    results, error = [], None
+    for future in futures:
+        try:
+            results.append(_collect_shared(future))
+        except Exception as e:
+            error = error or e
+    if error is not None:
+        raise error
+    return results
+# !SHARED MEMORY ###############################################################
 
 def load(filepath):
-    # Load file as polylines only (line, arc, spline, etc are converted).
+    # Load file as plain entities, converted to polylines later.
     path = pathlib.Path(filepath)
     extension = path.suffix.lower()
     name = path.stem
     if extension == '.dxf':
-        raw_polylines = _load_polylines_dxf(filepath)
+        parse = _dxf_entities
     elif extension == '.svg':
-        raw_polylines = _load_polylines_svg(filepath)
+        parse = _svg_entities
     else:
         raise Exception('unknown extension \"' + extension + '\".')
+    if instrumentation.enabled:
+        entities = instrumentation.call(path.name, 'parse', parse, filepath)
+        return instrumentation.call(path.name, 'build jobs', _build_jobs,
+                                    name, entities)
+    return _build_jobs(name, parse(filepath))
+
+def _build_jobs(name, entities):
+    parallel = len(entities) >= PARALLEL_MIN_ENTITIES
+    if parallel:
+        # contiguous chunks keep file order for a reproducible aggregation
+        nb_chunks = 4 * os.cpu_count()
+        chunks = [entities[i*len(entities)//nb_chunks:
+                           (i+1)*len(entities)//nb_chunks]
+                  for i in range(nb_chunks)]
+    else:
+        chunks = [entities]
+    raw_polylines = [pl.Polyline._init_internal(v, c)
+                     for converted in _map(_convert_entities,
+                                           [(c,) for c in chunks], parallel)
+                     for v, c in converted]
 
     # Aggregate consecutive polylines.
     polylines = pl.aggregate(raw_polylines)
 
-    # Check for no complex polylines (self crossing).
-    for polyline in polylines:
-        if not polyline.is_simple():
-            # TODO find a way to show user where is(are) the intersection(s)
-            raise Exception('Self crossing geometry found')
-
     # TODO detect geometry that cross others
 
 
     # TODO remove buggy closed single lines
     polylines = [p for p in polylines if p._vertices.shape[0] > 1]
 
-    # Group polylines as exterior and interior contours.
-    # Exterior is always the last in a group.
-    contour_groups = pl.group_as_contours(polylines)
+    # Components of overlapping contours are checked, grouped and offset
+    # independently.
+    components = pl.overlap_components(polylines)
+    args_list = [([(polylines[i].raw, polylines[i].is_closed()) for i in ids],
+                  Job.default_kerf_width, Job.default_exterior_clockwise)
+                 for ids in components]
+    groups = [g for prepared in _map(_prepare_component, args_list, parallel)
+                for g in prepared]
 
-    bounds = [g[-1].bounds.flatten() for g in contour_groups]
-    bounds = np.transpose(np.vstack(bounds))
-    global_pos = np.min(bounds, axis=1)[:2]
+    global_pos = np.min([local_pos for local_pos, _ in groups], axis=0)
 
     # Create jobs and return.
     jobs = []
-    for i, contours in enumerate(contour_groups):
-        if len(contour_groups) > 1:
+    for i, (local_pos, contours) in enumerate(groups):
+        if len(groups) > 1:
             job_name = format('%s %i'%(name, i))
         else:
             job_name = name
-        local_pos = contours[-1].bounds[0]
-        shifted = [c.affine(-local_pos, 0, 1) for c in contours]
+        shifted = []
+        for vertices, closed, key, results in contours:
+            shifted.append(pl.Polyline._init_internal(vertices, closed))
+            if key is not None:
+                for vertices, _ in results:
+                    vertices.flags.writeable = False
+                pl.offset_cache.put(key, results)
         job = Job(job_name, shifted)
         job.position = local_pos - global_pos
         jobs.append(job)
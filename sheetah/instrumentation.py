@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Call counts, wall time, cache hits and output sizes of pipeline stages,
+file loading and post processing, recorded by scope (job name, instance or
+file) and stage. The time of a stage includes the stages it pulls. Call
+sites check enabled before anything else, so that it costs nothing when
+switched off.
+"""
+import functools
+import json
+import threading
+import time
+
+import numpy as np
+
+enabled = False
+
+_lock = threading.Lock()
+_stats = {}
+_caches = {}
+_dump_thread = None
+_dump_stop = None
+
+def enable():
+    global enabled
+    enabled = True
+
+def disable():
+    global enabled
+    enabled = False
+
+def reset():
+    with _lock:
+        _stats.clear()
+
+def register_cache(name, stats_fun):
+    """Report stats_fun() dict under name with every snapshot."""
+    with _lock:
+        _caches[name] = stats_fun
+
+def describe(fun):
+    """Return (scope, stage) names of a pipeline function, the scope being
+    the name of the object it is bound to.
+    """
+    while isinstance(fun, functools.partial):
+        fun = fun.func
+    owner = getattr(fun, '__self__', None)
+    return str(getattr(owner, 'name', type(owner).__name__)), fun.__name__
+
+def record(scope, stage, seconds, items=0, nbytes=0, hits=0, misses=0):
+    with _lock:
+        s = _stats.get((scope, stage))
+        if s is None:
+            s = _stats[(scope, stage)] = {'calls': 0, 'seconds': 0.,
+                                          'max_seconds': 0., 'items': 0,
+                                          'last_bytes': 0, 'max_bytes': 0,
+                                          'hits': 0, 'misses': 0}
+        s['calls'] += 1
+        s['seconds'] += seconds
+        s['max_seconds'] = max(s['max_seconds'], seconds)
+        s['items'] += items
+        s['last_bytes'] = nbytes
+        s['max_bytes'] = max(s['max_bytes'], nbytes)
+        s['hits'] += hits
+        s['misses'] += misses
+
+def call(scope, stage, fun, *args, hits=0, misses=0):
+    """Return fun(*args), recording its time and output size."""
+    start = time.perf_counter()
+    result = fun(*args)
+    seconds = time.perf_counter() - start
+    items, nbytes = size(result)
+    record(scope, stage, seconds, items, nbytes, hits, misses)
+    return result
+
+def size(obj):
+    """Return (items, bytes) of obj, items counting the elements of a list
+    and bytes the vertices or commands it holds.
+    """
+    if isinstance(obj, np.ndarray):
+        return 1, obj.nbytes
+    if isinstance(obj, (list, tuple)):
+        return len(obj), sum(size(o)[1] for o in obj)
+    if hasattr(obj, 'raw'):
+        return 1, obj.raw.nbytes
+    if hasattr(obj, 'cmd_list'):
+        return len(obj.cmd_list), sum(len(c) for c in obj.cmd_list)
+    return 1, 0
+
+def stats():
+    """Return {(scope, stage): stats} recorded since the last reset."""
+    with _lock:
+        return {k: dict(v) for k, v in _stats.items()}
+
+def stage_stats():
+    """Return {stage: stats} summed over every scope."""
+    totals = {}
+    for (_, stage), s in stats().items():
+        t = totals.setdefault(stage, dict.fromkeys(s, 0))
+        for k, v in s.items():
+            t[k] = max(t[k], v) if k.startswith('max_') else t[k] + v
+    return totals
+
+def cache_stats():
+    with _lock:
+        caches = dict(_caches)
+    return {name: fun() for name, fun in caches.items()}
+
+def report():
+    """Return stage and cache stats as a text table."""
+    lines = ['%-24s %8s %10s %10s %10s %8s %8s' % ('stage', 'calls', 'total ms',
+             'max ms', 'items', 'hits', 'misses')]
+    stages = sorted(stage_stats().items(), key=lambda i: -i[1]['seconds'])
+    for stage, s in stages:
+        lines.append('%-24s %8i %10.1f %10.1f %10i %8i %8i' % (stage,
+                     s['calls'], s['seconds'] * 1e3, s['max_seconds'] * 1e3,
+                     s['items'], s['hits'], s['misses']))
+    for name, s in cache_stats().items():
+        lines.append(name + ': ' + ', '.join('%s %s' % i for i in s.items()))
+    return '\n'.join(lines)
+
+def dump(filepath):
+    """Append a json line with a snapshot of every stat to filepath."""
+    snapshot = {'time': time.time(),
+                'stats': {scope + '/' + stage: s
+                          for (scope, stage), s in stats().items()},
+                'caches': cache_stats()}
+    with open(filepath, 'a') as f:
+        f.write(json.dumps(snapshot) + '\n')
+
+def start_dump(filepath, interval=10.):
+    """Dump to filepath every interval seconds from a daemon thread."""
+    global _dump_thread, _dump_stop
+    stop_dump()
+    _dump_stop = threading.Event()
+    def run(stop):
+        while not stop.wait(interval):
+            dump(filepath)
+    _dump_thread = threading.Thread(target=run, args=(_dump_stop,),
+                                    daemon=True)
+    _dump_thread.start()
+
+def stop_dump():
+    global _dump_thread, _dump_stop
+    if _dump_thread is not None:
+        _dump_stop.set()
+        _dump_thread.join()
+        _dump_thread = None
+        _dump_stop = None
@@ -1,8 +1,19 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 from PyQt5 import QtCore
+from contextlib import contextmanager
 import numpy as np
+import functools
+import hashlib
 import math
+import threading
+import time
+import traceback
+import weakref
+
+import instrumentation
+import leads
+from polyline import LOD_PRECISIONS, PolylineSet
 
 class Task():
     def __init__(self, cmd_list):
@@ -10,6 +21,7 @@ class Task():
             raise Exception('Cannot create empty task.')
         self.cmd_list = cmd_list
         self.cmd_index = 0
+        self.started = False
         self.failed = False
 
     def __str__(self):
@@ -20,6 +32,14 @@ class Task():
         self.cmd_index += 1
         return cmd
 
+    def start(self):
+        """Called when the first command is sent."""
+        self.started = True
+
+    def empty(self):
+        """Return True once every command has been popped."""
+        return self.cmd_index >= len(self.cmd_list)
+
     def fail(self):
         self.failed = True
         self.close()
@@ -34,10 +54,10 @@ class JobTask(Task):
         self.task_id = task_id
         self.dry_run = dry_run
 
-    def pop(self):
-        if not self.dry_run and self.cmd_index == 0:
+    def start(self):
+        super().start()
+        if not self.dry_run:
             self.job.set_cut_state(self.task_id, Job.RUNNING)
-        return super().pop()
 
     def close(self):
         super().close()
@@ -47,6 +67,18 @@ class JobTask(Task):
             else:
                 self.job.set_cut_state(self.task_id, Job.DONE)
 
+class EvaluationCancelled(Exception):
+    """Raised inside pipeline stages once their evaluation is outdated."""
+    pass
+
+# outdated check of the evaluation running on each thread
+_running = threading.local()
+
+def _check_cancelled():
+    outdated = getattr(_running, 'outdated', None)
+    if outdated is not None and outdated():
+        raise EvaluationCancelled()
+
 class PipelineNode:
     def __init__(self, fun, parent):
         self.fun = fun
@@ -66,9 +98,20 @@ class PipelineNode:
         return self._data
 
     def notify_change(self):
+        self._invalidate()
+
+    def _invalidate(self):
         self.up_to_date = False
         for child in self.children:
-            child.notify_change()
+            child._invalidate()
+
+    def adopt(self, node):
+        """Take over the computed data of node, a node of another pipeline
+        with the same function.
+        """
+        if hasattr(node, '_data'):
+            self._data = node._data
+        self.up_to_date = node.up_to_date
 
     def _update(self):
         if self.parent is None:
@@ -76,13 +119,328 @@ class PipelineNode:
 
         if not self.up_to_date:
             self.parent._update()
-            self._data = self.fun(self.parent._data)
+            if instrumentation.enabled:
+                self._data = instrumentation.call(*instrumentation.describe(self.fun),
+                                                  self.fun, self.parent._data)
+            else:
+                self._data = self.fun(self.parent._data)
+            self.up_to_date = True
+
+class ElementPipelineNode(PipelineNode):
+    """Pipeline node computing fun(indices, elements) only for the elements
+    of its parent list that changed, others are passed through as the same
+    objects.
+
+    An element is recomputed when its parent object is a new one or when its
+    index was given to notify_change. With expand, fun returns a list of
+    results per element, which are flattened.
+    """
+    # elements computed between two checks of the running evaluation
+    CHUNK = 16
+
+    def __init__(self, fun, parent, expand=False):
+        super().__init__(fun, parent)
+        self.expand = expand
+        self._memo = {}
+        self._dirty = None
+
+    def notify_change(self, index=None):
+        """Invalidate element at index, or all of them if None."""
+        if index is None:
+            self._dirty = None
+        elif self._dirty is not None:
+            self._dirty.add(index)
+        self._invalidate()
+
+    def _update(self):
+        if self.parent is None:
+            return False
+
+        if not self.up_to_date:
+            self.parent._update()
+            elements = self.parent._data
+            if self._dirty is None:
+                memo, dirty = {}, ()
+            else:
+                memo, dirty = self._memo, self._dirty
+            indices = [i for i, e in enumerate(elements)
+                       if id(e) not in memo or i in dirty]
+            results = {}
+            if instrumentation.enabled:
+                started = time.perf_counter()
+            # computed by chunks, an outdated evaluation stops in between
+            # and keeps what it computed for the next one
+            for start in range(0, len(indices), self.CHUNK):
+                try:
+                    _check_cancelled()
+                except EvaluationCancelled:
+                    self._keep_partial(elements, memo, dirty, results)
+                    raise
+                chunk = indices[start:start+self.CHUNK]
+                computed = self.fun(chunk, [elements[i] for i in chunk])
+                results.update(zip(chunk, computed))
+            if instrumentation.enabled:
+                items, nbytes = instrumentation.size([results[i] for i in indices])
+                instrumentation.record(*instrumentation.describe(self.fun),
+                                       time.perf_counter() - started, items,
+                                       nbytes, hits=len(elements) - len(indices),
+                                       misses=len(indices))
+
+            # memo holds elements too, so that their ids stay valid
+            self._memo = {}
+            self._data = []
+            for i, e in enumerate(elements):
+                result = results[i] if i in results else memo[id(e)][1]
+                self._memo[id(e)] = (e, result)
+                if self.expand:
+                    self._data += result
+                else:
+                    self._data.append(result)
+            self._dirty = set()
             self.up_to_date = True
 
+    def _keep_partial(self, elements, memo, dirty, results):
+        """Memoize results of an interrupted update, elements left are
+        computed by the next one.
+        """
+        self._memo = dict(memo)
+        for i, result in results.items():
+            self._memo[id(elements[i])] = (elements[i], result)
+        self._dirty = set(dirty) - set(results)
+
+    def adopt(self, node):
+        super().adopt(node)
+        self._memo = node._memo
+        self._dirty = None if node._dirty is None else set(node._dirty)
+
+class InstanceNode(PipelineNode):
+    """Root node holding the result of fun(), called again after each
+    invalidation.
+    """
+    def __init__(self, fun):
+        super().__init__(fun, None)
+
+    def _update(self):
+        if not self.up_to_date:
+            if instrumentation.enabled:
+                self._data = instrumentation.call(*instrumentation.describe(self.fun),
+                                                  self.fun)
+            else:
+                self._data = self.fun()
+            self.up_to_date = True
+
+def directed(polyline, exterior, exterior_clockwise):
+    """Return polyline turning the cut way, holes turning the other way round
+    than the exterior.
+    """
+    ccw = exterior_clockwise != exterior
+    if polyline.is_ccw() != ccw:
+        return polyline.reverse()
+    return polyline
+
+def source_key(polylines):
+    """Return a digest of polylines content, equal for copies of a part up
+    to floating point noise.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    for p in polylines:
+        raw = np.round(np.asarray(p.raw, dtype=float), 9) + 0.
+        h.update(b'c' if p.is_closed() else b'o')
+        h.update(raw.shape[1].to_bytes(4, 'little'))
+        h.update(raw.tobytes())
+    return h.digest()
+
+class GeometryInstance:
+    """Pre-affine geometry of a job: direction, scale, offset, lead, loop,
+    pierce candidates and tessellations. Instances are shared by every job
+    with the same source and parameters and never change once created, a job
+    changing one of them moves to another instance.
+
+    params is (exterior_clockwise, scale, kerf_width, loop_radius,
+    corner_cost, leads) with leads a tuple of (cut index, start vertex) set
+    by hand.
+    """
+    def __init__(self, polylines, source_key, params):
+        self.polylines = polylines
+        self.source_key = source_key
+        self.params = params
+        (self.exterior_clockwise, self.scale, self.kerf_width,
+         self.loop_radius, self.corner_cost, leads) = params
+        self.leads = dict(leads)
+        self._lock = threading.Lock()
+        self.name = 'instance ' + source_key.hex()[:8]
+
+        self.root_node = PipelineNode(None, None)
+        self.root_node._data = polylines
+        self.dir_node    = ElementPipelineNode(self._apply_direction, self.root_node)
+        self.scale_node  = ElementPipelineNode(self._apply_scale, self.dir_node)
+        self.offset_node = ElementPipelineNode(self._apply_offset, self.scale_node, expand=True)
+        self.lead_node   = ElementPipelineNode(self._apply_lead, self.offset_node)
+        self.loop_node   = ElementPipelineNode(self._apply_loop, self.lead_node)
+        self.pierce_node = ElementPipelineNode(self._apply_pierce, self.loop_node)
+        # display tessellations by precision
+        self._cut_gen_nodes = {}
+        self._part_gen_nodes = {}
+
+    def derive(self, params):
+        """Return a new instance with params, reusing the results of this one
+        that params do not change.
+        """
+        instance = GeometryInstance(self.polylines, self.source_key, params)
+        with self._lock:
+            for precision in self._cut_gen_nodes:
+                instance._gen_nodes(precision)
+            pairs = [(instance.dir_node, self.dir_node),
+                     (instance.scale_node, self.scale_node),
+                     (instance.offset_node, self.offset_node),
+                     (instance.lead_node, self.lead_node),
+                     (instance.loop_node, self.loop_node),
+                     (instance.pierce_node, self.pierce_node)]
+            for precision, node in self._cut_gen_nodes.items():
+                pairs.append((instance._cut_gen_nodes[precision], node))
+                pairs.append((instance._part_gen_nodes[precision],
+                              self._part_gen_nodes[precision]))
+            for new, old in pairs:
+                new.adopt(old)
+
+        if instance.exterior_clockwise != self.exterior_clockwise:
+            instance.dir_node.notify_change()
+        if instance.scale != self.scale:
+            instance.scale_node.notify_change()
+        if instance.kerf_width != self.kerf_width:
+            instance.offset_node.notify_change()
+        if instance.loop_radius != self.loop_radius:
+            instance.loop_node.notify_change()
+        if instance.corner_cost != self.corner_cost:
+            instance.pierce_node.notify_change()
+        for i in set(instance.leads) | set(self.leads):
+            if instance.leads.get(i) != self.leads.get(i):
+                instance.pierce_node.notify_change(i)
+        return instance
+
+    def scaled(self):
+        with self._lock:
+            return self.scale_node.data
+
+    def cut_plines(self):
+        with self._lock:
+            return self.loop_node.data
+
+    def pierces(self):
+        with self._lock:
+            return self.pierce_node.data
+
+    def cut_paths(self, precision):
+        with self._lock:
+            return self._gen_nodes(precision)[0].data
+
+    def shape_paths(self, precision):
+        with self._lock:
+            return self._gen_nodes(precision)[1].data
+
+    def _gen_nodes(self, precision):
+        if precision not in self._cut_gen_nodes:
+            self._cut_gen_nodes[precision] = ElementPipelineNode(
+                functools.partial(self._generate, precision), self.loop_node)
+            self._part_gen_nodes[precision] = PipelineNode(
+                functools.partial(self._generate_shape, precision), self.scale_node)
+        return self._cut_gen_nodes[precision], self._part_gen_nodes[precision]
+
+    def _apply_direction(self, indices, polylines):
+        exterior_id = len(self.polylines) - 1
+        return [directed(p, i == exterior_id, self.exterior_clockwise)
+                for i, p in zip(indices, polylines)]
+
+    def _apply_scale(self, indices, polylines):
+        return PolylineSet(polylines).affine([0,0], 0, self.scale).polylines()
+
+    def _apply_offset(self, indices, polylines):
+        offset_polylines = []
+        for p in polylines:
+            if p.is_closed():
+                offset_polylines.append(p.offset(self.kerf_width / 2))
+            else:
+                offset_polylines.append([p])
+        return offset_polylines
+
+    def _apply_lead(self, indices, polylines):
+        # middles of long lines are smooth entries
+        return [p.split_lines(leads.LEAD_LENGTH) if p.is_closed() else p
+                for p in polylines]
+
+    def _apply_loop(self, indices, polylines):
+        return [p.loop(121*math.pi/180, self.kerf_width / 2, self.loop_radius)
+                for p in polylines]
+
+    def _apply_pierce(self, indices, polylines):
+        # directed cuts have scrap on the same side, left when the exterior
+        # turns clockwise
+        return [leads.candidates(p, self.exterior_clockwise, self.leads.get(i),
+                                 self.corner_cost)
+                for i, p in zip(indices, polylines)]
+
+    def _generate(self, precision, indices, polylines):
+        return [p.to_lines(precision) for p in polylines]
+
+    def _generate_shape(self, precision, polylines):
+        if len(polylines) > 1:
+            polylines = [p for p in polylines if p.is_closed()]
+        return [p.to_lines(precision) for p in polylines]
+
+# instances still used by a job, by source key and params
+_instances = weakref.WeakValueDictionary()
+_instances_lock = threading.Lock()
+
+def geometry_instance(polylines, source_key, params, base=None):
+    """Return the shared GeometryInstance of polylines with params. A missing
+    one is derived from base when it has the same source.
+    """
+    key = (source_key,) + params
+    with _instances_lock:
+        instance = _instances.get(key)
+    if instance is None:
+        if base is not None and base.source_key == source_key:
+            instance = base.derive(params)
+        else:
+            instance = GeometryInstance(polylines, source_key, params)
+        with _instances_lock:
+            instance = _instances.setdefault(key, instance)
+    return instance
+
+def instance_count():
+    """Return the number of geometry instances in use."""
+    with _instances_lock:
+        return len(_instances)
+
+instrumentation.register_cache('geometry instances',
+                               lambda: {'entries': instance_count()})
+
+class Evaluation:
+    """Snapshot of the display and cut data of a job pipeline run."""
+    def __init__(self, version, cut_paths, shape_paths, cut_plines):
+        self.version = version
+        self.cut_paths = cut_paths
+        self.shape_paths = shape_paths
+        self.cut_plines = cut_plines
+
+class EvaluationTask(QtCore.QRunnable):
+    def __init__(self, job, version):
+        super().__init__()
+        self.job = job
+        self.version = version
+
+    def run(self):
+        # exceptions must not escape to Qt from a pool thread
+        try:
+            self.job.evaluate(self.version)
+        except Exception:
+            traceback.print_exc()
+
 class Job(QtCore.QObject):
     shape_update = QtCore.pyqtSignal()
     param_update = QtCore.pyqtSignal()
     state_update = QtCore.pyqtSignal()
+    evaluation_ready = QtCore.pyqtSignal()
 
     TODO    = 0
     RUNNING = 1
@@ -91,6 +449,10 @@ class Job(QtCore.QObject):
     IGNORED = 4
     _states = (TODO, RUNNING, DONE, FAILED, IGNORED)
 
+    #TODO use default params handler to fill these attr
+    default_exterior_clockwise = True
+    default_kerf_width = 1.5
+
     def __init__(self, name, polylines):
         if not polylines:
             raise Exception('Empty job')
@@ -98,38 +460,70 @@ class Job(QtCore.QObject):
         super().__init__()
         self._name = name
 
-        #TODO use default params handler to fill these attr
         self._arc_voltage = 150.0
-        self._exterior_clockwise = True
+        self._exterior_clockwise = self.default_exterior_clockwise
         self._feedrate = 5000
-        self._kerf_width = 1.5
+        self._kerf_width = self.default_kerf_width
         self._pierce_delay = 500
         self._position = np.array([0.,0.])
         self._angle = 0.
         self._scale = 1.
         self._loop_radius = 1.5
+        self._corner_cost = leads.CORNER_COST
+        self._display_precision = LOD_PRECISIONS[0]
 
-        self.root_node = PipelineNode(None, None)
-        self.root_node._data = polylines
-
-        # vector
-        self.dir_node      = PipelineNode(self._apply_direction, self.root_node)
-        self.scale_node    = PipelineNode(self._apply_scale, self.dir_node)
-        self.offset_node   = PipelineNode(self._apply_offset, self.scale_node)
-        self.lead_node     = PipelineNode(self._apply_lead, self.offset_node)
-        self.loop_node     = PipelineNode(self._apply_loop, self.lead_node)
-        # discrete (display only)
-        self.cut_gen_node  = PipelineNode(self._generate, self.loop_node)
-        self.part_gen_node = PipelineNode(self._generate_shape, self.scale_node)
-        self.cut_aff_node  = PipelineNode(self._apply_affine, self.cut_gen_node)
-        self.part_aff_node = PipelineNode(self._apply_affine, self.part_gen_node)
-
-        self.cut_pline_affine_node = PipelineNode(self._apply_pline_affine, self.loop_node)
-
+        # cut count and states follow evaluations on the job thread, states
+        # are also set from the controller thread
+        self._state_lock = threading.Lock()
         self.cut_count = 0
-        self.lead_pos = [0.] * self.cut_count
+        self.lead_pos = [None] * self.cut_count
         self.cut_state = [self.TODO] * self.cut_count
 
+        # pre-affine geometry comes from an instance shared with copies
+        self._source_key = source_key(polylines)
+        self._instance = geometry_instance(polylines, self._source_key,
+                                           self._instance_params())
+        self._source = self._instance.polylines
+
+        self.instance_node = InstanceNode(self._select_instance)
+        self.loop_node     = PipelineNode(self._instance_cut_plines, self.instance_node)
+        # discrete (display only)
+        self.cut_gen_node  = PipelineNode(self._instance_cut_paths, self.instance_node)
+        self.part_gen_node = PipelineNode(self._instance_shape_paths, self.instance_node)
+        self.cut_aff_node  = ElementPipelineNode(self._apply_affine, self.cut_gen_node)
+        self.part_aff_node = ElementPipelineNode(self._apply_affine, self.part_gen_node)
+
+        self.cut_pline_affine_node = ElementPipelineNode(self._apply_pline_affine, self.loop_node)
+        # pulled on demand only, by cut sequencing
+        self.pierce_node = PipelineNode(self._instance_pierces, self.loop_node)
+        self.pierce_affine_node = ElementPipelineNode(self._apply_pierce_affine, self.pierce_node)
+
+        # evaluation order of background runs
+        self._stages = [self.instance_node, self.loop_node,
+                        self.cut_gen_node, self.cut_aff_node,
+                        self.part_gen_node, self.part_aff_node,
+                        self.cut_pline_affine_node]
+
+        # nodes are only touched with _lock held, invalidations from the GUI
+        # thread wait in _pending until the next evaluation picks them up
+        self._lock = threading.RLock()
+        self._pending_lock = threading.Lock()
+        self._pending = []
+        self._version = 0
+        self._evaluation = None
+
+        # signals and evaluation requests are coalesced until the next event
+        # loop iteration, or the end of the outermost batch
+        self._batch_depth = 0
+        self._notify_lock = threading.Lock()
+        self._notified = set()
+        self._evaluation_wanted = False
+        self._flush_requested = False
+
+        self.evaluation_ready.connect(self._on_evaluation_ready)
+        self._evaluation_wanted = True
+        self._request_flush()
+
     @property
     def name(self):
         return self._name
@@ -143,10 +537,9 @@ class Job(QtCore.QObject):
     @position.setter
     def position(self, p):
         self._position = np.array(p)
-        self.cut_aff_node.notify_change()
-        self.part_aff_node.notify_change()
-        self.cut_pline_affine_node.notify_change()
-        self.shape_update.emit()
+        self._invalidate(self.cut_aff_node, self.part_aff_node,
+                         self.cut_pline_affine_node, self.pierce_affine_node)
+        self._notify('shape_update')
 
     @property
     def angle(self):
@@ -155,10 +548,9 @@ class Job(QtCore.QObject):
     def angle(self, a):
         """Set job angle in radians."""
         self._angle = a
-        self.cut_aff_node.notify_change()
-        self.part_aff_node.notify_change()
-        self.cut_pline_affine_node.notify_change()
-        self.shape_update.emit()
+        self._invalidate(self.cut_aff_node, self.part_aff_node,
+                         self.cut_pline_affine_node, self.pierce_affine_node)
+        self._notify('shape_update')
 
     def turn_around(self, center, angle):
         """Angle in radians."""
@@ -167,10 +559,9 @@ class Job(QtCore.QObject):
         sin = math.sin(angle)
         v = self.position - center
         self._position = center + [v[0]*cos - v[1]*sin, v[0]*sin + v[1]*cos]
-        self.cut_aff_node.notify_change()
-        self.part_aff_node.notify_change()
-        self.cut_pline_affine_node.notify_change()
-        self.shape_update.emit()
+        self._invalidate(self.cut_aff_node, self.part_aff_node,
+                         self.cut_pline_affine_node, self.pierce_affine_node)
+        self._notify('shape_update')
 
     def pos_rot_matrix(self):
         cos = math.cos(self._angle)
@@ -185,18 +576,17 @@ class Job(QtCore.QObject):
     @scale.setter
     def scale(self, s):
         self._scale = s
-        self.scale_node.notify_change()
-        self.shape_update.emit()
+        self._invalidate(self.instance_node)
+        self._notify('shape_update')
 
     def scale_around(self, center, scale):
         self._scale *= scale
         v = self.position - center
         self._position = v * scale + center
-        self.scale_node.notify_change()
-        self.cut_aff_node.notify_change()
-        self.part_aff_node.notify_change()
-        self.cut_pline_affine_node.notify_change()
-        self.shape_update.emit()
+        self._invalidate(self.instance_node, self.cut_aff_node,
+                         self.part_aff_node, self.cut_pline_affine_node,
+                         self.pierce_affine_node)
+        self._notify('shape_update')
 
     @property
     def exterior_clockwise(self):
@@ -205,9 +595,8 @@ class Job(QtCore.QObject):
     def exterior_clockwise(self, e):
         self._exterior_clockwise = e
         self.need_contour_transform = True
-        self.dir_node.notify_change()
-        self.shape_update.emit()
-        self.param_update.emit()
+        self._invalidate(self.instance_node)
+        self._notify('shape_update', 'param_update')
 
     @property
     def kerf_width(self):
@@ -215,9 +604,8 @@ class Job(QtCore.QObject):
     @kerf_width.setter
     def kerf_width(self, k):
         self._kerf_width = k
-        self.offset_node.notify_change()
-        self.shape_update.emit()
-        self.param_update.emit()
+        self._invalidate(self.instance_node)
+        self._notify('shape_update', 'param_update')
 
     @property
     def arc_voltage(self):
@@ -225,7 +613,7 @@ class Job(QtCore.QObject):
     @arc_voltage.setter
     def arc_voltage(self, v):
         self._arc_voltage = v
-        self.param_update.emit()
+        self._notify('param_update')
 
     @property
     def feedrate(self):
@@ -233,7 +621,7 @@ class Job(QtCore.QObject):
     @feedrate.setter
     def feedrate(self, f):
         self._feedrate = f
-        self.param_update.emit()
+        self._notify('param_update')
 
     @property
     def pierce_delay(self):
@@ -241,7 +629,7 @@ class Job(QtCore.QObject):
     @pierce_delay.setter
     def pierce_delay(self, d):
         self._pierce_delay = d
-        self.param_update.emit()
+        self._notify('param_update')
 
     @property
     def loop_radius(self):
@@ -249,114 +637,278 @@ class Job(QtCore.QObject):
     @loop_radius.setter
     def loop_radius(self, l):
         self._loop_radius = l
-        self.loop_node.notify_change()
-        self.shape_update.emit()
+        self._invalidate(self.instance_node)
+        self._notify('shape_update')
+
+    @property
+    def corner_cost(self):
+        return self._corner_cost
+    @corner_cost.setter
+    def corner_cost(self, c):
+        """Set mm of travel worth a radian of direction change at cut starts."""
+        self._corner_cost = c
+        self._invalidate(self.instance_node)
+        self._notify('param_update')
+
+    @property
+    def display_precision(self):
+        return self._display_precision
+    @display_precision.setter
+    def display_precision(self, p):
+        """Set tessellation precision of displayed paths in mm."""
+        if p == self._display_precision:
+            return
+        self._display_precision = p
+        self._invalidate(self.cut_gen_node, self.part_gen_node)
+        self._notify('shape_update')
 
     def set_lead_pos(self, index, pos):
+        """Start cut index at vertex pos, None to place it automatically."""
         self.lead_pos[index] = pos
-        self.shape_update.emit()
+        self._invalidate(self.instance_node)
+        self._notify('shape_update')
 
     def set_cut_state(self, index, state):
-        """Set state of a particular cut."""
+        """Set state of a particular cut, from any thread."""
         if state not in self._states:
             raise Exception('Unknown state ' + str(state) + '.')
-        self.cut_state[index] = state
-        self.state_update.emit()
-        self.shape_update.emit()
+        with self._state_lock:
+            # cuts may have been renumbered since the task was generated
+            if index >= self.cut_count:
+                return
+            self.cut_state[index] = state
+        self._notify('state_update', 'shape_update')
 
     def cut_state_index(self, state):
         """Return index of the first cut matching state, -1 otherwise."""
         if state not in self._states:
             raise Exception('Unknown state ' + str(state) + '.')
-        try:
-            index = self.cut_state.index(state)
-        except:
-            index = -1
+        with self._state_lock:
+            try:
+                index = self.cut_state.index(state)
+            except:
+                index = -1
         return index
 
     def cut_state_indices(self, state):
         """Return indices of cuts matching state."""
         if state not in self._states:
             raise Exception('Unknown state ' + str(state) + '.')
-        return [i for i, s in enumerate(self.cut_state) if s==state]
+        with self._state_lock:
+            return [i for i, s in enumerate(self.cut_state) if s==state]
+
+    def cut_states(self):
+        """Return a copy of cut states, from any thread."""
+        with self._state_lock:
+            return list(self.cut_state)
+
+    @property
+    def evaluation(self):
+        """Last completed background Evaluation, None before the first."""
+        return self._evaluation
+
+    def evaluate(self, version=None):
+        """Run the pipeline up to date unless a newer invalidation happens
+        in between two stages. Emit evaluation_ready and return True when
+        a result for version (default current one) is published.
+        """
+        with self._lock:
+            if version is None:
+                version = self._version
+            _running.outdated = lambda: version != self._version
+            try:
+                for node in self._stages:
+                    if version != self._version:
+                        return False
+                    self._apply_pending()
+                    node._update()
+            except EvaluationCancelled:
+                return False
+            finally:
+                _running.outdated = None
+            if self._evaluation is not None and self._evaluation.version == version:
+                return False
+            self._evaluation = Evaluation(version,
+                                          self.cut_aff_node._data,
+                                          self.part_aff_node._data,
+                                          self.cut_pline_affine_node._data)
+        self.evaluation_ready.emit()
+        return True
+
+    def _invalidate(self, *nodes, index=None):
+        with self._pending_lock:
+            self._pending += [(node, index) for node in nodes]
+            self._version += 1
+        with self._notify_lock:
+            self._evaluation_wanted = True
+        self._request_flush()
+
+    def _schedule(self, version):
+        QtCore.QThreadPool.globalInstance().start(EvaluationTask(self, version))
+
+    @contextmanager
+    def batch(self):
+        """Group changes so that they trigger a single evaluation and a
+        single emission of each signal.
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            self._request_flush()
+
+    def _notify(self, *names):
+        with self._notify_lock:
+            self._notified.update(names)
+        self._request_flush()
+
+    def _request_flush(self):
+        if self._batch_depth:
+            return
+        if QtCore.QCoreApplication.instance() is None:
+            self._flush()
+            return
+        with self._notify_lock:
+            if self._flush_requested:
+                return
+            self._flush_requested = True
+        QtCore.QMetaObject.invokeMethod(self, '_flush', QtCore.Qt.QueuedConnection)
+
+    @QtCore.pyqtSlot()
+    def _flush(self):
+        with self._notify_lock:
+            self._flush_requested = False
+            if self._batch_depth:
+                return
+            notified, self._notified = self._notified, set()
+            evaluate, self._evaluation_wanted = self._evaluation_wanted, False
+        if evaluate:
+            self._schedule(self._version)
+        for name in ('state_update', 'param_update', 'shape_update'):
+            if name in notified:
+                getattr(self, name).emit()
+
+    def _apply_pending(self):
+        with self._pending_lock:
+            pending, self._pending = self._pending, []
+        for node, index in pending:
+            if index is None:
+                node.notify_change()
+            else:
+                node.notify_change(index)
+
+    @QtCore.pyqtSlot()
+    def _on_evaluation_ready(self):
+        evaluation = self._evaluation
+        self._sync_cut_count(len(evaluation.cut_plines))
+
+    def _sync_cut_count(self, cut_count):
+        """Reset leads and states of cuts when their count changed, on the
+        job thread.
+        """
+        if cut_count == self.cut_count:
+            return
+        leads = self._instance_params()[-1]
+        with self._state_lock:
+            self.cut_count = cut_count
+            self.lead_pos = [None] * cut_count
+            self.cut_state = [self.TODO] * cut_count
+        if leads:
+            # leads were given for cuts that no longer exist
+            self._invalidate(self.instance_node)
+        self._notify('state_update')
+
+    def _pull(self, node):
+        """Return node data up to date, computed on the calling thread."""
+        with self._lock:
+            self._apply_pending()
+            data = node.data
+            counted = self.loop_node.up_to_date
+            cut_count = len(self.loop_node._data) if counted else None
+        if counted and QtCore.QThread.currentThread() is self.thread():
+            self._sync_cut_count(cut_count)
+        return data
+
+    def _scaled_exterior(self):
+        """Return (bounds, centroid) of the exterior in job frame, from the
+        source so that the pipeline is never waited for.
+        """
+        exterior = self._source[-1]
+        bounds = np.sort(exterior.bounds * self._scale, axis=0)
+        return bounds, exterior.centroid * self._scale
 
     def get_bounds(self):
-        return self.scale_node.data[-1].bounds
+        return self._scaled_exterior()[0]
 
     def get_size(self):
         bounds = self.get_bounds()
         return bounds[1] - bounds[0]
 
     def get_centroid(self):
-        rel_centroid = self.scale_node.data[-1].centroid
+        rel_centroid = self._scaled_exterior()[1]
         return np.dot(self.pos_rot_matrix(), np.append(rel_centroid, 1.))[:-1]
 
     def get_cut_count(self):
         return self.cut_count
 
     def get_shape_paths(self):
-        return self.part_aff_node.data
+        return self._pull(self.part_aff_node)
 
     def get_cut_paths(self):
-        return (self.cut_aff_node.data, self.cut_state)
+        return (self._pull(self.cut_aff_node), self.cut_states())
 
     def get_cut_plines(self):
-        return self.cut_pline_affine_node.data
+        return self._pull(self.cut_pline_affine_node)
 
-    def _apply_direction(self, polylines):
-        directed_polylines = []
-        for p in polylines[:-1]:
-            if p.is_ccw() != self._exterior_clockwise:
-                directed_polylines.append(p.reverse())
-            else:
-                directed_polylines.append(p)
-        exterior = polylines[-1]
-        if exterior.is_ccw() == self._exterior_clockwise:
-            directed_polylines.append(exterior.reverse())
-        else:
-            directed_polylines.append(exterior)
-        # print(directed_polylines[0].to_lines())
-        return directed_polylines
+    def get_pierces(self):
+        """Return (vertices, costs, pierce points) of each cut entry."""
+        return self._pull(self.pierce_affine_node)
 
-    def _apply_scale(self, polylines):
-        return [p.affine([0,0], 0, self._scale) for p in polylines]
+    def get_local_cut_plines(self):
+        """Return cut polylines in job frame, before position and angle."""
+        return self._pull(self.loop_node)
 
-    def _apply_offset(self, polylines):
-        offset_polylines = []
-        for p in polylines:
-            if p.is_closed():
-                offset_polylines += p.offset(self.kerf_width / 2)
-            else:
-                offset_polylines.append(p)
-        updated_cut_count = len(offset_polylines)
-        if updated_cut_count != self.cut_count:
-            self.cut_count = updated_cut_count
-            self.lead_pos = [0.] * self.cut_count
-            self.cut_state = [self.TODO] * self.cut_count
-        return offset_polylines
+    def _instance_params(self):
+        leads = tuple((i, p) for i, p in enumerate(self.lead_pos)
+                      if p is not None)
+        return (self._exterior_clockwise, float(self._scale),
+                float(self._kerf_width), float(self._loop_radius),
+                float(self._corner_cost), leads)
 
-    def _apply_lead(self, polylines):
-        return polylines
+    def _select_instance(self):
+        self._instance = geometry_instance(self._source, self._source_key,
+                                           self._instance_params(),
+                                           self._instance)
+        return self._instance
 
-    def _apply_loop(self, polylines):
-        return [p.loop(121*math.pi/180, self.kerf_width / 2, self._loop_radius)
-                for p in polylines]
+    def _instance_cut_plines(self, instance):
+        return instance.cut_plines()
 
-    def _generate(self, polylines):
-        return [p.to_lines() for p in polylines]
+    def _instance_pierces(self, polylines):
+        return self._instance.pierces()
 
-    def _generate_shape(self, polylines):
-        if len(polylines) > 1:
-            polylines = [p for p in polylines if p.is_closed()]
-        return self._generate(polylines)
+    def _instance_cut_paths(self, instance):
+        return instance.cut_paths(self._display_precision)
 
-    def _apply_affine(self, polylines):
-        return [np.dot(self.pos_rot_matrix(), np.insert(p, 2, 1., axis=0))[:-1]
-                for p in polylines]
+    def _instance_shape_paths(self, instance):
+        return instance.shape_paths(self._display_precision)
+
+    def _apply_affine(self, indices, paths):
+        data = np.insert(np.hstack(paths), 2, 1., axis=0)
+        data = np.dot(self.pos_rot_matrix(), data)[:-1]
+        sizes = [p.shape[1] for p in paths]
+        return np.split(data, np.cumsum(sizes)[:-1], axis=1)
+
+    def _apply_pline_affine(self, indices, polylines):
+        polyline_set = PolylineSet(polylines)
+        return polyline_set.affine(self._position, self._angle, 1.).polylines()
 
-    def _apply_pline_affine(self, polylines):
-        return [p.affine(self._position, self._angle, 1.) for p in polylines]
+    def _apply_pierce_affine(self, indices, pierces):
+        matrix = self.pos_rot_matrix()
+        return [(ids, costs, np.dot(matrix[:2,:2], points) + matrix[:2,2:])
+                for ids, costs, points in pierces]
 
     def is_closed(self):
-        polylines = self.root_node._data
+        polylines = self._source
         return len(polylines) != 1 or polylines[0].is_closed()
@@ -4,6 +4,9 @@ from PyQt5.QtCore import Qt
 from pyqtgraph import arrayToQPath
 import numpy as np
 
+import instrumentation
+from polyline import lod_precision
+
 class JobVisual(QtWidgets.QGraphicsPathItem):
     def __init__(self, controller, job):
         super().__init__()
@@ -22,8 +25,14 @@ class JobVisual(QtWidgets.QGraphicsPathItem):
 
         self.select_brush = QtGui.QBrush(QtGui.QColor(4, 200, 255, 200))
         self.unselect_brush = QtGui.QBrush(QtGui.QColor(4, 150, 255, 150))
-
-        self.job.shape_update.connect(self.on_job_shape_update)
+        self.collision_brush = QtGui.QBrush(QtGui.QColor(255, 40, 40, 150))
+        self.colliding = False
+
+        self.fill_path = QtGui.QPainterPath()
+        self.on_view_scale(self.controller.view.pixel_size())
+        # geometry is computed in background, keep drawing the last result
+        self.job.evaluation_ready.connect(self.on_job_shape_update)
+        self.job.state_update.connect(self.on_job_shape_update)
         self.on_job_shape_update()
 
         self.menu = QtGui.QMenu()
@@ -71,16 +80,30 @@ class JobVisual(QtWidgets.QGraphicsPathItem):
             ev.accept()
 
     def on_job_shape_update(self):
+        if instrumentation.enabled:
+            instrumentation.call(self.job.name, 'arrayToQPath', self._update_paths)
+        else:
+            self._update_paths()
+
+    def _update_paths(self):
+        evaluation = self.job.evaluation
+        if evaluation is None:
+            return
+
         data = np.empty((2,0), dtype=np.float)
         connect = np.empty(0, dtype=np.bool)
-        for path in self.job.get_shape_paths():
+        for path in evaluation.shape_paths:
             connected = np.ones(path.shape[1], dtype=np.bool)
             connected[-1] = False
             connect = np.concatenate((connect, connected))
             data = np.concatenate((data, path), axis=1)
         self.fill_path = arrayToQPath(data[0], data[1], connect)
 
-        paths, states = self.job.get_cut_paths()
+        paths = evaluation.cut_paths
+        states = self.job.cut_states()
+        if len(states) != len(paths):
+            # cut count changed since this evaluation
+            states = [self.job.TODO] * len(paths)
         self.pen_base.setWidthF(self.job.kerf_width)
         # set pen for boundingRect to take it into account
         self.setPen(self.pen_base)
@@ -97,16 +120,27 @@ class JobVisual(QtWidgets.QGraphicsPathItem):
         self.setPath(self.cut_paths[states[-1]]) # TODO should take ALL paths
 
         # TODO breaking encapsulation to refresh handle on kerf with update
-        self.controller.handle.update()
+        self.controller.handle.request_update()
+
+    def on_view_scale(self, pixel_size):
+        # differences under half a pixel are not visible
+        self.job.display_precision = lod_precision(pixel_size / 2)
 
     def on_job_settings(self):
         self.params_dialog.move(self.menu.pos())
         self.params_dialog.reset_params()
         self.params_dialog.exec_()
 
+    def set_colliding(self, colliding):
+        if colliding != self.colliding:
+            self.colliding = colliding
+            self.update()
+
     def paint(self, painter, option, widget):
         if self.job.is_closed():
-            if self.isSelected():
+            if self.colliding:
+                painter.fillPath(self.fill_path, self.collision_brush)
+            elif self.isSelected():
                 painter.fillPath(self.fill_path, self.select_brush)
             else:
                 painter.fillPath(self.fill_path, self.unselect_brush)
@@ -187,6 +221,13 @@ class JobParamDialog(QtWidgets.QDialog):
         self.loop_radius_spbox.setSuffix("mm")
         form.addRow("Loop radius",self.loop_radius_spbox)
 
+        self.corner_cost_spbox = QtGui.QDoubleSpinBox()
+        self.corner_cost_spbox.setRange(0, 1000)
+        self.corner_cost_spbox.setValue(self.job.corner_cost)
+        self.corner_cost_spbox.setSingleStep(5)
+        self.corner_cost_spbox.setSuffix("mm/rad")
+        form.addRow("Corner cost",self.corner_cost_spbox)
+
         layout = QtGui.QVBoxLayout()
         layout.addWidget(name_label)
         layout.addLayout(form)
@@ -200,20 +241,16 @@ class JobParamDialog(QtWidgets.QDialog):
         self.pierce_delay_spbox.setValue(self.job.pierce_delay)
         self.kerf_width_spbox.setValue(self.job.kerf_width)
         self.loop_radius_spbox.setValue(self.job.loop_radius)
+        self.corner_cost_spbox.setValue(self.job.corner_cost)
 
     def accept(self):
-        # TODO ugly way to avoid multiple signals (break encapsulation)
-        self.job.blockSignals(True)
-
-        self.job.exterior_clockwise = self.cut_direction_checkbox.isChecked()
-        self.job.feedrate = self.feedrate_spbox.value()
-        self.job.arc_voltage = self.arc_voltage_spbox.value()
-        self.job.pierce_delay = self.pierce_delay_spbox.value()
-        self.job.kerf_width = self.kerf_width_spbox.value()
-        self.job.loop_radius = self.loop_radius_spbox.value()
-
-        self.job.blockSignals(False)
-        self.job.shape_update.emit()
-        self.job.param_update.emit()
+        with self.job.batch():
+            self.job.exterior_clockwise = self.cut_direction_checkbox.isChecked()
+            self.job.feedrate = self.feedrate_spbox.value()
+            self.job.arc_voltage = self.arc_voltage_spbox.value()
+            self.job.pierce_delay = self.pierce_delay_spbox.value()
+            self.job.kerf_width = self.kerf_width_spbox.value()
+            self.job.loop_radius = self.loop_radius_spbox.value()
+            self.job.corner_cost = self.corner_cost_spbox.value()
 
         super().accept()
@@ -4,57 +4,172 @@ from PyQt5 import QtCore, QtWidgets
 import pyqtgraph as pg
 import numpy as np
 import serial
+from asynccontroller import AsyncController
 from controllerbase import ControllerBase, ControllerUIBase, InputDecisionTree
+from job import JobTask
 
+import os
 import queue
+import threading
+import tty
+
+def decimate(data, width):
+    """Return (x, samples) of data, (n, k) samples, reduced to the min and
+    max of width buckets of consecutive samples so that no spike is lost.
+    Bucket sizes differ by one at most, every sample falls in one of them.
+    samples never share memory with data.
+    """
+    n = data.shape[0]
+    if n <= 2 * width:
+        return np.arange(n), data.copy()
+    edges = np.linspace(0, n, width + 1).astype(int)
+    x = np.repeat((edges[:-1] + edges[1:] - 1) / 2, 2)
+    return x, _reduce(data, data, edges)
+
+def _reduce(lows, highs, edges):
+    """Return min of lows and max of highs between consecutive edges,
+    interleaved.
+    """
+    samples = np.empty((2 * (edges.size - 1), lows.shape[1]))
+    samples[0::2] = np.minimum.reduceat(lows, edges[:-1])
+    samples[1::2] = np.maximum.reduceat(highs, edges[:-1])
+    return samples
 
 class QTHCLogger(QtCore.QObject):
+    """Last capacity THC samples (z position, arc voltage, speed).
+
+    Samples go to a ring buffer written twice, capacity rows apart, so that
+    the last samples in arrival order are always a contiguous slice of it
+    and can be viewed without copy. Views see later samples overwrite the
+    oldest ones. The min and max of every BLOCK samples are kept the same
+    way, for envelopes of long histories.
+
+    Readers poll version, thc_update is only emitted when samples are
+    cleared, which may happen on another thread than logging.
+    """
+    BLOCK = 64
     thc_update = QtCore.pyqtSignal()
-    def __init__(self):
+    def __init__(self, capacity=1000):
         super().__init__()
-        self.thc_data = np.zeros((1000, 3))
+        self._lock = threading.Lock()
+        self._capacity = capacity
+        self._buffer = np.zeros((2 * capacity, 3))
+        self._index = 0
+        self._blocks = capacity // self.BLOCK
+        self._block_buffer = np.zeros((2 * self._blocks, 2, 3))
+        self._block_index = 0
+        self._written = 0
+        self.count = 0
+        # bumped by every change, to tell new data
+        self.version = 0
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def thc_data(self):
+        """Return capacity samples, oldest first, zeros before the first."""
+        return self.view()
+
+    def view(self, n=None):
+        """Return the last n samples, oldest first, all of them if None."""
+        if n is None:
+            n = self._capacity
+        end = self._index + self._capacity
+        return self._buffer[end-min(n, self._capacity):end]
+
+    def envelope(self, width):
+        """Return (x, samples) of thc_data decimated to width min and max
+        pairs, plus one for samples outside whole blocks at each end, x
+        being positions in thc_data.
+        """
+        with self._lock:
+            if self._capacity < 4 * width * self.BLOCK:
+                return decimate(self.view(), width)
+            tail = self._written % self.BLOCK
+            nb_blocks = min(self._blocks, (self._capacity - tail) // self.BLOCK)
+            start = self._capacity - tail - nb_blocks * self.BLOCK
+            end = self._block_index + self._blocks
+            blocks = self._block_buffer[end-nb_blocks:end]
+            edges = np.linspace(0, nb_blocks, width + 1).astype(int)
+            samples = _reduce(blocks[:,0], blocks[:,1], edges)
+            x = start + ((edges[:-1] + edges[1:]) * self.BLOCK - 1) / 2
+            x = np.repeat(x, 2)
+            # samples older than the first whole block, then those of the
+            # block being filled
+            data = self.view()
+            head, last = data[:start], data[self._capacity-tail:]
+            if start:
+                x = np.concatenate(([(start - 1) / 2] * 2, x))
+                samples = np.vstack((head.min(axis=0), head.max(axis=0),
+                                     samples))
+            if tail:
+                x = np.append(x, [self._capacity - (tail + 1) / 2] * 2)
+                samples = np.vstack((samples, last.min(axis=0),
+                                     last.max(axis=0)))
+            return x, samples
 
     def log_thc_data(self, z_pos, arc_v, speed):
-        self.thc_data[:-1] = self.thc_data[1:]
-        self.thc_data[-1] = np.array([z_pos, arc_v, speed])
+        with self._lock:
+            i = self._index
+            self._buffer[i] = self._buffer[i + self._capacity] = (z_pos, arc_v,
+                                                                  speed)
+            self._index = (i + 1) % self._capacity
+            self._written += 1
+            if self._blocks and self._written % self.BLOCK == 0:
+                block = self.view(self.BLOCK)
+                j = self._block_index
+                self._block_buffer[j,0] = \
+                    self._block_buffer[j + self._blocks,0] = block.min(axis=0)
+                self._block_buffer[j,1] = \
+                    self._block_buffer[j + self._blocks,1] = block.max(axis=0)
+                self._block_index = (j + 1) % self._blocks
+            self.count = min(self.count + 1, self._capacity)
+            self.version += 1
+
+    def clear(self):
+        with self._lock:
+            self._buffer[:] = 0.
+            self._index = 0
+            self._block_buffer[:] = 0.
+            self._block_index = 0
+            self._written = 0
+            self.count = 0
+            self.version += 1
         self.thc_update.emit()
 
-class KlipperController(ControllerBase):
-    def __init__(self, project, post_processor):
-        super().__init__(project, post_processor)
-        self.serial = serial.Serial()
-        self.thc_logger = QTHCLogger()
-        self.klipper_busy = False
+class KlipperProtocol:
+    """Klipper replies parsing, shared by the threaded and asyncio
+    controllers.
+    """
+    # klipper answers each line once queued, moves queue in its look-ahead
+    window_commands = 16
+    window_bytes = 1024
+    printer_path = '/tmp/printer'
+    # THC samples kept, enough for a whole cut when raised
+    thc_capacity = 1000
 
+    def _init_protocol(self):
+        self.thc_logger = QTHCLogger(self.thc_capacity)
         self.input_parser = InputDecisionTree()
         self.input_parser.append_node('ok', self._process_ok)
         self.input_parser.append_node('!!', self._process_error)
         self.input_parser.append_node('// echo: THC_error', self._process_thc)
 
-    def _link_open(self, *args, **kwargs):
-        self.serial = serial.Serial('/tmp/printer', timeout=0.2)
-
-    def _link_close(self):
-        self.serial.close()
-
-    def _link_read(self):
-        return self.serial.readline().decode('ascii')
-
-    def _link_send(self, cmd):
-        self.serial.write((cmd + '\n').encode('ascii'))
-        self.klipper_busy = True
-
-    def _link_busy(self):
-        return self.klipper_busy
-
     def _process_input(self, input):
         self.input_parser.process_input(input)
 
+    def _task_started(self, task):
+        # THC samples are plotted from the start of the running cut
+        if isinstance(task, JobTask):
+            self.thc_logger.clear()
+
     def _process_ok(self, input):
         self._complete_cmd()
-        self.klipper_busy = False
 
     def _process_error(self, input):
+        # the failed command is still answered by an ok
         self._abort_internal(input)
 
     def _process_thc(self, input):
@@ -68,7 +183,39 @@ class KlipperController(ControllerBase):
         else:
             self.thc_logger.log_thc_data(z_pos, arc_v, speed)
 
+class KlipperController(KlipperProtocol, ControllerBase):
+    def __init__(self, project, post_processor):
+        super().__init__(project, post_processor)
+        self.serial = serial.Serial()
+        self._init_protocol()
+
+    def _link_open(self, *args, **kwargs):
+        self.serial = serial.Serial(self.printer_path, timeout=0.2)
+
+    def _link_close(self):
+        self.serial.close()
+
+    def _link_read(self):
+        return self.serial.readline().decode('ascii')
+
+    def _link_send(self, cmd):
+        self.serial.write((cmd + '\n').encode('ascii'))
+
+class AsyncKlipperController(KlipperProtocol, AsyncController):
+    def __init__(self, project, post_processor):
+        super().__init__(project, post_processor)
+        self._init_protocol()
+
+    def _link_open(self, *args, **kwargs):
+        fd = os.open(self.printer_path, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        tty.setraw(fd)
+        return fd
+
 class THCWidget(pg.PlotWidget):
+    """THC curves redrawn at most FPS times per second, when samples
+    arrived or the plot was resized.
+    """
+    FPS = 30
     def __init__(self, thc_logger):
         super().__init__()
         self.thc_logger = thc_logger
@@ -79,16 +226,26 @@ class THCWidget(pg.PlotWidget):
         self.z_pos_curve = pg.PlotCurveItem([], [], pen=pg.mkPen(color=(87, 200, 34), width=1))
         self.arc_v_curve = pg.PlotCurveItem([], [], pen=pg.mkPen(color=(255, 87, 34), width=1))
         self.speed_curve = pg.PlotCurveItem([], [], pen=pg.mkPen(color=(34, 120, 255), width=1))
+        self._drawn = None
         self.on_thc_data()
         self.addItem(self.z_pos_curve)
         self.addItem(self.arc_v_curve)
         self.addItem(self.speed_curve)
         self.thc_logger.thc_update.connect(self.on_thc_data)
+        self.timer = QtCore.QTimer(self)
+        self.timer.timeout.connect(self.on_thc_data)
+        self.timer.start(1000 // self.FPS)
 
     def on_thc_data(self):
-        self.z_pos_curve.setData(self.thc_logger.thc_data[:,0])
-        self.arc_v_curve.setData(self.thc_logger.thc_data[:,1])
-        self.speed_curve.setData(self.thc_logger.thc_data[:,2])
+        width = max(int(self.getViewBox().width()), 1)
+        drawn = (self.thc_logger.version, width)
+        if drawn == self._drawn:
+            return
+        self._drawn = drawn
+        x, samples = self.thc_logger.envelope(width)
+        self.z_pos_curve.setData(x, samples[:,0])
+        self.arc_v_curve.setData(x, samples[:,1])
+        self.speed_curve.setData(x, samples[:,2])
 
 class KlipperControllerUI(ControllerUIBase):
     def __init__(self, controller):
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Pierce points of closed cuts.
+
+A closed cut is pierced in scrap, at the end of a straight lead-in going to
+the vertex where the cut starts. Candidate vertices are scored by how sharp
+the contour turns around them and by the room the lead-in has. The distance
+from the previous cut is added when cuts are sequenced.
+"""
+import math
+import numpy as np
+
+import polyline as pl
+
+# mm from pierce point to cut start
+LEAD_LENGTH = 5.
+# lead-in lengths tried, as fractions of LEAD_LENGTH, longest first
+LEAD_SCALES = (1., .5, .25)
+# default mm of travel worth avoiding a radian of direction change at the
+# start, a job parameter
+CORNER_COST = 50.
+# mm of travel worth a full length lead-in over the shortest one
+SHORT_LEAD_COST = 10.
+# candidates kept per cut, spread along it
+MAX_CANDIDATES = 32
+
+def candidates(polyline, scrap_left, manual=None, corner_cost=CORNER_COST):
+    """Return (vertices, costs, pierces) of the entries of polyline, pierces
+    being the (2, n) pierce points of vertices. Scrap is on the left of the
+    cut way if scrap_left. An open polyline is pierced at its start, manual
+    forces the entry vertex of a closed one. corner_cost is the mm of travel
+    worth a radian of direction change at the start.
+    """
+    vertices = polyline.raw
+    if not polyline.is_closed():
+        return np.array([0]), np.array([0.]), vertices[:2,:1].copy()
+
+    corners, normals = _corners(vertices, scrap_left)
+    if manual is not None:
+        ids = np.array([manual % vertices.shape[1]])
+    else:
+        ids = _spread(corners, MAX_CANDIDATES)
+    starts = vertices[:2,ids]
+    scales = _lead_scales(polyline, starts, normals[:,ids])
+    feasible = scales > 0
+    if manual is None and np.any(feasible):
+        ids, starts, scales = ids[feasible], starts[:,feasible], scales[feasible]
+    pierces = starts + normals[:,ids] * scales * LEAD_LENGTH
+    costs = corner_cost * corners[ids] + SHORT_LEAD_COST * (1. - scales)
+    return ids, costs, pierces
+
+def _corners(vertices, scrap_left):
+    """Return direction change within LEAD_LENGTH along the contour around
+    each vertex, and the unit normal toward scrap at each vertex.
+    """
+    a = vertices[:2]
+    b = np.roll(a, -1, axis=1)
+    chord = b - a
+    length = np.hypot(*chord)
+    angle = np.arctan2(chord[1], chord[0])
+    sweep = 4 * np.arctan(vertices[2])
+    start = angle - sweep / 2
+    end = angle + sweep / 2
+    # turn at vertex k, from the end of segment k-1 to the start of segment k
+    turn = np.abs((start - np.roll(end, 1) + math.pi) % (2 * math.pi) - math.pi)
+
+    # cumulated turn along the contour, stepping at vertices and growing
+    # along arcs, repeated over three laps for windows crossing the start
+    arc = np.abs(sweep) > 1e-9
+    length = np.where(arc, length * sweep / (2 * np.sin(np.where(arc, sweep, 1.) / 2)),
+                      length)
+    s = np.concatenate(([0.], np.cumsum(length)))
+    total = np.concatenate(([0.], np.cumsum(turn + np.abs(sweep))))
+    xp = np.concatenate((np.repeat(s[:-1], 2), s[-1:]))
+    fp = np.concatenate((np.dstack((total[:-1], total[:-1] + turn)).ravel(),
+                         total[-1:]))
+    xp = np.concatenate((xp[:-1] - s[-1], xp[:-1], xp + s[-1]))
+    fp = np.concatenate((fp[:-1] - total[-1], fp[:-1], fp + total[-1]))
+    window = min(LEAD_LENGTH, s[-1] / 2)
+    corners = (np.interp(s[:-1] + window, xp, fp) -
+               np.interp(s[:-1] - window, xp, fp))
+
+    tangent = (np.vstack((np.cos(np.roll(end, 1)), np.sin(np.roll(end, 1)))) +
+               np.vstack((np.cos(start), np.sin(start))))
+    cusp = np.hypot(*tangent) < 1e-9
+    tangent[:,cusp] = np.vstack((np.cos(start[cusp]), np.sin(start[cusp])))
+    tangent /= np.hypot(*tangent)
+    normals = np.vstack((-tangent[1], tangent[0]))
+    if not scrap_left:
+        normals = -normals
+    return corners, normals
+
+def _spread(costs, count):
+    """Return indices of the lowest costs in count runs of consecutive
+    vertices.
+    """
+    n = costs.size
+    if n <= count:
+        return np.arange(n)
+    runs = np.arange(n) * count // n
+    order = np.lexsort((costs, runs))
+    _, firsts = np.unique(runs[order], return_index=True)
+    return order[firsts]
+
+def _lead_scales(polyline, starts, normals):
+    """Return the longest lead scale of each start whose pierce point keeps
+    half the lead length away from the contour, 0 when none does.
+    """
+    lines = polyline.to_lines(pl.lod_precision(LEAD_LENGTH / 20))
+    a = lines
+    b = np.roll(lines, -1, axis=1)
+    ab = b - a
+    ab_sq = np.maximum(np.sum(ab**2, axis=0), 1e-18)
+    scales = np.zeros(starts.shape[1])
+    for chunk in range(0, starts.shape[1], 64):
+        s = slice(chunk, chunk + 64)
+        found = np.zeros(starts[:,s].shape[1], dtype=bool)
+        for scale in LEAD_SCALES:
+            p = starts[:,s] + normals[:,s] * scale * LEAD_LENGTH
+            ap = p[:,:,None] - a[:,None,:]
+            t = np.clip(np.sum(ap * ab[:,None,:], axis=0) / ab_sq, 0., 1.)
+            d = ap - t * ab[:,None,:]
+            clearance = np.min(np.sum(d**2, axis=0), axis=1)
+            ok = ~found & (clearance >= (scale * LEAD_LENGTH / 2)**2)
+            scales[s][ok] = scale
+            found |= ok
+    return scales
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Automatic placement of jobs on a sheet.
+
+Parts and sheet are rasterized. For a pair of parts at given rotations, the
+no-fit map is the set of offsets where their masks overlap, computed once by
+correlation and cached. A part placement takes the union of the no-fit maps
+of the parts already placed and the first free offset, scanning rows then
+columns from the sheet origin. A genetic search over placement order and
+part rotations runs in every process of a pool until a time budget, the
+best layout is kept.
+"""
+import math
+import os
+import random
+import time
+
+import numpy as np
+
+import polyline as pl
+import workers
+from job import source_key
+
+# mm per pixel of the rasters
+RESOLUTION = 2.
+# number of rotations tried per part, evenly spaced over a turn
+ROTATIONS = 4
+POPULATION = 16
+MUTATION_RATE = 0.2
+
+def rect_sheet(x, y, width, height):
+    """Return a closed polyline of a rectangular sheet."""
+    return pl.Polyline([[x, x + width, x + width, x],
+                        [y, y, y + height, y + height],
+                        [0, 0, 0, 0]], True)
+
+def nest(jobs, sheet, rotations=ROTATIONS, resolution=RESOLUTION, spacing=0.,
+         time_budget=10., processes=None):
+    """Return for each job an (angle, position) placing it on the closed
+    polyline sheet without overlap, None when it does not fit. Parts are
+    the cut contours of jobs, kerf included, kept spacing mm apart.
+    processes=0 searches in the calling process.
+    """
+    if not jobs:
+        return []
+    angles = [2 * math.pi * k / rotations for k in range(rotations)]
+    sheet_origin, sheet_mask = _sheet_raster(sheet, resolution)
+    parts, kinds = [], []
+    for job in jobs:
+        plines = job.get_local_cut_plines()
+        parts.append(_part_rasters(plines, angles, resolution, spacing))
+        # copies of a part share their no-fit maps
+        kinds.append(source_key(plines))
+    masks = [[mask for _, mask in part] for part in parts]
+
+    deadline = time.time() + time_budget
+    args = (masks, kinds, sheet_mask, deadline)
+    if processes == 0:
+        results = [_search(*args, seed=0)]
+    else:
+        nb = processes or os.cpu_count()
+        futures = [workers.pool().submit(_search, *args, seed=s) for s in range(nb)]
+        results = [f.result() for f in futures]
+    _, layout = min(results, key=lambda r: r[0])
+
+    placements = []
+    for part, place in zip(parts, layout):
+        if place is None:
+            placements.append(None)
+            continue
+        rotation, i, j = place
+        corner = sheet_origin + np.array([j, i]) * resolution
+        local_min, _ = part[rotation]
+        placements.append((angles[rotation], corner - local_min))
+    return placements
+
+def apply(jobs, placements):
+    """Move jobs to their placements, jobs without one are left alone."""
+    for job, placement in zip(jobs, placements):
+        if placement is not None:
+            with job.batch():
+                job.angle, job.position = placement
+
+# RASTERS ######################################################################
+def _contours(plines, precision):
+    closed = [p.to_lines(precision) for p in plines if p.is_closed()]
+    opened = [p.to_lines(precision) for p in plines if not p.is_closed()]
+    return closed, opened
+
+def _fill(mask, origin, resolution, polygons):
+    """Set cells of mask whose center is inside one of polygons, (2, n)
+    point arrays.
+    """
+    h, w = mask.shape
+    rows = origin[1] + (np.arange(h) + .5) * resolution
+    for points in polygons:
+        a = points
+        b = np.roll(points, -1, axis=1)
+        # edges crossing each row center line, half open so that vertices
+        # on the line count once
+        crossing = (a[1][:,None] <= rows) != (b[1][:,None] <= rows)
+        e, r = np.nonzero(crossing)
+        t = (rows[r] - a[1,e]) / (b[1,e] - a[1,e])
+        x = a[0,e] + t * (b[0,e] - a[0,e])
+        cols = np.clip(np.ceil((x - origin[0]) / resolution - .5), 0, w)
+        toggles = np.zeros((h, w + 1), dtype=int)
+        np.add.at(toggles, (r, cols.astype(int)), 1)
+        mask |= (np.cumsum(toggles, axis=1)[:,:w] % 2).astype(bool)
+
+def _stroke(mask, origin, resolution, paths, reach=0.):
+    """Set cells of mask within reach of paths, (2, n) point arrays, reach
+    being at most a quarter of resolution.
+    """
+    h, w = mask.shape
+    step = resolution / 4
+    # a box around each sample, as wide as the samples gap plus twice reach,
+    # touches two cells at most on each axis, those of its corners
+    half = step / 2 + reach
+    corners = np.array([[-half, -half, half, half], [-half, half, -half, half]])
+    for points in paths:
+        a, b = points[:,:-1], points[:,1:]
+        steps = np.ceil(np.hypot(*(b - a)) / step).astype(int) + 1
+        t = np.concatenate([np.linspace(0, 1, s) for s in steps])
+        starts = np.repeat(a, steps, axis=1)
+        ends = np.repeat(b, steps, axis=1)
+        samples = starts + (ends - starts) * t
+        for corner in corners.T:
+            cells = np.floor((samples + corner[:,None] - origin[:,None]) /
+                             resolution).astype(int)
+            cells[0] = np.clip(cells[0], 0, w - 1)
+            cells[1] = np.clip(cells[1], 0, h - 1)
+            mask[cells[1],cells[0]] = True
+
+def _dilate(mask, radius):
+    if radius <= 0:
+        return mask
+    h, w = mask.shape
+    padded = np.pad(mask, radius)
+    dilated = np.zeros_like(padded)
+    for di in range(2 * radius + 1):
+        for dj in range(2 * radius + 1):
+            dilated[di:di+h,dj:dj+w] |= mask
+    return dilated
+
+def _part_rasters(plines, angles, resolution, spacing):
+    """Return (local_min, mask) for each angle, mask covering every cell the
+    part rotated by angle touches and local_min the corner of the first
+    cell in the rotated part frame.
+    """
+    # tessellations stray from arcs by precision at most
+    precision = pl.lod_precision(resolution / 4)
+    closed, opened = _contours(plines, precision)
+    margin = int(math.ceil(spacing / resolution))
+    rasters = []
+    for angle in angles:
+        cos, sin = math.cos(angle), math.sin(angle)
+        rot = np.array([[cos, -sin], [sin, cos]])
+        rot_closed = [rot.dot(p) for p in closed]
+        rot_opened = [rot.dot(p) for p in opened]
+        points = np.hstack(rot_closed + rot_opened)
+        local_min = np.min(points, axis=1) - precision
+        size = np.max(points, axis=1) + precision - local_min
+        w, h = np.floor(size / resolution).astype(int) + 1
+        mask = np.zeros((h, w), dtype=bool)
+        _fill(mask, local_min, resolution, rot_closed)
+        _stroke(mask, local_min, resolution,
+                [np.hstack((p, p[:,:1])) for p in rot_closed] + rot_opened,
+                precision)
+        mask = _dilate(mask, margin)
+        rasters.append((local_min - margin * resolution, mask))
+    return rasters
+
+def _sheet_raster(sheet, resolution):
+    """Return (origin, mask) of the sheet, mask being True on the cells a
+    part may not cover.
+    """
+    bounds = sheet.bounds
+    origin = bounds[0]
+    w, h = np.floor((bounds[1] - bounds[0]) / resolution).astype(int)
+    vertices = sheet.raw
+    rectangle = (vertices.shape[1] == 4 and not np.any(vertices[2]) and
+                 np.all(np.isclose(vertices[:2], bounds[0][:,None]) |
+                        np.isclose(vertices[:2], bounds[1][:,None])))
+    if rectangle:
+        return origin, np.zeros((h, w), dtype=bool)
+    precision = pl.lod_precision(resolution / 4)
+    path = sheet.to_lines(precision)
+    inside = np.zeros((h, w), dtype=bool)
+    _fill(inside, origin, resolution, [path])
+    # cells partially outside are forbidden
+    outside = np.zeros((h, w), dtype=bool)
+    _stroke(outside, origin, resolution, [np.hstack((path, path[:,:1]))],
+            precision)
+    return origin, ~inside | outside
+# !RASTERS #####################################################################
+
+# PLACEMENT ####################################################################
+def _correlate(a, b):
+    """Return map of offsets of b relative to a, shifted by b shape - 1,
+    where their True cells overlap.
+    """
+    shape = (a.shape[0] + b.shape[0] - 1, a.shape[1] + b.shape[1] - 1)
+    fa = np.fft.rfft2(a.astype(float), shape)
+    fb = np.fft.rfft2(b[::-1,::-1].astype(float), shape)
+    return np.fft.irfft2(fa * fb, shape) > .5
+
+class _Placer:
+    """Bottom left placement of parts with cached no-fit maps."""
+    def __init__(self, masks, kinds, sheet_mask):
+        self.masks = masks
+        self.kinds = kinds
+        self.sheet_mask = sheet_mask
+        self.sheet_free = not np.any(sheet_mask)
+        self.nfps = {}
+        self.ifps = {}
+
+    def _nfp(self, a, ra, b, rb):
+        key = (self.kinds[a], ra, self.kinds[b], rb)
+        nfp = self.nfps.get(key)
+        if nfp is None:
+            nfp = self.nfps[key] = _correlate(self.masks[a][ra],
+                                              self.masks[b][rb])
+        return nfp
+
+    def _ifp(self, b, rb):
+        """Return map of positions of part b where it leaves the sheet."""
+        key = (self.kinds[b], rb)
+        ifp = self.ifps.get(key)
+        if ifp is None:
+            H, W = self.sheet_mask.shape
+            h, w = self.masks[b][rb].shape
+            if h > H or w > W:
+                ifp = None
+            elif self.sheet_free:
+                ifp = np.zeros((H - h + 1, W - w + 1), dtype=bool)
+            else:
+                full = _correlate(self.sheet_mask, self.masks[b][rb])
+                ifp = full[h-1:H,w-1:W]
+            self.ifps[key] = ifp
+        return ifp
+
+    def place(self, order, rotations):
+        """Return (fitness, layout), layout giving (rotation, row, column) of
+        each part or None, and fitness the unplaced area then the rows and
+        columns used, lower being better.
+        """
+        layout = [None] * len(self.masks)
+        placed = []
+        unplaced, used_rows, used_cols = 0, 0, 0
+        for b in order:
+            rb = rotations[b]
+            h, w = self.masks[b][rb].shape
+            ifp = self._ifp(b, rb)
+            if ifp is None:
+                unplaced += int(np.count_nonzero(self.masks[b][rb]))
+                continue
+            forbidden = ifp.copy()
+            H, W = forbidden.shape
+            for a, ra, i, j in placed:
+                nfp = self._nfp(a, ra, b, rb)
+                # nfp cell (di, dj) is b at (i + di - h + 1, j + dj - w + 1)
+                i0, j0 = i - h + 1, j - w + 1
+                top, left = max(i0, 0), max(j0, 0)
+                bottom = min(i0 + nfp.shape[0], H)
+                right = min(j0 + nfp.shape[1], W)
+                if top < bottom and left < right:
+                    forbidden[top:bottom,left:right] |= \
+                        nfp[top-i0:bottom-i0,left-j0:right-j0]
+            first = int(np.argmin(forbidden))
+            i, j = divmod(first, W)
+            if forbidden[i,j]:
+                unplaced += int(np.count_nonzero(self.masks[b][rb]))
+                continue
+            layout[b] = (rb, i, j)
+            placed.append((b, rb, i, j))
+            used_rows = max(used_rows, i + h)
+            used_cols = max(used_cols, j + w)
+        return (unplaced, used_rows, used_cols), layout
+# !PLACEMENT ###################################################################
+
+# SEARCH #######################################################################
+def _search(masks, kinds, sheet_mask, deadline, seed):
+    """Genetic search of placement order and rotations until deadline, return
+    the best (fitness, layout).
+    """
+    rng = random.Random(seed)
+    placer = _Placer(masks, kinds, sheet_mask)
+    n = len(masks)
+    nb_rotations = len(masks[0])
+    areas = [int(np.count_nonzero(m[0])) for m in masks]
+
+    # largest parts first is a good start, others are mutations of it
+    order = sorted(range(n), key=lambda k: -areas[k])
+    start = (order, [0] * n)
+    population = [start] + [_mutate(rng, start, nb_rotations, 1.)
+                            for k in range(POPULATION - 1)]
+    if seed:
+        population[0] = _mutate(rng, start, nb_rotations, 1.)
+    scored = [(placer.place(*c), c) for c in population]
+    while time.time() < deadline:
+        scored.sort(key=lambda s: s[0][0])
+        parents = scored[:POPULATION // 2]
+        children = []
+        while len(children) < POPULATION - len(parents):
+            a = min(rng.sample(parents, 2), key=lambda s: s[0][0])[1]
+            b = min(rng.sample(parents, 2), key=lambda s: s[0][0])[1]
+            child = _mutate(rng, _crossover(rng, a, b), nb_rotations,
+                            MUTATION_RATE)
+            children.append((placer.place(*child), child))
+            if time.time() >= deadline:
+                break
+        scored = parents + children
+    return min((s[0] for s in scored), key=lambda r: r[0])
+
+def _crossover(rng, a, b):
+    """Order crossover of placement orders, uniform of rotations."""
+    n = len(a[0])
+    i, j = sorted(rng.sample(range(n + 1), 2))
+    kept = a[0][i:j]
+    kept_set = set(kept)
+    rest = [k for k in b[0] if k not in kept_set]
+    order = rest[:i] + kept + rest[i:]
+    rotations = [ra if rng.random() < .5 else rb
+                 for ra, rb in zip(a[1], b[1])]
+    return order, rotations
+
+def _mutate(rng, chromosome, nb_rotations, rate):
+    order, rotations = list(chromosome[0]), list(chromosome[1])
+    n = len(order)
+    for k in range(n):
+        if rng.random() < rate / 2 and n > 1:
+            m = min(k + 1, n - 1) if rng.random() < .5 else rng.randrange(n)
+            order[k], order[m] = order[m], order[k]
+        if rng.random() < rate / 2:
+            rotations[order[k]] = rng.randrange(nb_rotations)
+    return order, rotations
+# !SEARCH ######################################################################
@@ -1,19 +1,29 @@
 #!/usr/bin/env python3
+from collections import OrderedDict
 from copy import copy
+import hashlib
 import math
+import threading
 import numpy as np
 
-# required by aggregate
-from random import shuffle
-
-from geomdl import BSpline
 from geomdl import utilities
+import instrumentation
 from polylineinterface import PolylineInterface
 
 import cavaliercontours as cavc
 
 from shapely.geometry.polygon import Polygon, LineString
 
+# Tessellation precisions (mm) available to display, finest first.
+LOD_PRECISIONS = (1e-3, 1e-2, 1e-1, 1.)
+# Number of tessellations kept per polyline.
+LOD_CACHE_SIZE = 2
+
+def lod_precision(tolerance):
+    """Return the coarsest level of detail precision within tolerance."""
+    levels = [p for p in LOD_PRECISIONS if p <= tolerance]
+    return levels[-1] if levels else LOD_PRECISIONS[0]
+
 class Polyline(PolylineInterface):
     def __init__(self, vertices, closed):
         vertices = np.array(vertices) # NOTE this create a copy
@@ -36,7 +46,8 @@ class Polyline(PolylineInterface):
         object._closed = closed
         object._cavc_up_to_date = False
         object._shapely_up_to_date = False
-        object._lines_up_to_date = False
+        object._geometry_up_to_date = False
+        object._lines = OrderedDict()
         return object
 
     def _update_cavc(self):
@@ -44,6 +55,26 @@ class Polyline(PolylineInterface):
             self._cavc_pline = cavc.Polyline(self._vertices, self._closed)
             self._cavc_up_to_date = True
 
+    def _update_geometry(self):
+        if not self._geometry_up_to_date:
+            vertices = np.asarray(self._vertices, dtype=float)
+            a, b, bulge = _segment_table(vertices, self._closed)
+            area, moment, length, length_moment = _segment_moments(a, b, bulge)
+            self._area = np.sum(area) if self._closed else 0.
+            if self._area != 0:
+                self._centroid = np.sum(moment, axis=1) / self._area
+            elif np.sum(length) > 0:
+                self._centroid = np.sum(length_moment, axis=1) / np.sum(length)
+            else:
+                self._centroid = np.mean(vertices[:2], axis=1)
+            lo, hi = _segment_extents(a, b, bulge)
+            lo = np.minimum(np.min(lo, axis=1, initial=np.inf),
+                            np.min(vertices[:2], axis=1, initial=np.inf))
+            hi = np.maximum(np.max(hi, axis=1, initial=-np.inf),
+                            np.max(vertices[:2], axis=1, initial=-np.inf))
+            self._bounds = np.array([lo, hi])
+            self._geometry_up_to_date = True
+
     def _update_shapely(self):
         if not self._shapely_up_to_date:
             if self.is_closed():
@@ -52,61 +83,6 @@ class Polyline(PolylineInterface):
                 self._shapely = LineString(self.to_lines().T)
             self._shapely_up_to_date = True
 
-    def _update_lines(self):
-        if self._lines_up_to_date:
-            return
-
-        precision = 1e-3
-        points = []
-        n = self._vertices.shape[1]
-        for i in range(n - int(not self._closed)):
-            a = self._vertices[:2,i]
-            b = self._vertices[:2,(i+1)%n]
-            bulge = self._vertices[2,i]
-            if points:
-                points.pop(-1)
-            if math.isclose(bulge, 0):
-                points += [a, b]
-            else:
-                rot = np.array([[0,-1],
-                                [1, 0]])
-                on_right = bulge >= 0
-                if not on_right:
-                    rot = -rot
-                bulge = abs(bulge)
-                ab = b-a
-                chord = np.linalg.norm(ab)
-                radius = chord * (bulge + 1. / bulge) / 4
-                center_offset = radius - chord * bulge / 2
-                center = a + ab/2 + center_offset / chord * rot.dot(ab)
-
-                a_dir = a - center
-                b_dir = b - center
-                rad_start = math.atan2(a_dir[1], a_dir[0])
-                rad_end   = math.atan2(b_dir[1], b_dir[0])
-
-                # TODO handle case where bulge almost 0 or inf (line or circle)
-                if not math.isclose(rad_start, rad_end):
-                    if on_right != (rad_start < rad_end):
-                        if on_right:
-                            rad_start -= 2*math.pi
-                        else:
-                            rad_end -= 2*math.pi
-
-                    rad_len = abs(rad_end - rad_start)
-                    if radius > precision:
-                        max_angle = 2 * math.acos(1.0 - precision / radius)
-                    else:
-                        max_angle = math.pi
-                    nb_segments = max(2, math.ceil(rad_len / max_angle) + 1)
-
-                    angles = np.linspace(rad_start, rad_end, nb_segments + 1)
-                    arc_data = (center.reshape(2,1) + radius *
-                                np.vstack((np.cos(angles), np.sin(angles))))
-                    points += np.transpose(arc_data).tolist()
-        self._lines = np.transpose(np.array(points))
-        self._lines_up_to_date = True
-
     @property
     def raw(self):
         return self._vertices
@@ -121,25 +97,46 @@ class Polyline(PolylineInterface):
 
     @property
     def bounds(self):
-        self._update_cavc()
-        min_x, min_y, max_x, max_y = self._cavc_pline.get_extents()
-        return np.array([[min_x, min_y], [max_x, max_y]])
+        """Return [[min_x, min_y], [max_x, max_y]] including arc extremes."""
+        self._update_geometry()
+        return np.copy(self._bounds)
+
+    @property
+    def area(self):
+        """Signed area, positive when counter clockwise."""
+        self._update_geometry()
+        return self._area
 
     @property
     def centroid(self):
-        self._update_shapely()
-        return self._shapely.centroid
+        """Area centroid, or length centroid if the polyline encloses none."""
+        self._update_geometry()
+        return np.copy(self._centroid)
 
     def is_closed(self):
         return self._closed
 
     def is_ccw(self):
-        self._update_cavc()
-        return self._cavc_pline.get_area() >= 0
+        return self.area >= 0
 
-    # TODO
     def is_simple(self):
-        return True
+        return self.self_intersections().shape[1] == 0
+
+    def self_intersections(self):
+        """Return (2, n) points where the polyline crosses or touches
+        itself.
+        """
+        a, b, bulge = _segment_table(self._vertices, self._closed)
+        m = bulge.size
+        lo, hi = _segment_extents(a, b, bulge)
+        i, j = _candidate_pairs(lo, hi)
+        points, pair_ids = _intersect_pairs(a, b, bulge, i, j)
+        i, j = i[pair_ids], j[pair_ids]
+        # consecutive segments always meet at their shared vertex
+        keep = ~((j == i + 1) & _near(points, b[:,i]))
+        if self._closed:
+            keep &= ~((i == 0) & (j == m - 1) & _near(points, a[:,i]))
+        return _unique_points(points[:,keep])
 
     def reverse(self):
         polyline = Polyline._init_internal(np.copy(self._vertices),
@@ -153,6 +150,31 @@ class Polyline(PolylineInterface):
             polyline._vertices[2,-1] = 0.
         return polyline
 
+    def shift_start(self, index):
+        """Return closed polyline starting at vertex index."""
+        if not self._closed:
+            raise Exception('Cannot shift start of an open polyline.')
+        return Polyline._init_internal(np.roll(self._vertices, -index, axis=1),
+                                       True)
+
+    def split_lines(self, min_length):
+        """Return polyline with straight segments of min_length or more
+        split at their middle.
+        """
+        vertices = self._vertices
+        n = vertices.shape[1]
+        nb_segments = n if self._closed else n - 1
+        a = vertices[:2,:nb_segments]
+        b = np.roll(vertices[:2], -1, axis=1)[:,:nb_segments]
+        split = np.flatnonzero((vertices[2,:nb_segments] == 0) &
+                               (np.hypot(*(b - a)) >= min_length))
+        if split.size == 0:
+            return self
+        middles = np.vstack(((a[:,split] + b[:,split]) / 2,
+                             np.zeros(split.size)))
+        return Polyline._init_internal(np.insert(vertices, split + 1, middles,
+                                                 axis=1), self._closed)
+
     def contains(self, object):
         if not self._closed:
             return False
@@ -176,7 +198,7 @@ class Polyline(PolylineInterface):
         polyline = Polyline._init_internal(np.copy(self._vertices),
                                            self._closed)
         cos = math.cos(r) * s
-        sin = math.sin(r)
+        sin = math.sin(r) * s
         tr_mat = np.array([[cos,-sin, d[0]],
                            [sin, cos, d[1]],
                            [  0,   0,    1]])
@@ -187,27 +209,29 @@ class Polyline(PolylineInterface):
         return polyline
 
     def offset(self, offset):
-        self._update_cavc()
-        cavc_plines = self._cavc_pline.parallel_offset(offset, 0)
-        polylines = []
-        for cavc_pline in cavc_plines:
-            polyline = Polyline._init_internal(cavc_pline.vertex_data(),
-                                               cavc_pline.is_closed())
-            polyline._cavc_pline = cavc_pline
-            polyline._cavc_up_to_date = True
-            polylines.append(polyline)
-        return polylines
+        key = OffsetCache.key(self._vertices, self._closed, offset)
+        results = offset_cache.get(key)
+        if results is None:
+            self._update_cavc()
+            cavc_plines = self._cavc_pline.parallel_offset(offset, 0)
+            results = []
+            for cavc_pline in cavc_plines:
+                vertices = cavc_pline.vertex_data()
+                # shared between every polyline built from this entry
+                vertices.flags.writeable = False
+                results.append((vertices, cavc_pline.is_closed()))
+            offset_cache.put(key, results)
+        return [Polyline._init_internal(vertices, closed)
+                for vertices, closed in results]
 
     def loop(self, limit_angle, selected_radius, loop_radius):
-        polyline = Polyline._init_internal(np.copy(self._vertices),
-                                           self._closed)
-
+        vertices = self._vertices
         limit_bulge = math.tan((math.pi - limit_angle) / 4)
-        ids = np.where(np.abs(polyline._vertices[2]) >= limit_bulge)[0]
+        ids = np.where(np.abs(vertices[2]) >= limit_bulge)[0]
 
-        cur = np.take(polyline._vertices, ids, axis=1)
-        next_ids = (ids+1)%polyline._vertices.shape[1]
-        next = np.take(polyline._vertices[:2], next_ids, axis=1)
+        cur = np.take(vertices, ids, axis=1)
+        next_ids = (ids+1)%vertices.shape[1]
+        next = np.take(vertices[:2], next_ids, axis=1)
 
         # i, x, y, b, h_theta, vx, vy
         data = np.vstack((ids, cur, 2*np.arctan(np.abs(cur[2])), next-cur[:2]))
@@ -234,18 +258,379 @@ class Polyline(PolylineInterface):
 
         new_b = np.insert(new_b, 2, 0, axis=0)
         new_a = np.vstack((new_a, -1/data[3]))
-        for i in reversed(range(data.shape[1])):
-            id = int(data[0, i] + 0.1)
-            polyline._vertices[2, id] = 0
 
-            polyline._vertices = np.insert(polyline._vertices, id+1, new_b[:,i], axis=1)
-            polyline._vertices = np.insert(polyline._vertices, id+1, new_a[:,i], axis=1)
+        # every looped corner i is followed by new_a and new_b, so original
+        # vertices move by two per looped corner before them
+        ids = np.rint(data[0]).astype(int)
+        nb_vertices = vertices.shape[1]
+        shift = 2 * np.searchsorted(ids, np.arange(nb_vertices))
+        looped = np.empty((3, nb_vertices + 2 * ids.size))
+        looped[:,np.arange(nb_vertices) + shift] = vertices
+        corners = ids + 2 * np.arange(ids.size)
+        looped[2,corners] = 0
+        looped[:,corners + 1] = new_a
+        looped[:,corners + 2] = new_b
+
+        return Polyline._init_internal(looped, self._closed)
+
+    def to_lines(self, precision=LOD_PRECISIONS[0]):
+        lines = self._lines.get(precision)
+        if lines is None:
+            lines = _tessellate(self._vertices, self._closed, precision)
+            self._lines[precision] = lines
+            if len(self._lines) > LOD_CACHE_SIZE:
+                self._lines.popitem(last=False)
+        else:
+            self._lines.move_to_end(precision)
+        return lines
+
+# OFFSET CACHE ################################################################
+class OffsetCache:
+    """LRU cache of offset results, keyed by polyline content and offset
+    distance so that identical contours share them across jobs. Safe to
+    use from several threads.
+    """
+    def __init__(self, max_bytes=64*2**20):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def key(vertices, closed, offset):
+        digest = hashlib.blake2b(np.ascontiguousarray(vertices).tobytes(),
+                                 digest_size=16)
+        digest.update(b'c' if closed else b'o')
+        return digest.digest(), float(offset)
+
+    def get(self, key):
+        with self._lock:
+            results = self._entries.get(key)
+            if results is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            return results
+
+    def put(self, key, results):
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= OffsetCache._size(self._entries.pop(key))
+            size = OffsetCache._size(results)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = results
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= OffsetCache._size(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'entries': len(self._entries),
+                    'bytes': self._bytes,
+                    'max_bytes': self.max_bytes}
+
+    def _size(results):
+        return sum(vertices.nbytes for vertices, _ in results)
+
+offset_cache = OffsetCache()
+instrumentation.register_cache('offset cache', offset_cache.stats)
+# !OFFSET CACHE ###############################################################
+class PolylineSet:
+    """Contours sharing a single (3, n) vertex buffer, contour i spanning
+    columns offsets[i] to offsets[i+1]. Operations apply to all contours at
+    once.
+    """
+    def __init__(self, polylines):
+        if polylines:
+            vertices = np.hstack([p._vertices for p in polylines])
+        else:
+            vertices = np.empty(shape=(3,0))
+        sizes = [p._vertices.shape[1] for p in polylines]
+        offsets = np.concatenate(([0], np.cumsum(sizes))).astype(int)
+        closed = np.array([p._closed for p in polylines], dtype=bool)
+        PolylineSet._init_internal(vertices, offsets, closed, self)
 
-        return polyline
+    def _init_internal(vertices, offsets, closed, object=None):
+        if object is None:
+            object = PolylineSet.__new__(PolylineSet)
+        object._vertices = vertices
+        object._offsets = offsets
+        object._closed = closed
+        return object
+
+    def __len__(self):
+        return self._closed.size
+
+    def __getitem__(self, i):
+        """Return contour i as a Polyline sharing the set buffer."""
+        start, end = self._offsets[i:i+2]
+        return Polyline._init_internal(self._vertices[:,start:end],
+                                       bool(self._closed[i]))
+
+    def polylines(self):
+        return [self[i] for i in range(len(self))]
+
+    @property
+    def raw(self):
+        return self._vertices
+
+    @property
+    def offsets(self):
+        return self._offsets
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def _segments(self):
+        """Return start and end vertex indices of every segment and the
+        contour it belongs to.
+        """
+        sizes = np.diff(self._offsets)
+        n = self._vertices.shape[1]
+        ids = np.arange(n)
+        next_ids = ids + 1
+        last = self._offsets[1:] - 1
+        next_ids[last] = self._offsets[:-1]
+        keep = np.ones(n, dtype=bool)
+        keep[last[~self._closed]] = False
+        contours = np.repeat(np.arange(len(self)), sizes)
+        return ids[keep], next_ids[keep], contours[keep]
+
+    @property
+    def bounds(self):
+        """Return (k, 2, 2) array of [[min_x, min_y], [max_x, max_y]] for
+        each of the k contours.
+        """
+        starts = self._offsets[:-1]
+        lo = np.minimum.reduceat(self._vertices[:2], starts, axis=1)
+        hi = np.maximum.reduceat(self._vertices[:2], starts, axis=1)
+        a, b, contours = self._segments()
+        seg_lo, seg_hi = _segment_extents(self._vertices[:2,a],
+                                          self._vertices[:2,b],
+                                          self._vertices[2,a])
+        for axis in range(2):
+            np.minimum.at(lo[axis], contours, seg_lo[axis])
+            np.maximum.at(hi[axis], contours, seg_hi[axis])
+        return np.stack((lo.T, hi.T), axis=1)
 
-    def to_lines(self):
-        self._update_lines()
-        return self._lines
+    @property
+    def areas(self):
+        """Return (k,) signed areas of the contours, zero for open ones."""
+        a, b, contours = self._segments()
+        area = _segment_moments(self._vertices[:2,a], self._vertices[:2,b],
+                                self._vertices[2,a])[0]
+        areas = np.bincount(contours, weights=area, minlength=len(self))
+        areas[~self._closed] = 0.
+        return areas
+
+    def reverse(self):
+        sizes = np.diff(self._offsets)
+        starts = np.repeat(self._offsets[:-1], sizes)
+        n = np.repeat(sizes, sizes)
+        j = np.arange(self._vertices.shape[1]) - starts
+        closed = np.repeat(self._closed, sizes)
+        xy_ids = starts + np.where(closed, (n - j) % n, n - 1 - j)
+        bulge_ids = starts + np.where(closed, n - 1 - j, n - 2 - j)
+        vertices = np.vstack((self._vertices[:2,xy_ids],
+                              -self._vertices[2,bulge_ids]))
+        vertices[2,(~closed) & (j == n - 1)] = 0.
+        return PolylineSet._init_internal(vertices, self._offsets,
+                                          self._closed)
+
+    def affine(self, d, r, s):
+        cos = math.cos(r) * s
+        sin = math.sin(r) * s
+        rot_mat = np.array([[cos,-sin],
+                            [sin, cos]])
+        vertices = np.empty(self._vertices.shape)
+        vertices[:2] = (np.dot(rot_mat, self._vertices[:2]) +
+                        np.reshape(d, (2,1)))
+        vertices[2] = self._vertices[2]
+        return PolylineSet._init_internal(vertices, self._offsets,
+                                          self._closed)
+
+    def to_lines(self, precision=LOD_PRECISIONS[0]):
+        """Return the list of (2, n) tessellations of all contours."""
+        a, b, contours = self._segments()
+        points, counts, ends = _tessellate_segments(self._vertices[:2,a],
+                                                    self._vertices[:2,b],
+                                                    self._vertices[2,a],
+                                                    precision)
+        # close each contour with the end point of its last segment, or its
+        # single vertex when it has no segment
+        seg_count = np.bincount(contours, minlength=len(self))
+        last_seg = np.cumsum(seg_count) - 1
+        tails = self._vertices[:2,self._offsets[:-1]].copy()
+        has_seg = seg_count > 0
+        tails[:,has_seg] = ends[:,last_seg[has_seg]]
+        point_count = np.bincount(contours, weights=counts,
+                                  minlength=len(self)).astype(int)
+        positions = np.cumsum(point_count)
+        points = np.insert(points, positions, tails, axis=1)
+        return np.split(points, (positions + np.arange(1, len(self) + 1))[:-1],
+                        axis=1)
+
+def _arc_geometry(a, b, bulge):
+    """Return centers, radii, start and end angles of the (2, n) chords a->b
+    with bulges (n,). Angles are unwrapped so that end - start is the signed
+    sweep. Meaningless where bulge is 0.
+    """
+    on_right = bulge >= 0
+    abs_bulge = np.abs(bulge)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ab = b - a
+        chord = np.sqrt(ab[0]**2 + ab[1]**2)
+        radius = chord * (abs_bulge + 1. / abs_bulge) / 4
+        center_offset = radius - chord * abs_bulge / 2
+        normal = np.where(on_right, 1., -1.) * np.vstack((-ab[1], ab[0]))
+        center = a + ab/2 + center_offset / chord * normal
+
+    a_dir = a - center
+    b_dir = b - center
+    rad_start = np.arctan2(a_dir[1], a_dir[0])
+    rad_end = np.arctan2(b_dir[1], b_dir[0])
+    wrap = (~np.isclose(rad_start, rad_end, rtol=1e-9, atol=0.) &
+            (on_right != (rad_start < rad_end)))
+    rad_start = np.where(wrap & on_right, rad_start - 2*math.pi, rad_start)
+    rad_end = np.where(wrap & ~on_right, rad_end - 2*math.pi, rad_end)
+    return center, radius, rad_start, rad_end
+
+def _tessellate_segments(a, b, bulge, precision):
+    """Discretize every a->b segment at once, arcs being split so that the
+    chord error stays under precision.
+    Return the points of all segments except their end points, the number of
+    points of each segment and the (2, n) end points.
+    """
+    is_arc = bulge != 0
+    counts = np.ones(bulge.shape, dtype=int)
+    ends = np.array(b, dtype=float)
+    if not np.any(is_arc):
+        return np.array(a, dtype=float), counts, ends
+
+    center, radius, rad_start, rad_end = _arc_geometry(a[:,is_arc],
+                                                       b[:,is_arc],
+                                                       bulge[is_arc])
+    # arcs with same start and end angles are drawn as lines
+    rad_len = np.abs(rad_end - rad_start)
+    valid = (~np.isclose(rad_start, rad_end, rtol=1e-9, atol=0.) &
+             np.isfinite(rad_len))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        max_angle = np.where(radius > precision,
+                             2 * np.arccos(1.0 - precision / radius), math.pi)
+        nb_segments = np.ceil(rad_len / max_angle) + 1
+    nb_segments = np.maximum(2, np.where(valid, nb_segments, 0)).astype(int)
+    nb_segments[~valid] = 1
+    counts[is_arc] = nb_segments
+    arc_ends = center + radius * np.vstack((np.cos(rad_end), np.sin(rad_end)))
+    ends[:,is_arc] = np.where(valid, arc_ends, ends[:,is_arc])
+
+    seg_ids = np.repeat(np.arange(bulge.size), counts)
+    first = np.cumsum(counts) - counts
+    steps = np.arange(seg_ids.size) - first[seg_ids]
+    points = np.array(a[:,seg_ids], dtype=float)
+
+    arc_ids = np.cumsum(is_arc) - 1
+    on_arc = is_arc[seg_ids]
+    arc_seg = arc_ids[seg_ids[on_arc]]
+    on_arc[on_arc] = valid[arc_seg]
+    arc_seg = arc_ids[seg_ids[on_arc]]
+    step = (rad_end - rad_start) / nb_segments
+    angles = steps[on_arc] * step[arc_seg] + rad_start[arc_seg]
+    points[:,on_arc] = (center[:,arc_seg] + radius[arc_seg] *
+                        np.vstack((np.cos(angles), np.sin(angles))))
+    return points, counts, ends
+
+def _tessellate(vertices, closed, precision):
+    """Return (2, n) points following the polyline within precision."""
+    n = vertices.shape[1]
+    nb_seg = n - int(not closed)
+    if nb_seg < 1:
+        return np.array(vertices[:2], dtype=float)
+    a = vertices[:2,:nb_seg]
+    b = np.roll(vertices[:2], -1, axis=1)[:,:nb_seg]
+    points, _, ends = _tessellate_segments(a, b, vertices[2,:nb_seg], precision)
+    return np.hstack((points, ends[:,-1:]))
+
+def _segment_extents(a, b, bulge):
+    """Return (2, n) lower and upper corners of the bounding boxes of the
+    a->b segments, including arc extremes.
+    """
+    lo = np.minimum(a, b)
+    hi = np.maximum(a, b)
+    is_arc = bulge != 0
+    if not np.any(is_arc):
+        return lo, hi
+    center, radius, rad_start, rad_end = _arc_geometry(a[:,is_arc],
+                                                       b[:,is_arc],
+                                                       bulge[is_arc])
+    sweep = rad_end - rad_start
+    for k in range(4):
+        angle = k * math.pi / 2
+        inside = np.where(sweep >= 0,
+                          np.mod(angle - rad_start, 2*math.pi) <= sweep,
+                          np.mod(rad_start - angle, 2*math.pi) <= -sweep)
+        axis = k % 2
+        if k < 2:
+            extreme = np.maximum(hi[axis,is_arc], center[axis] + radius)
+            hi[axis,is_arc] = np.where(inside, extreme, hi[axis,is_arc])
+        else:
+            extreme = np.minimum(lo[axis,is_arc], center[axis] - radius)
+            lo[axis,is_arc] = np.where(inside, extreme, lo[axis,is_arc])
+    return lo, hi
+
+def _sweep_minus_sin(sweep):
+    """Return sweep - sin(sweep), without cancellation on small sweeps."""
+    small = np.abs(sweep) < 1e-2
+    series = sweep**3 / 6 - sweep**5 / 120 + sweep**7 / 5040
+    return np.where(small, series, sweep - np.sin(sweep))
+
+def _segment_moments(a, b, bulge):
+    """Return (n,) signed areas and (2, n) first moments of the regions
+    between the origin and the a->b segments, then (n,) lengths and (2, n)
+    first moments of the segments themselves.
+    """
+    cross = _cross(a, b)
+    area = cross / 2
+    moment = (a + b) * cross / 6
+    ab = b - a
+    length = np.sqrt(_dot(ab, ab))
+    length_moment = (a + b) / 2 * length
+    is_arc = bulge != 0
+    if not np.any(is_arc):
+        return area, moment, length, length_moment
+    center, radius, rad_start, rad_end = _arc_geometry(a[:,is_arc],
+                                                       b[:,is_arc],
+                                                       bulge[is_arc])
+    sweep = rad_end - rad_start
+    bisector = (rad_start + rad_end) / 2
+    direction = np.vstack((np.cos(bisector), np.sin(bisector)))
+    # circular segment between chord and arc, and arc, both centered on the
+    # bisector
+    segment_area = radius**2 / 2 * _sweep_minus_sin(sweep)
+    abs_sweep = np.abs(sweep)
+    segment_dist = (4 * radius * np.sin(abs_sweep / 2)**3 /
+                    (3 * _sweep_minus_sin(abs_sweep)))
+    arc_length = radius * abs_sweep
+    arc_dist = 2 * radius * np.sin(abs_sweep / 2) / abs_sweep
+    area[is_arc] += segment_area
+    moment[:,is_arc] += segment_area * (center + segment_dist * direction)
+    length[is_arc] = arc_length
+    length_moment[:,is_arc] = arc_length * (center + arc_dist * direction)
+    return area, moment, length, length_moment
 
 def line2polyline(start, end):
     return Polyline(np.insert([start, end], 2, 0., axis=1).T, False)
@@ -269,47 +654,444 @@ def circle2polyline(center, radius):
                 [1. , 1.]]
     return Polyline(vertices, True)
 
-# TODO replace with biarc
-def spline2polyline(degree, control_points, closed):
-    epsilon = 1e-1
-    spline = BSpline.Curve()
-    spline.degree = degree
-    spline.ctrlpts = control_points
-    if closed:
-        spline.ctrlpts += spline.ctrlpts[:spline.degree]
-        m = spline.degree + len(spline.ctrlpts)
-        spline.knotvector = [i/m for i in range(m+1)]
-        curve_range = (spline.knotvector[spline.degree], spline.knotvector[len(spline.ctrlpts)])
-        nb_seg_init = len(spline.ctrlpts)
+# samples per control point checked when fitting splines
+SPLINE_SAMPLES = 32
+# part of the tolerance left to the curve between samples
+SPLINE_MARGIN = .05
+# times samples are refined where the curve strays from the fit in between
+SPLINE_REFINEMENTS = 16
+
+def _de_boor(degree, knots, ctrlpts, t, side='right'):
+    """Return (2, n) points of the B-spline at parameters t, taking the
+    limit from side at knots.
+    """
+    span = np.searchsorted(knots, t, side=side) - 1
+    span = np.clip(span, degree, len(ctrlpts) - 1)
+    d = ctrlpts[span[None,:] + np.arange(-degree, 1)[:,None]]
+    for r in range(1, degree + 1):
+        for j in range(degree, r - 1, -1):
+            left = knots[j + span - degree]
+            right = knots[j + 1 + span - r]
+            alpha = ((t - left) / (right - left))[:,None]
+            d[j] = (1. - alpha) * d[j-1] + alpha * d[j]
+    return d[degree].T
+
+def _biarc(p0, t0, p1, t1):
+    """Return joint point and joint tangent of the equal tangent length biarc
+    going from p0 with unit tangent t0 to p1 with unit tangent t1, None if
+    there is none.
+    """
+    v = p1 - p0
+    t = t0 + t1
+    vt = _dot(v, t)
+    vv = _dot(v, v)
+    a = _dot(t, t) - 4.
+    if abs(a) < 1e-12:
+        if vt <= 0:
+            return None
+        d = vv / (2 * vt)
     else:
-        spline.knotvector = utilities.generate_knot_vector(spline.degree, len(spline.ctrlpts))
-        curve_range = (0, 1)
-        nb_seg_init = len(spline.ctrlpts) - 1
-
-    t = np.linspace(curve_range[0], curve_range[1], num=nb_seg_init)
-    curve_data = np.hstack((t.reshape(nb_seg_init,1), np.array(spline.evaluate_list(t))))
-    curve_data = np.transpose(curve_data)
-    i = 1
-    while i < np.size(curve_data, 1):
-        t_mid = (curve_data[0][i] + curve_data[0][i-1]) / 2
-        a = curve_data[1:,i-1]
-        b = curve_data[1:,i]
-        c = spline.evaluate_single(t_mid)
-        ab = b - a
-        ac = c - a
-        ac_proj_in_ab = np.sum(ab * ac, axis=0) / np.sum(np.square(ab), axis=0)
-        dist_to_curve = np.linalg.norm(ac_proj_in_ab * ab - ac, axis=0)
-
-        if dist_to_curve > epsilon:
-            curve_data = np.insert(curve_data, i, [t_mid, c[0], c[1]], axis=1)
+        d = (vt - math.sqrt(max(vt**2 - a * vv, 0.))) / a
+    if not 0 < d < math.inf:
+        return None
+    return (p0 + d * t0 + p1 - d * t1) / 2, (v - d * t) / (2 * d)
+
+def _bulge(tangent, chord):
+    """Return the bulge of the arc leaving with tangent along chord."""
+    return math.tan(math.atan2(_cross(tangent, chord), _dot(tangent, chord)) / 2)
+
+def _arc_distance(points, a, tangent, b):
+    """Return distances from (2, n) points to the arc of at most half a turn
+    leaving a with tangent and ending at b.
+    """
+    c = b - a
+    cc = _dot(c, c)
+    ap = points - a[:,None]
+    bp = points - b[:,None]
+    if cc == 0:
+        return np.sqrt(_dot(ap, ap))
+    normal = np.array((-tangent[1], tangent[0]))
+    nc = _dot(normal, c)
+    if abs(nc) < 1e-9 * cc:
+        u = np.clip(_dot(c, ap) / cc, 0., 1.)
+        ap -= u * c[:,None]
+        return np.sqrt(_dot(ap, ap))
+    radius = cc / (2 * nc)
+    center = a + radius * normal
+    v = points - center[:,None]
+    side = math.copysign(1., radius)
+    within = ((_cross(a - center, v) * side >= 0) &
+              (_cross(v, b - center) * side >= 0))
+    on_circle = np.abs(np.sqrt(_dot(v, v)) - abs(radius))
+    to_ends = np.sqrt(np.minimum(_dot(ap, ap), _dot(bp, bp)))
+    return np.where(within, on_circle, to_ends)
+
+def _biarc_deviation(points, p0, t0, joint, tj, p1):
+    """Return distances from (2, n) points to the biarc p0, joint, p1."""
+    return np.minimum(_arc_distance(points, p0, t0, joint),
+                      _arc_distance(points, joint, tj, p1))
+
+def _fit_biarc(samples, tangents, i, j, tolerance):
+    """Return joint, joint tangent and bulges of the biarc joining samples i
+    and j if it stays within tolerance of the samples in between, else None.
+    """
+    p0, t0, p1, t1 = samples[:,i], tangents[:,i], samples[:,j], tangents[:,j]
+    biarc = _biarc(p0, t0, p1, t1)
+    if biarc is None:
+        return None
+    joint, tj = biarc
+    bulge0, bulge1 = _bulge(t0, joint - p0), _bulge(tj, p1 - joint)
+    if abs(bulge0) > 1 or abs(bulge1) > 1:
+        return None
+    inner = samples[:,i+1:j]
+    if inner.shape[1]:
+        deviation = _biarc_deviation(inner, p0, t0, joint, tj, p1)
+        if deviation.max() > tolerance:
+            return None
+    return joint, tj, bulge0, bulge1
+
+def _fit_biarcs(samples, tangents, tolerance):
+    """Return (i, j, fit) of the biarcs joining samples i and j, fit being
+    None for a line, from the first sample to the last one.
+    """
+    # greedily extend each biarc as far as it stays within tolerance, starting
+    # from the length of the previous one
+    fits = []
+    last = samples.shape[1] - 1
+    i, span = 0, 1
+    while i < last:
+        fit, good, bad = None, i, last + 1
+        j = min(i + span, last)
+        while good + 1 < bad:
+            attempt = _fit_biarc(samples, tangents, i, j, tolerance)
+            if attempt is None:
+                bad = j
+            else:
+                fit, good = attempt, j
+            if bad > last:
+                j = min(i + 2 * (j - i), last)
+            else:
+                j = (good + bad) // 2
+
+        if fit is None or (abs(fit[2]) < 1e-9 and abs(fit[3]) < 1e-9):
+            fit = None
+        good = max(good, i + 1)
+        fits.append((i, good, fit))
+        span = good - i
+        i = good
+    return fits
+
+def _fit_deviation(samples, tangents, fits, points):
+    """Return distances from points, (2, n - 1) points of the curve between
+    consecutive samples, to the fits covering them.
+    """
+    deviation = np.empty(points.shape[1])
+    for i, j, fit in fits:
+        p0, p1 = samples[:,i], samples[:,j]
+        if fit is None:
+            t0 = p1 - p0
+            joint, tj = (p0 + p1) / 2, t0
         else:
-            i += 1
-    vertices = np.insert(curve_data[1:], 2, 0., axis=0)
+            t0 = tangents[:,i]
+            joint, tj = fit[:2]
+        deviation[i:j] = _biarc_deviation(points[:,i:j], p0, t0, joint, tj, p1)
+    return deviation
+
+def spline2polyline(degree, control_points, closed, tolerance=1e-1):
+    """Fit a B-spline with biarcs staying within tolerance of the curve."""
+    ctrlpts = np.array(control_points, dtype=float)[:,:2]
+    if degree == 1:
+        return Polyline(np.insert(ctrlpts, 2, 0., axis=1).T, closed)
     if closed:
-        return Polyline(vertices[:,:-1], True)
+        ctrlpts = np.vstack((ctrlpts, ctrlpts[:degree]))
+        m = degree + len(ctrlpts)
+        knots = np.arange(m + 1) / m
+        curve_range = (knots[degree], knots[len(ctrlpts)])
     else:
-        return Polyline(vertices, False)
-
+        knots = np.array(utilities.generate_knot_vector(degree, len(ctrlpts)))
+        curve_range = (0., 1.)
+
+    # derivative is a B-spline of degree - 1 on the inner knots
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dctrlpts = (degree * np.diff(ctrlpts, axis=0) /
+                    (knots[degree+1:-1] - knots[1:-degree-1])[:,None])
+    def derivative(t, side='right'):
+        return _de_boor(degree - 1, knots[1:-1], dctrlpts, t, side)
+    scale = np.max(np.abs(dctrlpts[np.isfinite(dctrlpts)]), initial=0.)
+
+    # knots are sampled too, the curve is split at those where it has a
+    # corner: derivative vanishing or changing direction
+    inner = np.unique(knots[(knots > curve_range[0]) & (knots < curve_range[1])])
+    left, right = derivative(inner, 'left'), derivative(inner, 'right')
+    stalled = (np.sqrt(np.minimum(_dot(left, left), _dot(right, right))) <=
+               1e-9 * scale)
+    turned = np.abs(_cross(left, right)) > 1e-9 * np.sqrt(_dot(left, left) *
+                                                          _dot(right, right))
+    breaks = np.concatenate(([curve_range[0]], inner[stalled | turned],
+                             [curve_range[1]]))
+
+    nb_samples = SPLINE_SAMPLES * len(ctrlpts)
+    length = curve_range[1] - curve_range[0]
+    margin = SPLINE_MARGIN * tolerance
+    fit_tolerance = tolerance - margin
+    vertices = []
+    for t0, t1 in zip(breaks[:-1], breaks[1:]):
+        num = max(int(math.ceil(nb_samples * (t1 - t0) / length)), 1) + 1
+        t = np.linspace(t0, t1, num=num)
+        t = np.unique(np.concatenate((t, inner[(inner > t0) & (inner < t1)])))
+        # fits keep a margin for the curve between samples, which are refined
+        # until it strays less than the margin from the chords between them
+        for _ in range(SPLINE_REFINEMENTS):
+            samples = _de_boor(degree, knots, ctrlpts, t)
+            middles = (t[:-1] + t[1:]) / 2
+            points = _de_boor(degree, knots, ctrlpts, middles)
+            chord = samples[:,1:] - samples[:,:-1]
+            sagitta = (np.abs(_cross(chord, points - samples[:,:-1])) /
+                       np.maximum(np.sqrt(_dot(chord, chord)), 1e-300))
+            strays = sagitta > margin
+            if not np.any(strays):
+                break
+            t = np.sort(np.concatenate((t, middles[strays])))
+        # and until the fit is within tolerance midway too
+        for _ in range(SPLINE_REFINEMENTS):
+            samples = _de_boor(degree, knots, ctrlpts, t)
+            tangents = derivative(t)
+            tangents[:,-1:] = derivative(t[-1:], 'left')
+            norms = np.sqrt(_dot(tangents, tangents))
+            # fall back to finite differences where the derivative vanishes,
+            # one sided at the piece ends
+            stalled = ~(norms > 1e-9 * scale)
+            if np.any(stalled):
+                tangents[:,stalled] = np.gradient(samples, axis=1)[:,stalled]
+                norms = np.sqrt(_dot(tangents, tangents))
+            tangents /= np.where(norms > 0, norms, 1.)
+            if closed and len(breaks) == 2:
+                samples[:,-1] = samples[:,0]
+                tangents[:,-1] = tangents[:,0]
+            fits = _fit_biarcs(samples, tangents, fit_tolerance)
+            middles = (t[:-1] + t[1:]) / 2
+            points = _de_boor(degree, knots, ctrlpts, middles)
+            strays = _fit_deviation(samples, tangents, fits, points) > tolerance
+            if not np.any(strays):
+                break
+            t = np.sort(np.concatenate((t, middles[strays])))
+
+        for i, _, fit in fits:
+            p = samples[:,i]
+            if fit is None:
+                vertices.append((p[0], p[1], 0.))
+            else:
+                joint, _, bulge0, bulge1 = fit
+                vertices += [(p[0], p[1], bulge0), (joint[0], joint[1], bulge1)]
+
+    if not closed:
+        end = _de_boor(degree, knots, ctrlpts, np.array([curve_range[1]]))
+        vertices.append((end[0,0], end[1,0], 0.))
+    return Polyline(np.array(vertices).T, closed)
+
+# INTERSECTIONS ###############################################################
+# distance under which points are considered identical
+INTERSECTION_TOLERANCE = 1e-6
+# distance from a shared vertex under which intersections of consecutive
+# segments are ignored
+JOINT_TOLERANCE = 1e-3
+
+def _segment_table(vertices, closed):
+    """Return (2, m) start and end points and (m,) bulges of segments."""
+    nb_seg = max(0, vertices.shape[1] - int(not closed))
+    a = vertices[:2,:nb_seg]
+    b = np.roll(vertices[:2], -1, axis=1)[:,:nb_seg]
+    return a, b, vertices[2,:nb_seg]
+
+def _candidate_pairs(lo, hi):
+    """Sweep a line over segments bounding boxes and return index pairs
+    (i < j) of overlapping boxes. The sweep runs along the axis where the
+    fewest boxes are crossed at once.
+    """
+    n = lo.shape[1]
+    sweeps = []
+    for axis in range(2):
+        order = np.argsort(lo[axis], kind='stable')
+        # boxes starting while box k is still crossed by the sweep line
+        stops = np.searchsorted(lo[axis,order], hi[axis,order], side='right')
+        counts = np.maximum(stops - np.arange(n) - 1, 0)
+        sweeps.append((np.sum(counts), axis, order, counts))
+    _, axis, order, counts = min(sweeps, key=lambda sweep: sweep[0])
+    first = np.repeat(np.arange(n), counts)
+    shift = np.arange(first.size) - np.repeat(np.cumsum(counts) - counts,
+                                              counts)
+    i = order[first]
+    j = order[first + 1 + shift]
+    other = 1 - axis
+    overlap = (lo[other,i] <= hi[other,j]) & (lo[other,j] <= hi[other,i])
+    i, j = i[overlap], j[overlap]
+    return np.minimum(i, j), np.maximum(i, j)
+
+def _cross(u, v):
+    return u[0] * v[1] - u[1] * v[0]
+
+def _dot(u, v):
+    return u[0] * v[0] + u[1] * v[1]
+
+def _near(points, others, tol=JOINT_TOLERANCE):
+    return _dot(points - others, points - others) <= tol**2
+
+def _unique_points(points, tol=INTERSECTION_TOLERANCE):
+    if points.shape[1] < 2:
+        return points
+    keys = np.round(points / tol).astype(np.int64)
+    _, ids = np.unique(keys, axis=1, return_index=True)
+    return points[:,np.sort(ids)]
+
+def _on_line(points, a, b, tol):
+    d = b - a
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = _dot(points - a, d) / _dot(d, d)
+    t = np.clip(np.nan_to_num(t), 0., 1.)
+    return _near(points, a + t * d, tol)
+
+def _on_arc(points, center, radius, rad_start, rad_end, tol):
+    v = points - center
+    dist = np.sqrt(_dot(v, v))
+    angle = np.arctan2(v[1], v[0])
+    sweep = rad_end - rad_start
+    delta = np.where(sweep >= 0, angle - rad_start, rad_start - angle)
+    delta = np.mod(delta, 2*math.pi)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tol_angle = tol / radius
+    within = ((delta <= np.abs(sweep) + tol_angle) |
+              (delta >= 2*math.pi - tol_angle))
+    return (np.abs(dist - radius) <= tol) & within
+
+def _line_line(a1, b1, a2, b2, tol):
+    d1 = b1 - a1
+    d2 = b2 - a2
+    w = a2 - a1
+    len1 = np.sqrt(_dot(d1, d1))
+    len2 = np.sqrt(_dot(d2, d2))
+    denom = _cross(d1, d2)
+    parallel = np.abs(denom) <= 1e-12 * len1 * len2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = _cross(w, d2) / denom
+        u = _cross(w, d1) / denom
+        hit = (~parallel & (t >= -tol / len1) & (t <= 1 + tol / len1) &
+               (u >= -tol / len2) & (u <= 1 + tol / len2))
+    points = [a1[:,hit] + t[hit] * d1[:,hit]]
+    ids = [np.nonzero(hit)[0]]
+    # overlapping collinear segments meet at the endpoints lying on the other
+    with np.errstate(divide='ignore', invalid='ignore'):
+        collinear = parallel & (np.abs(_cross(w, d1)) <= tol * len1)
+    for p, a, b in ((a2, a1, b1), (b2, a1, b1), (a1, a2, b2), (b1, a2, b2)):
+        hit = collinear & _on_line(p, a, b, tol)
+        points.append(p[:,hit])
+        ids.append(np.nonzero(hit)[0])
+    return np.hstack(points), np.concatenate(ids)
+
+def _line_circle(a, b, center, radius, tol):
+    """Return the two intersections of lines with circles and where both
+    exist.
+    """
+    d = b - a
+    f = a - center
+    len2 = _dot(d, d)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dist = np.abs(_cross(d, f)) / np.sqrt(len2)
+        half_b = _dot(f, d)
+        disc = half_b**2 - len2 * (_dot(f, f) - radius**2)
+        root = np.sqrt(np.maximum(disc, 0.))
+        t1 = (-half_b - root) / len2
+        t2 = (-half_b + root) / len2
+    hit = dist <= radius + tol
+    return a + t1 * d, a + t2 * d, hit
+
+def _circle_circle(c1, r1, c2, r2, tol):
+    """Return the two intersections of circles and where both exist."""
+    v = c2 - c1
+    dist = np.sqrt(_dot(v, v))
+    hit = (dist > tol) & (dist <= r1 + r2 + tol) & (dist >= np.abs(r1 - r2) - tol)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        along = (r1**2 - r2**2 + dist**2) / (2 * dist)
+        height = np.sqrt(np.maximum(r1**2 - along**2, 0.))
+        u = v / dist
+    mid = c1 + along * u
+    normal = np.vstack((-u[1], u[0]))
+    return mid + height * normal, mid - height * normal, hit
+
+def _intersect_pairs(a, b, bulge, i, j, tol=INTERSECTION_TOLERANCE):
+    """Return (2, k) intersection points of segment pairs (i, j) and the
+    index of the pair each point belongs to.
+    """
+    n = bulge.size
+    is_arc = bulge != 0
+    center = np.full((2, n), np.nan)
+    radius = np.full(n, np.inf)
+    rad_start = np.zeros(n)
+    rad_end = np.zeros(n)
+    if np.any(is_arc):
+        arc = _arc_geometry(a[:,is_arc], b[:,is_arc], bulge[is_arc])
+        center[:,is_arc], radius[is_arc], rad_start[is_arc], rad_end[is_arc] = arc
+
+    def on_segment(points, s):
+        return np.where(is_arc[s],
+                        _on_arc(points, center[:,s], radius[s],
+                                rad_start[s], rad_end[s], tol),
+                        _on_line(points, a[:,s], b[:,s], tol))
+
+    points = []
+    pair_ids = []
+
+    lines = np.nonzero(~is_arc[i] & ~is_arc[j])[0]
+    p, ids = _line_line(a[:,i[lines]], b[:,i[lines]],
+                        a[:,j[lines]], b[:,j[lines]], tol)
+    points.append(p)
+    pair_ids.append(lines[ids])
+
+    mixed = np.nonzero(is_arc[i] != is_arc[j])[0]
+    line = np.where(is_arc[i[mixed]], j[mixed], i[mixed])
+    arc = np.where(is_arc[i[mixed]], i[mixed], j[mixed])
+    p1, p2, hit = _line_circle(a[:,line], b[:,line], center[:,arc],
+                               radius[arc], tol)
+    for p in (p1, p2):
+        valid = (hit & _on_line(p, a[:,line], b[:,line], tol) &
+                 on_segment(p, arc))
+        points.append(p[:,valid])
+        pair_ids.append(mixed[valid])
+
+    arcs = np.nonzero(is_arc[i] & is_arc[j])[0]
+    s1, s2 = i[arcs], j[arcs]
+    p1, p2, hit = _circle_circle(center[:,s1], radius[s1],
+                                 center[:,s2], radius[s2], tol)
+    for p in (p1, p2):
+        valid = hit & on_segment(p, s1) & on_segment(p, s2)
+        points.append(p[:,valid])
+        pair_ids.append(arcs[valid])
+    # arcs of a same circle meet at the endpoints lying on the other
+    v = center[:,s2] - center[:,s1]
+    same = (_dot(v, v) <= tol**2) & (np.abs(radius[s1] - radius[s2]) <= tol)
+    for p, on in ((a[:,s2], s1), (b[:,s2], s1), (a[:,s1], s2), (b[:,s1], s2)):
+        valid = same & on_segment(p, on)
+        points.append(p[:,valid])
+        pair_ids.append(arcs[valid])
+
+    return np.hstack(points), np.concatenate(pair_ids).astype(int)
+def crossings(polylines_a, polylines_b):
+    """Return (2, n) points where any polyline of the first list crosses or
+    touches any polyline of the second one.
+    """
+    tables = [_segment_table(p._vertices, p._closed)
+              for p in polylines_a + polylines_b]
+    if not tables:
+        return np.empty((2,0))
+    a = np.hstack([t[0] for t in tables])
+    b = np.hstack([t[1] for t in tables])
+    bulge = np.concatenate([t[2] for t in tables])
+    split = sum(t[2].size for t in tables[:len(polylines_a)])
+    lo, hi = _segment_extents(a, b, bulge)
+    i, j = _candidate_pairs(lo, hi)
+    across = (i < split) & (j >= split)
+    points, _ = _intersect_pairs(a, b, bulge, i[across], j[across])
+    return _unique_points(points)
+# !INTERSECTIONS ##############################################################
 # AGGREGATOR ###################################################################
 class EdgeConnector:
     def polyline2connectors(polyline):
@@ -350,42 +1132,66 @@ class EdgeConnector:
         else:
             return self._polyline.reverse()
 
-class KdTree:
-    def __init__(self, connector, split_dir=True, precision=1e-2):
+class Joint:
+    def __init__(self, connector, x, y):
+        self.x = x
+        self.y = y
         self._connectors = [connector]
-        self._split_dir = split_dir # True is for vertical
-        self._precision = precision
-        self._pos = connector.pos
-        self._tl_child = self._br_child = None
         self._complex_joint = False
 
     def insert(self, connector):
-        if np.allclose(connector.pos, self._pos, atol=self._precision):
-            if not self._complex_joint:
-                if len(self._connectors) == 2:
-                    self._complex_joint = True
-                    for e in self._connectors:
-                        e.disconnect()
-                else:
-                    connector.connect(self._connectors[0])
-            self._connectors.append(connector)
-            return
-
-        if self._split_dir: # vertical split
-            tl = connector.pos[0] < self._pos[0]
-        else: # horizontal split
-            tl = connector.pos[1] > self._pos[1]
-
-        if tl:
-            if self._tl_child is not None:
-                self._tl_child.insert(connector)
+        if not self._complex_joint:
+            if len(self._connectors) == 2:
+                self._complex_joint = True
+                for e in self._connectors:
+                    e.disconnect()
             else:
-                self._tl_child = KdTree(connector, not self._split_dir)
-        else:
-            if self._br_child is not None:
-                self._br_child.insert(connector)
-            else:
-                self._br_child = KdTree(connector, not self._split_dir)
+                connector.connect(self._connectors[0])
+        self._connectors.append(connector)
+
+class JointGrid:
+    """Spatial hash of joints with cells the size of the snap precision, so
+    that any joint within precision of a position lies in the 3x3 cells
+    around it.
+    """
+    _neighbours = [(i, j) for i in (0, -1, 1) for j in (0, -1, 1)]
+
+    def __init__(self, precision=1e-2):
+        self._precision = precision
+        self._cells = {}
+
+    def insert(self, connector):
+        x, y = connector.pos.tolist()
+        i = math.floor(x / self._precision)
+        j = math.floor(y / self._precision)
+        for di, dj in self._neighbours:
+            for joint in self._cells.get((i + di, j + dj), ()):
+                if (abs(joint.x - x) <= self._precision and
+                    abs(joint.y - y) <= self._precision):
+                    joint.insert(connector)
+                    return
+        self._cells.setdefault((i, j), []).append(Joint(connector, x, y))
+
+def _chain(connector):
+    """Collect polylines linked from a single end connector."""
+    parts = []
+    current = connector
+    current.mark()
+    while current is not None:
+        parts.append(current.polyline())
+        current = current.opp_end
+        current.mark()
+        current = current.next
+    if len(parts) == 1:
+        return parts[0]
+    vertices = np.hstack([p._vertices[:,:-1] for p in parts[:-1]])
+    vertices = np.hstack((vertices, parts[-1]._vertices))
+    if np.allclose(vertices[:2,0], vertices[:2,-1], atol=1e-3):
+        closed = True
+        vertices = np.delete(vertices, -1, axis=1)
+    else:
+        closed = False
+    return Polyline(vertices, closed)
 
 def aggregate(polylines):
     ready_polylines = [p for p in polylines if p._closed]
@@ -393,47 +1199,22 @@ def aggregate(polylines):
     if not open_polylines:
         return ready_polylines
 
-    # shuffle polylines to ensure KdTree correct distribution
-    shuffle(open_polylines)
-
     connectors = []
     for p in open_polylines:
         connectors += EdgeConnector.polyline2connectors(p)
-    tree = KdTree(connectors[0])
-    for c in connectors[1:]:
-        tree.insert(c)
-
-    updated = True
-    while updated:
-        updated = False
-        for c in connectors:
-            if not c.connected() and not c.marked: # unprocessed single end
-                parts = []
-                updated = True
-                current = c
-                current.mark()
-                while current is not None:
-                    parts.append(current.polyline())
-                    current = current.opp_end
-                    current.mark()
-                    current = current.next
-                if len(parts) > 1:
-                    vertices = np.hstack([p._vertices[:,:-1] for p in parts[:-1]])
-                    vertices = np.hstack((vertices, parts[-1]._vertices))
-                    if np.allclose(vertices[:2,0], vertices[:2,-1], atol=1e-3):
-                        closed = True
-                        vertices = np.delete(vertices, -1, axis=1)
-                    else:
-                        closed = False
-                    ready_polylines.append(Polyline(vertices, closed))
-                else:
-                    ready_polylines.append(parts[0])
-        if not updated: # no more single ends
-            for c in connectors: # look for a loop and cut it open
-                if c.connected() and not c.marked:
-                    c.disconnect()
-                    updated = True
-                    break
+    grid = JointGrid()
+    for c in connectors:
+        grid.insert(c)
+
+    # chains ending on single ends first
+    for c in connectors:
+        if not c.connected() and not c.marked:
+            ready_polylines.append(_chain(c))
+    # then only loops remain, cut them open
+    for c in connectors:
+        if c.connected() and not c.marked:
+            c.disconnect()
+            ready_polylines.append(_chain(c))
     return ready_polylines
 # !AGGREGATOR #################################################################
 class HierarchyNode:
@@ -447,32 +1228,58 @@ class HierarchyNode:
     def is_closed(self):
         return self._polyline._closed
 
-    def contains(self, other):
-        return self._polyline.contains(other._polyline)
-
     def add_child(self, child):
         self._children.append(child)
 
     def children(self):
         return self._children
 
-def append_to_hierarchy(hierarchy, node):
-    children_id = []
-    for i, n in enumerate(hierarchy):
-        if node.contains(n):
-            children_id.append(i)
-    if children_id:
-        for i in sorted(children_id, reverse=True):
-            node.add_child(hierarchy.pop(i))
-        hierarchy.append(node)
-        return
-
-    for n in hierarchy:
-        if n.contains(node):
-            append_to_hierarchy(n.children(), node)
-            return
-
-    hierarchy.append(node)
+def find_parents(polylines):
+    """Return for each polyline the index of the smallest closed polyline
+    containing it, or None. Polylines are assumed not to cross each other.
+    """
+    n = len(polylines)
+    polyline_set = PolylineSet(polylines)
+    areas = np.abs(polyline_set.areas).tolist()
+    # a container is larger than what it contains, rank polylines by area
+    order = sorted(range(n), key=lambda i: -areas[i])
+    rank = [0] * n
+    for r, i in enumerate(order):
+        rank[i] = r
+    bounds = polyline_set.bounds
+    lo = bounds[:,0].tolist()
+    hi = bounds[:,1].tolist()
+
+    # bounding boxes index, grid of about n cells each listing the closed
+    # polylines covering it, smallest first
+    origin = np.min(bounds[:,0], axis=0)
+    size = np.max(bounds[:,1], axis=0) - origin
+    nb_cells = max(1, int(math.sqrt(n)))
+    cell_size = np.where(size > 0, size / nb_cells, 1.)
+    def cell_of(points):
+        cell = np.floor((points - origin) / cell_size).astype(int)
+        return np.clip(cell, 0, nb_cells - 1).tolist()
+    lo_cells, hi_cells = cell_of(bounds[:,0]), cell_of(bounds[:,1])
+    starts = [p._vertices[:2,0] for p in polylines]
+    start_cells = cell_of(np.array(starts))
+    cells = {}
+    for i in reversed(order):
+        if polylines[i]._closed:
+            (x0, y0), (x1, y1) = lo_cells[i], hi_cells[i]
+            for x in range(x0, x1 + 1):
+                for y in range(y0, y1 + 1):
+                    cells.setdefault((x, y), []).append(i)
+
+    parents = [None] * n
+    for i, point in enumerate(starts):
+        for c in cells.get(tuple(start_cells[i]), ()):
+            if (rank[c] < rank[i] and
+                lo[c][0] <= lo[i][0] and lo[c][1] <= lo[i][1] and
+                hi[c][0] >= hi[i][0] and hi[c][1] >= hi[i][1] and
+                polylines[c].contains(point)):
+                parents[i] = c
+                break
+    return parents
 
 def extract_groups(hierarchy):
     groups = []
@@ -488,9 +1295,37 @@ def extract_groups(hierarchy):
         hierarchy = sublevel_hierarchy
     return groups
 
+def overlap_components(polylines):
+    """Return lists of indices of polylines whose bounding boxes overlap,
+    directly or through other ones. Contours nested in each other always
+    end up in the same list.
+    """
+    if not polylines:
+        return []
+    bounds = PolylineSet(polylines).bounds
+    i, j = _candidate_pairs(bounds[:,0].T, bounds[:,1].T)
+    # propagate smallest index through pairs, with pointer jumping
+    labels = np.arange(len(polylines))
+    while True:
+        low = np.minimum(labels[i], labels[j])
+        updated = labels.copy()
+        np.minimum.at(updated, i, low)
+        np.minimum.at(updated, j, low)
+        updated = updated[updated]
+        if np.array_equal(updated, labels):
+            break
+        labels = updated
+    order = np.argsort(labels, kind='stable')
+    splits = np.flatnonzero(np.diff(labels[order])) + 1
+    return [ids.tolist() for ids in np.split(order, splits)]
+
 def group_as_contours(polylines):
-    hierarchy = [HierarchyNode(polylines[0])]
-    for polyline in polylines[1:]:
-        append_to_hierarchy(hierarchy, HierarchyNode(polyline))
+    nodes = [HierarchyNode(p) for p in polylines]
+    hierarchy = []
+    for node, parent in zip(nodes, find_parents(polylines)):
+        if parent is None:
+            hierarchy.append(node)
+        else:
+            nodes[parent].add_child(node)
     groups = extract_groups(hierarchy)
     return groups
@@ -29,10 +29,22 @@ class PolylineInterface(ABC):
     def is_simple(self):
         pass
 
+    @abstractmethod
+    def self_intersections(self):
+        pass
+
     @abstractmethod
     def reverse(self):
         pass
 
+    @abstractmethod
+    def shift_start(self, index):
+        pass
+
+    @abstractmethod
+    def split_lines(self, min_length):
+        pass
+
     @abstractmethod
     def contains(self, object):
         pass
@@ -50,7 +62,7 @@ class PolylineInterface(ABC):
         pass
 
     @abstractmethod
-    def to_lines(self):
+    def to_lines(self, precision):
         pass
 
     # @abstractmethod
@@ -67,7 +79,7 @@ class PolylineInterface(ABC):
 # def circle2polyline(center, radius):
 #     pass
 #
-# def spline2polyline(degree, control_points, closed):
+# def spline2polyline(degree, control_points, closed, tolerance):
 #     pass
 #
 # def aggregate(polylines):
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 from job import Task, JobTask
+import instrumentation
 import numpy as np
 import math
 
@@ -15,12 +16,31 @@ class PostProcessor:
     def emergency_task(self):
         return Task(self._abort_seq)
 
-    def generate(self, job, task_id, dry_run=False):
+    def generate(self, job, task_id, dry_run=False, entry=None):
+        """Entry is the vertex where a closed cut starts, the lowest cost
+        pierce candidate if None.
+        """
+        if instrumentation.enabled:
+            return instrumentation.call(job.name, 'generate', self._generate,
+                                        job, task_id, dry_run, entry)
+        return self._generate(job, task_id, dry_run, entry)
+
+    def _generate(self, job, task_id, dry_run, entry):
         cut_pline = job.get_cut_plines()[task_id]
+        ids, costs, pierces = job.get_pierces()[task_id]
+        if entry is None:
+            entry = int(ids[np.argmin(costs)])
+        if entry:
+            cut_pline = cut_pline.shift_start(entry)
+        # lead-in from the pierce point of entry when it has one
+        pierce = cut_pline.start
+        found = np.flatnonzero(ids == entry)
+        if found.size:
+            pierce = pierces[:,found[0]]
         gcode = list()
         gcode = ['G90',
-                 'G1 F6000 X' + '{:.3f}'.format(cut_pline.start[0]) +
-                         ' Y' + '{:.3f}'.format(cut_pline.start[1]), 'PROBE']
+                 'G1 F6000 X' + '{:.3f}'.format(pierce[0]) +
+                         ' Y' + '{:.3f}'.format(pierce[1]), 'PROBE']
         if dry_run:
             gcode += ['G91', 'G1 F3000 Z20', 'G90', 'M6 V0 T-1']
         else:
@@ -28,6 +48,9 @@ class PostProcessor:
             'G1 Z-2.3', 'G90',
             'M6 V' + '{:.2f}'.format(job.arc_voltage) + ' T' + '{:.0f}'.format(job.feedrate * 0.9)]
         gcode += ['G1 F' + str(job.feedrate)]
+        if not np.allclose(pierce, cut_pline.start):
+            gcode += ['G1 X' + '{:.3f}'.format(cut_pline.start[0]) +
+                        ' Y' + '{:.3f}'.format(cut_pline.start[1])]
 
         data = cut_pline.raw
         points = []
@@ -1,14 +1,27 @@
 from PyQt5.QtCore import QObject, pyqtSignal
 import fileutils
+import instrumentation
+import nesting
 import pathlib
+import sequencer
+import threading
 from job import Job
+from collision import CollisionDetector
 
 class Project(QObject):
     job_update = pyqtSignal()
+    # rapid travel of the last generated tasks and travel saved by
+    # sequencing, in mm
+    travel_update = pyqtSignal(float, float)
+    _nesting_ready = pyqtSignal(object, object)
 
     def __init__(self):
         super().__init__()
         self.jobs = list()
+        self.travel = 0.
+        self.travel_saved = 0.
+        self.collision_detector = CollisionDetector(self)
+        self._nesting_ready.connect(self._on_nesting_ready)
 
     def load_job(self, filepath):
         try:
@@ -22,11 +35,56 @@ class Project(QObject):
         self.jobs = [j for j in self.jobs if j not in jobs]
         self.job_update.emit()
 
+    def nest_jobs(self, sheet, time_budget=10.):
+        """Place jobs on the sheet polyline, searching in the background."""
+        jobs = list(self.jobs)
+        def run():
+            try:
+                placements = nesting.nest(jobs, sheet, time_budget=time_budget)
+            except Exception as e:
+                print('Unable to nest jobs, ' + str(e))
+                return
+            self._nesting_ready.emit(jobs, placements)
+        threading.Thread(target=run, daemon=True).start()
+
+    def _on_nesting_ready(self, jobs, placements):
+        # jobs removed during the search are left out
+        kept = [(j, p) for j, p in zip(jobs, placements) if j in self.jobs]
+        jobs = [j for j, p in kept]
+        placements = [p for j, p in kept]
+        nesting.apply(jobs, placements)
+        unplaced = placements.count(None)
+        if unplaced:
+            print(str(unplaced) + ' jobs do not fit on the sheet.')
+        self.job_update.emit()
+
     def generate_tasks(self, post_processor, dry_run):
-        tasks = []
+        cuts, plines, pierces = [], [], []
         for job in self.jobs:
+            # pulled first, cut states follow the cut count
+            job_plines = job.get_cut_plines()
+            job_pierces = job.get_pierces()
             for i in job.cut_state_indices(Job.TODO):
-                tasks.append(post_processor.generate(job, i, dry_run))
-        if tasks:
-            tasks.insert(0, post_processor.init_task())
+                if i < len(job_plines):
+                    cuts.append((job, i))
+                    plines.append(job_plines[i])
+                    pierces.append(job_pierces[i])
+        if not cuts:
+            return []
+        # cut order minimizing travel from machine origin
+        if instrumentation.enabled:
+            order, entries = instrumentation.call('project', 'sequence',
+                                                  sequencer.sequence, plines,
+                                                  (0., 0.), pierces)
+        else:
+            order, entries = sequencer.sequence(plines, pierces=pierces)
+        initial = sequencer.travel(plines, range(len(cuts)), [0] * len(cuts),
+                                   pierces=pierces)
+        self.travel = sequencer.travel(plines, order, entries, pierces=pierces)
+        self.travel_saved = initial - self.travel
+        self.travel_update.emit(self.travel, self.travel_saved)
+
+        tasks = [post_processor.generate(*cuts[k], dry_run, entries[k])
+                 for k in order]
+        tasks.insert(0, post_processor.init_task())
         return tasks
@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Cut ordering minimizing rapid travel between the end of a cut and the
+pierce of the next one.
+
+Contours have to be cut before the closed contour containing them (holes
+before their exterior, parts nested in a hole before the hole). A closed
+cut can be entered at any of its vertices, an open one at its start only.
+Given pierces from leads.candidates, a cut is entered at the pierce point of
+one of its candidate vertices, the cost of the candidate being added to the
+travel to it.
+
+Nearest neighbour construction scans every cut at each step, its time grows
+with the square of the cut count. It stays under a second up to about 5000
+cuts, improvement moves being cheaper past that.
+"""
+from collections import deque
+import math
+import numpy as np
+
+import polyline as pl
+
+# candidate cuts looked at from each cut by the improvement moves
+NEIGHBOURS = 8
+# longest chain of consecutive cuts moved at once by Or-opt
+OR_OPT_LENGTH = 3
+# rounds of entry selection followed by improvement
+ROUNDS = 2
+
+def travel(plines, order, entries, origin=(0., 0.), pierces=None):
+    """Return rapid travel length of cutting plines in order from origin."""
+    position = np.array(origin, dtype=float)
+    length = 0.
+    for i in order:
+        vertices = plines[i].raw
+        entry = vertices[:2,entries[i]]
+        pierce = entry
+        if pierces is not None:
+            ids, _, points = pierces[i]
+            found = np.flatnonzero(ids == entries[i])
+            if found.size:
+                pierce = points[:,found[0]]
+        length += np.linalg.norm(pierce - position)
+        position = entry if plines[i].is_closed() else vertices[:2,-1]
+    return length
+
+def sequence(plines, origin=(0., 0.), pierces=None):
+    """Return (order, entries) of plines, order being the indices of plines
+    in cut order and entries the index of the start vertex of each of them.
+    pierces gives for each of plines its (vertices, costs, pierce points)
+    entry candidates.
+    """
+    n = len(plines)
+    if n == 0:
+        return [], []
+    return _Sequencer(plines, origin, pierces).run()
+
+class _Sequencer:
+    def __init__(self, plines, origin, pierces):
+        self.plines = plines
+        self.n = n = len(plines)
+        self.closed = [p.is_closed() for p in plines]
+        self.entries = [0] * n
+        if pierces is None:
+            pierces = [None] * n
+        # (vertices, costs, entry points) of the entries of each cut
+        self.candidates = [c if c is not None else self._vertex_candidates(p)
+                           for p, c in zip(plines, pierces)]
+
+        # cut i must be cut before parents[i]
+        self.parents = pl.find_parents(plines)
+        self.children = [[] for i in range(n)]
+        for i, parent in enumerate(self.parents):
+            if parent is not None:
+                self.children[parent].append(i)
+
+        # entry and exit points, index n stands for origin
+        self.nx = [float(p.start[0]) for p in plines] + [float(origin[0])]
+        self.ny = [float(p.start[1]) for p in plines] + [float(origin[1])]
+        self.ex = [float(p.end[0]) for p in plines] + [float(origin[0])]
+        self.ey = [float(p.end[1]) for p in plines] + [float(origin[1])]
+        for i in range(n):
+            self._set_entry(i, 0)
+        # entry and exit of a cut differ for open cuts and lead-ins
+        self.has_open = not all(self.closed) or any(c is not None
+                                                    for c in pierces)
+
+    def run(self):
+        self.order = self._nearest_neighbour()
+        for r in range(ROUNDS):
+            self._select_entries()
+            self._update_positions(0, self.n - 1)
+            if r == 0:
+                # entries move little afterwards
+                self.neighbours = self._neighbours()
+            self._improve()
+        return self.order, self.entries
+
+    def d(self, a, b):
+        """Travel from exit of cut a to entry of cut b, b None at the end."""
+        if b is None:
+            return 0.
+        return math.hypot(self.ex[a] - self.nx[b], self.ey[a] - self.ny[b])
+
+    def _vertex_candidates(self, pline):
+        vertices = pline.raw
+        if not pline.is_closed():
+            return np.array([0]), np.array([0.]), vertices[:2,:1]
+        n = vertices.shape[1]
+        return np.arange(n), np.zeros(n), vertices[:2]
+
+    def _set_entry(self, i, candidate):
+        """Enter cut i at its candidate of index candidate."""
+        ids, _, points = self.candidates[i]
+        vertex = int(ids[candidate])
+        self.entries[i] = vertex
+        self.nx[i], self.ny[i] = (float(v) for v in points[:,candidate])
+        if self.closed[i]:
+            x, y = self.plines[i].raw[:2,vertex]
+            self.ex[i], self.ey[i] = float(x), float(y)
+
+    # CONSTRUCTION #############################################################
+    def _nearest_neighbour(self):
+        """Cut next the closest cut whose contained cuts are all done, entering
+        closed cuts at their closest candidate.
+        """
+        n = self.n
+        bounds = pl.PolylineSet(self.plines).bounds
+        lo_x, lo_y = bounds[:,0,0].copy(), bounds[:,0,1].copy()
+        hi_x, hi_y = bounds[:,1,0].copy(), bounds[:,1,1].copy()
+        for i, (_, _, points) in enumerate(self.candidates):
+            # pierce points may lie out of the cut
+            lo_x[i], lo_y[i] = np.minimum((lo_x[i], lo_y[i]), points.min(axis=1))
+            hi_x[i], hi_y[i] = np.maximum((hi_x[i], hi_y[i]), points.max(axis=1))
+        # candidate costs add to the distance of any entry
+        min_costs = np.array([costs.min() for _, costs, _ in self.candidates])
+        blocked = np.array([len(c) for c in self.children])
+        available = blocked == 0
+        x, y = self.nx[n], self.ny[n]
+        order = []
+        for step in range(n):
+            # box distance plus the lowest cost is a lower bound of the
+            # distance to a cut, only cuts whose bound is under the distance
+            # to the closest box can be closer
+            dx = np.maximum(np.maximum(lo_x - x, x - hi_x), 0.)
+            dy = np.maximum(np.maximum(lo_y - y, y - hi_y), 0.)
+            bound = np.hypot(dx, dy) + min_costs
+            bound[~available] = np.inf
+            best, best_vertex, best_dist = None, 0, np.inf
+            candidates = [int(np.argmin(bound))]
+            while candidates:
+                for c in candidates:
+                    vertex, dist = self._closest_vertex(c, x, y)
+                    if dist < best_dist:
+                        best, best_vertex, best_dist = c, vertex, dist
+                    bound[c] = np.inf
+                candidates = np.flatnonzero(bound < best_dist).tolist()
+            order.append(best)
+            available[best] = False
+            parent = self.parents[best]
+            if parent is not None:
+                blocked[parent] -= 1
+                if blocked[parent] == 0:
+                    available[parent] = True
+            self._set_entry(best, best_vertex)
+            x, y = self.ex[best], self.ey[best]
+        return order
+
+    def _closest_vertex(self, c, x, y):
+        """Return (candidate, distance) of the entry of cut c closest to x, y,
+        costs included.
+        """
+        _, costs, points = self.candidates[c]
+        dist = np.hypot(points[0] - x, points[1] - y) + costs
+        candidate = int(np.argmin(dist))
+        return candidate, dist[candidate]
+    # !CONSTRUCTION ############################################################
+
+    def _select_entries(self):
+        """Enter each closed cut at the candidate closest to the way from the
+        previous cut to the next one.
+        """
+        order = self.order
+        for k, i in enumerate(order):
+            if not self.closed[i]:
+                continue
+            prev = order[k-1] if k else self.n
+            ids, costs, points = self.candidates[i]
+            vertices = self.plines[i].raw[:2,ids]
+            dist = costs + np.hypot(points[0] - self.ex[prev],
+                                    points[1] - self.ey[prev])
+            if k + 1 < len(order):
+                next = order[k+1]
+                dist += np.hypot(vertices[0] - self.nx[next],
+                                 vertices[1] - self.ny[next])
+            self._set_entry(i, int(np.argmin(dist)))
+
+    def _neighbours(self):
+        """Return for each cut its closest cuts by entry points, closest
+        first.
+        """
+        x, y = np.array(self.nx[:-1]), np.array(self.ny[:-1])
+        k = min(NEIGHBOURS, self.n - 1)
+        neighbours = []
+        if k <= 0:
+            return [[] for i in range(self.n)]
+        for start in range(0, self.n, 256):
+            chunk = slice(start, start + 256)
+            dist = ((x[chunk,None] - x[None])**2 + (y[chunk,None] - y[None])**2)
+            rows = np.arange(dist.shape[0])
+            dist[rows,rows + start] = np.inf
+            nearest = np.argpartition(dist, k - 1, axis=1)[:,:k]
+            rows = rows[:,None]
+            nearest = nearest[rows,np.argsort(dist[rows,nearest], axis=1)]
+            neighbours += nearest.tolist()
+        return neighbours
+
+    def _update_positions(self, first, last):
+        """Update positions of cuts between positions first and last."""
+        if first == 0 and last == self.n - 1:
+            self.pos = [0] * self.n
+        for k in range(first, last + 1):
+            self.pos[self.order[k]] = k
+        if self.has_open:
+            # reversing a chain changes travel inside it when cuts are open,
+            # reversal[j] - reversal[i] is that change for positions i..j
+            if first == 0 and last == self.n - 1:
+                self._points = [np.array(self.nx), np.array(self.ny),
+                                np.array(self.ex), np.array(self.ey)]
+            nx, ny, ex, ey = self._points
+            order = np.array(self.order)
+            a, b = order[:-1], order[1:]
+            gain = (np.hypot(ex[b] - nx[a], ey[b] - ny[a]) -
+                    np.hypot(ex[a] - nx[b], ey[a] - ny[b]))
+            self.reversal = np.concatenate(([0.], np.cumsum(gain))).tolist()
+
+    # IMPROVEMENT ##############################################################
+    def _improve(self):
+        """Apply improving moves around every cut until none is found, a
+        cut being looked at again only when a move changed its neighbours.
+        """
+        active = deque(self.order)
+        queued = [True] * self.n
+        while active:
+            c = active.popleft()
+            queued[c] = False
+            k = self.pos[c]
+            touched = self._two_opt(k) or self._or_opt(k)
+            if touched:
+                for t in touched + [c]:
+                    if t is not None and t != self.n and not queued[t]:
+                        queued[t] = True
+                        active.append(t)
+
+    def _at(self, k):
+        """Cut at position k, origin before the first and None after the
+        last.
+        """
+        if k < 0:
+            return self.n
+        if k >= self.n:
+            return None
+        return self.order[k]
+
+    def _two_opt(self, i):
+        """Reverse a chain starting at position i so that the cut before it
+        leads to one of its neighbours.
+        """
+        d, at, pos = self.d, self._at, self.pos
+        prev, first = at(i - 1), at(i)
+        if prev == self.n:
+            return None
+        removed = d(prev, first)
+        for c in self.neighbours[prev]:
+            added = d(prev, c)
+            # neighbours further than the removed link cannot improve
+            if added >= removed:
+                break
+            j = pos[c]
+            if j <= i:
+                continue
+            next = at(j + 1)
+            delta = added + d(first, next) - removed - d(c, next)
+            if self.has_open:
+                delta += self.reversal[j] - self.reversal[i]
+            if delta < -1e-9 and self._can_reverse(i, j):
+                self.order[i:j+1] = self.order[i:j+1][::-1]
+                self._update_positions(i, j)
+                return [prev, first, c, next]
+        return None
+
+    def _can_reverse(self, i, j):
+        for c in self.order[i:j+1]:
+            parent = self.parents[c]
+            if parent is not None and i <= self.pos[parent] <= j:
+                return False
+        return True
+
+    def _or_opt(self, i):
+        """Move the chain of cuts from position i next to a neighbour of its
+        first or last cut.
+        """
+        d, at, pos = self.d, self._at, self.pos
+        for length in range(1, OR_OPT_LENGTH + 1):
+            j = i + length - 1
+            if j >= self.n:
+                break
+            first, last = at(i), at(j)
+            prev, next = at(i - 1), at(j + 1)
+            removed = d(prev, first) + d(last, next) - d(prev, next)
+            # insert after q, so that q leads to first, or before r so that
+            # last leads to r, neighbours further than removed cannot improve
+            targets = []
+            for q in self.neighbours[first]:
+                if d(q, first) >= removed:
+                    break
+                targets.append(pos[q])
+            for r in self.neighbours[last]:
+                if d(last, r) >= removed:
+                    break
+                targets.append(pos[r] - 1)
+            for k in targets:
+                if i - 1 <= k <= j:
+                    continue
+                q, r = at(k), at(k + 1)
+                inserted = d(q, first) + d(last, r) - d(q, r)
+                if inserted - removed < -1e-9 and self._can_move(i, j, k):
+                    chain = self.order[i:j+1]
+                    if k > j:
+                        self.order[i:k+1] = self.order[j+1:k+1] + chain
+                        self._update_positions(i, k)
+                    else:
+                        self.order[k+1:j+1] = chain + self.order[k+1:i]
+                        self._update_positions(k + 1, j)
+                    return [prev, first, last, next, q, r]
+        return None
+
+    def _can_move(self, i, j, k):
+        """Return whether chain i..j can move after position k."""
+        chain = self.order[i:j+1]
+        if k > j:
+            # chain moves after cuts j+1..k, none of them may contain it
+            for c in chain:
+                parent = self.parents[c]
+                if parent is not None and j < self.pos[parent] <= k:
+                    return False
+        else:
+            # chain moves before cuts k+1..i-1, none of them may be inside
+            for c in chain:
+                for child in self.children[c]:
+                    if k < self.pos[child] < i:
+                        return False
+        return True
+    # !IMPROVEMENT #############################################################
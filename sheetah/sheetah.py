@@ -3,10 +3,14 @@
 from PyQt5 import QtWidgets
 from PyQt5.QtCore import Qt
 import pyqtgraph as pg
+import os
 
 
+import instrumentation
 from project import Project
-from klippercontroller import KlipperController, KlipperControllerUI
+from asynccontroller import ControllerBridge
+from klippercontroller import (KlipperController, AsyncKlipperController,
+                               KlipperControllerUI)
 from postprocessor import PostProcessor
 
 from workspacegraphics import WorkspaceView, ProjectBar
@@ -32,6 +36,10 @@ class MainWindow(QtWidgets.QMainWindow):
 
 if __name__ == '__main__':
     app = QtWidgets.QApplication([])
+    # SHEETAH_STATS=<file> records pipeline stats, dumped every 10 seconds
+    if os.environ.get('SHEETAH_STATS'):
+        instrumentation.enable()
+        instrumentation.start_dump(os.environ['SHEETAH_STATS'])
     pg.setConfigOption('background', 'w')
 
     app.setStyleSheet(open('style/darkorange.stylesheet').read())
@@ -45,7 +53,12 @@ if __name__ == '__main__':
     ws_controller = WorkspaceController(project, ws_view)
 
     post_processor = PostProcessor()
-    controller = KlipperController(project, post_processor)
+    # SHEETAH_ASYNC=1 runs the controller on an asyncio loop
+    if os.environ.get('SHEETAH_ASYNC'):
+        controller = ControllerBridge(AsyncKlipperController(project,
+                                                             post_processor))
+    else:
+        controller = KlipperController(project, post_processor)
     controller_ui = KlipperControllerUI(controller)
 
     main_window = MainWindow(ws_view,
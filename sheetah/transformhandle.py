@@ -1,4 +1,4 @@
-from PyQt5 import QtWidgets, QtGui
+from PyQt5 import QtCore, QtWidgets, QtGui
 from PyQt5.QtCore import Qt
 
 class HandleIcon(QtWidgets.QGraphicsPixmapItem):
@@ -50,8 +50,21 @@ class TransformHandle(QtWidgets.QGraphicsRectItem):
         self.setZValue(2)
         self.rotate = RotateHandle('resources/rotate_icon.png', self, controller)
         self.scale = ScaleHandle('resources/scale_icon.png', self, controller)
+        self._update_requested = False
         self.hide()
 
+    def request_update(self):
+        """Update once on next event loop iteration, whatever the number of
+        requests until then.
+        """
+        if not self._update_requested:
+            self._update_requested = True
+            QtCore.QTimer.singleShot(0, self._requested_update)
+
+    def _requested_update(self):
+        self._update_requested = False
+        self.update()
+
     def update(self):
         # TODO handle error scene == None ?
         if self.scene().selectedItems():
@@ -0,0 +1,18 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Process pool shared by file loading and nesting, created on first use."""
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+_lock = threading.Lock()
+_executor = None
+
+def pool():
+    global _executor
+    with _lock:
+        if _executor is None:
+            # spawn as the GUI process runs Qt threads that must not be forked
+            context = multiprocessing.get_context('spawn')
+            _executor = ProcessPoolExecutor(mp_context=context)
+        return _executor
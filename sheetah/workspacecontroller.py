@@ -4,6 +4,7 @@ import math
 
 from transformhandle import TransformHandle
 from jobgraphics import JobVisual, JobVisualProxy
+import nesting
 from pyqtgraph import Point
 
 class WorkspaceController:
@@ -22,7 +23,10 @@ class WorkspaceController:
         self.scene.addItem(self.handle)
 
         self.project.job_update.connect(self.on_job_update)
+        self.project.collision_detector.collision_update.connect(
+            self.on_collision_update)
         self.scene.selectionChanged.connect(self.on_selection)
+        self.view.scale_update.connect(self.on_view_scale)
 
     def delete_selection(self):
         self.project.remove_jobs([item.job
@@ -63,7 +67,7 @@ class WorkspaceController:
         for item in self.items:
             item.job.position += self.pos
         self.items = []
-        self.handle.update()
+        self.handle.request_update()
         self._grab = False
 
     def start_rot(self, pos):
@@ -88,7 +92,7 @@ class WorkspaceController:
         for item in self.items:
             item.job.turn_around(self.origin, self.angle)
         self.items = []
-        self.handle.update()
+        self.handle.request_update()
 
     def start_scale(self, pos):
         self._create_proxy_items()
@@ -112,7 +116,7 @@ class WorkspaceController:
         for item in self.items:
             item.job.scale_around(self.origin, self.scale)
         self.items = []
-        self.handle.update()
+        self.handle.request_update()
 
     def on_job_update(self):
         jobs = self.project.jobs.copy()
@@ -131,9 +135,20 @@ class WorkspaceController:
             jv = JobVisual(self, j)
             self.job_visuals.append(jv)
             self.scene.addItem(jv)
+        self.on_collision_update()
+
+    def on_collision_update(self):
+        detector = self.project.collision_detector
+        for jv in self.job_visuals:
+            jv.set_colliding(detector.colliding(jv.job))
+
+    def on_view_scale(self):
+        pixel_size = self.view.pixel_size()
+        for jv in self.job_visuals:
+            jv.on_view_scale(pixel_size)
 
     def on_selection(self):
-        self.handle.update()
+        self.handle.request_update()
 
     def keyPressEvent(self, ev):
         if ev.modifiers() == Qt.NoModifier:
@@ -154,6 +169,12 @@ class WorkspaceController:
             elif ev.key() == Qt.Key_S:
                 # Ctrl + S
                 print('Save')
+            elif ev.key() == Qt.Key_N:
+                # Ctrl + N
+                rect = self.view.machine.rect()
+                self.project.nest_jobs(nesting.rect_sheet(rect.x(), rect.y(),
+                                                          rect.width(),
+                                                          rect.height()))
         elif ev.modifiers() == (Qt.ControlModifier | Qt.ShiftModifier):
             if ev.key() == Qt.Key_Z:
                 # Ctrl + Shift + Z
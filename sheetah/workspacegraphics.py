@@ -8,11 +8,18 @@ class ProjectBar(QtGui.QWidget):
         self.project = project
 
         self.load_btn = QtGui.QPushButton('load')
+        self.travel_label = QtWidgets.QLabel()
         layout = QtGui.QVBoxLayout()
         layout.addWidget(self.load_btn)
+        layout.addWidget(self.travel_label)
         self.setLayout(layout)
 
         self.load_btn.clicked.connect(self.on_load)
+        self.project.travel_update.connect(self.on_travel_update)
+
+    def on_travel_update(self, travel, saved):
+        self.travel_label.setText('Travel %.0f mm, %.0f mm saved by '
+                                  'sequencing' % (travel, saved))
 
     def on_load(self):
         filepath, _ = QtGui.QFileDialog.getOpenFileName(self,
@@ -22,6 +29,8 @@ class ProjectBar(QtGui.QWidget):
             self.project.load_job(filepath)
 
 class WorkspaceView(QtWidgets.QGraphicsView):
+    scale_update = QtCore.pyqtSignal()
+
     def __init__(self):
         super().__init__(QtWidgets.QGraphicsScene())
         self.controller = None
@@ -84,6 +93,10 @@ class WorkspaceView(QtWidgets.QGraphicsView):
         # focus loss to prevent that.
         self.lastScenePosOutdated = False
 
+    def pixel_size(self):
+        """Return size of a screen pixel in scene units."""
+        return 1. / abs(self.transform().m11())
+
     def on_frame(self):
         cvImg = self.video_thread.frame
         height, width, channel = cvImg.shape
@@ -117,6 +130,7 @@ class WorkspaceView(QtWidgets.QGraphicsView):
         viewport.translate(new_center - viewport.center())
         self.setSceneRect(viewport)
         self.selecting = False
+        self.scale_update.emit()
 
     def mouseDoubleClickEvent(self, ev):
         self.posSyncCheck(ev)
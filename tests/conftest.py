@@ -0,0 +1,14 @@
+import os
+import sys
+
+# modules of sheetah import each other by bare name
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'sheetah'))
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import pytest
+
+@pytest.fixture(scope='session')
+def qapp():
+    """Application delivering queued signals when events are processed."""
+    from PyQt5 import QtWidgets
+    return QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
@@ -0,0 +1,33 @@
+"""Stand-ins for the project, jobs and post processor driven by
+controllers.
+"""
+import threading
+
+from job import JobTask, Task
+
+class FakeJob:
+    """Records the cut states set by tasks."""
+    def __init__(self):
+        self.states = {}
+
+    def set_cut_state(self, index, state):
+        self.states[index] = state
+
+class FakeProject:
+    """Generates tasks of count commands each, one per cut of job."""
+    def __init__(self, tasks=3, count=10):
+        self.job = FakeJob()
+        self.cmd_lists = [['G1 X%d Y%d' % (t, k) for k in range(count)]
+                          for t in range(tasks)]
+        self.threads = []
+
+    def generate_tasks(self, post_processor, dry_run):
+        self.threads.append(threading.current_thread())
+        return [JobTask(list(c), self.job, t, dry_run)
+                for t, c in enumerate(self.cmd_lists)]
+
+class FakePostProcessor:
+    emergency = ['M5', 'G0 Z10']
+
+    def emergency_task(self):
+        return Task(list(self.emergency))
@@ -0,0 +1,281 @@
+"""Former implementations replaced by faster ones, kept as references for
+tests and benchmarks.
+"""
+import math
+import numpy as np
+import random
+
+import polyline as pl
+
+def tessellate(vertices, closed, precision=1e-3):
+    """Per segment loop of Polyline._update_lines before user-001."""
+    points = []
+    n = vertices.shape[1]
+    for i in range(n - int(not closed)):
+        a = vertices[:2,i]
+        b = vertices[:2,(i+1)%n]
+        bulge = vertices[2,i]
+        if points:
+            points.pop(-1)
+        if math.isclose(bulge, 0):
+            points += [a, b]
+        else:
+            rot = np.array([[0,-1],
+                            [1, 0]])
+            on_right = bulge >= 0
+            if not on_right:
+                rot = -rot
+            bulge = abs(bulge)
+            ab = b-a
+            chord = np.linalg.norm(ab)
+            radius = chord * (bulge + 1. / bulge) / 4
+            center_offset = radius - chord * bulge / 2
+            center = a + ab/2 + center_offset / chord * rot.dot(ab)
+
+            a_dir = a - center
+            b_dir = b - center
+            rad_start = math.atan2(a_dir[1], a_dir[0])
+            rad_end   = math.atan2(b_dir[1], b_dir[0])
+
+            if not math.isclose(rad_start, rad_end):
+                if on_right != (rad_start < rad_end):
+                    if on_right:
+                        rad_start -= 2*math.pi
+                    else:
+                        rad_end -= 2*math.pi
+
+                rad_len = abs(rad_end - rad_start)
+                if radius > precision:
+                    max_angle = 2 * math.acos(1.0 - precision / radius)
+                else:
+                    max_angle = math.pi
+                nb_segments = max(2, math.ceil(rad_len / max_angle) + 1)
+
+                angles = np.linspace(rad_start, rad_end, nb_segments + 1)
+                arc_data = (center.reshape(2,1) + radius *
+                            np.vstack((np.cos(angles), np.sin(angles))))
+                points += np.transpose(arc_data).tolist()
+    return np.transpose(np.array(points))
+
+class KdTree:
+    """Joint tree of aggregate before user-004."""
+    def __init__(self, connector, split_dir=True, precision=1e-2):
+        self._connectors = [connector]
+        self._split_dir = split_dir # True is for vertical
+        self._precision = precision
+        self._pos = connector.pos
+        self._tl_child = self._br_child = None
+        self._complex_joint = False
+
+    def insert(self, connector):
+        if np.allclose(connector.pos, self._pos, atol=self._precision):
+            if not self._complex_joint:
+                if len(self._connectors) == 2:
+                    self._complex_joint = True
+                    for e in self._connectors:
+                        e.disconnect()
+                else:
+                    connector.connect(self._connectors[0])
+            self._connectors.append(connector)
+            return
+
+        if self._split_dir: # vertical split
+            tl = connector.pos[0] < self._pos[0]
+        else: # horizontal split
+            tl = connector.pos[1] > self._pos[1]
+
+        if tl:
+            if self._tl_child is not None:
+                self._tl_child.insert(connector)
+            else:
+                self._tl_child = KdTree(connector, not self._split_dir)
+        else:
+            if self._br_child is not None:
+                self._br_child.insert(connector)
+            else:
+                self._br_child = KdTree(connector, not self._split_dir)
+
+def aggregate(polylines, shuffle=random.shuffle):
+    """KdTree aggregation of Polyline.aggregate before user-004."""
+    ready_polylines = [p for p in polylines if p._closed]
+    open_polylines = [p for p in polylines if not p._closed]
+    if not open_polylines:
+        return ready_polylines
+
+    # shuffle polylines to ensure KdTree correct distribution
+    shuffle(open_polylines)
+
+    connectors = []
+    for p in open_polylines:
+        connectors += pl.EdgeConnector.polyline2connectors(p)
+    tree = KdTree(connectors[0])
+    for c in connectors[1:]:
+        tree.insert(c)
+
+    updated = True
+    while updated:
+        updated = False
+        for c in connectors:
+            if not c.connected() and not c.marked: # unprocessed single end
+                parts = []
+                updated = True
+                current = c
+                current.mark()
+                while current is not None:
+                    parts.append(current.polyline())
+                    current = current.opp_end
+                    current.mark()
+                    current = current.next
+                if len(parts) > 1:
+                    vertices = np.hstack([p._vertices[:,:-1] for p in parts[:-1]])
+                    vertices = np.hstack((vertices, parts[-1]._vertices))
+                    if np.allclose(vertices[:2,0], vertices[:2,-1], atol=1e-3):
+                        closed = True
+                        vertices = np.delete(vertices, -1, axis=1)
+                    else:
+                        closed = False
+                    ready_polylines.append(pl.Polyline(vertices, closed))
+                else:
+                    ready_polylines.append(parts[0])
+        if not updated: # no more single ends
+            for c in connectors: # look for a loop and cut it open
+                if c.connected() and not c.marked:
+                    c.disconnect()
+                    updated = True
+                    break
+    return ready_polylines
+
+def loop(polyline, limit_angle, selected_radius, loop_radius):
+    """np.insert based Polyline.loop before user-009."""
+    polyline = pl.Polyline._init_internal(np.copy(polyline._vertices),
+                                          polyline._closed)
+
+    limit_bulge = math.tan((math.pi - limit_angle) / 4)
+    ids = np.where(np.abs(polyline._vertices[2]) >= limit_bulge)[0]
+
+    cur = np.take(polyline._vertices, ids, axis=1)
+    next_ids = (ids+1)%polyline._vertices.shape[1]
+    next = np.take(polyline._vertices[:2], next_ids, axis=1)
+
+    # i, x, y, b, h_theta, vx, vy
+    data = np.vstack((ids, cur, 2*np.arctan(np.abs(cur[2])), next-cur[:2]))
+
+    # i, x, y, b, h_theta, vx, vy, d
+    data = np.vstack((data, np.linalg.norm(data[-2:], axis=0)))
+
+    radius = data[7] / (2 * np.sin(data[4]))
+    ignored = np.where(np.logical_not(np.isclose(radius, selected_radius)))[0]
+    data = np.delete(data, ignored, axis=1)
+
+    # i, x, y, b, h_theta, vx, vy, d, h
+    data = np.vstack((data, (data[7] + 2 * loop_radius * np.sin(data[4])) * np.tan(data[4]) / 2))
+
+    a = data[1:3]
+    ab = data[5:7]
+    normalized_ab = ab / data[7]
+    ab_normal = np.array([-normalized_ab[1], normalized_ab[0]])
+    h = data[8]
+    top = a + ab / 2 + ab_normal * h
+    half_top_side = loop_radius * np.sin(data[4])
+    new_a = top + normalized_ab * half_top_side
+    new_b = top - normalized_ab * half_top_side
+
+    new_b = np.insert(new_b, 2, 0, axis=0)
+    new_a = np.vstack((new_a, -1/data[3]))
+    for i in reversed(range(data.shape[1])):
+        id = int(data[0, i] + 0.1)
+        polyline._vertices[2, id] = 0
+
+        polyline._vertices = np.insert(polyline._vertices, id+1, new_b[:,i], axis=1)
+        polyline._vertices = np.insert(polyline._vertices, id+1, new_a[:,i], axis=1)
+
+    return polyline
+
+class HierarchyNode:
+    """Contour hierarchy node of group_as_contours before user-005."""
+    def __init__(self, polyline):
+        self._polyline = polyline
+        self._children = []
+
+    def polyline(self):
+        return self._polyline
+
+    def contains(self, other):
+        return self._polyline.contains(other._polyline)
+
+    def add_child(self, child):
+        self._children.append(child)
+
+    def children(self):
+        return self._children
+
+def append_to_hierarchy(hierarchy, node):
+    children_id = []
+    for i, n in enumerate(hierarchy):
+        if node.contains(n):
+            children_id.append(i)
+    if children_id:
+        for i in sorted(children_id, reverse=True):
+            node.add_child(hierarchy.pop(i))
+        hierarchy.append(node)
+        return
+
+    for n in hierarchy:
+        if n.contains(node):
+            append_to_hierarchy(n.children(), node)
+            return
+
+    hierarchy.append(node)
+
+def group_as_contours(polylines):
+    """Shapely containment grouping of polyline.group_as_contours before
+    user-005.
+    """
+    hierarchy = [HierarchyNode(polylines[0])]
+    for polyline in polylines[1:]:
+        append_to_hierarchy(hierarchy, HierarchyNode(polyline))
+    return pl.extract_groups(hierarchy)
+
+class InputDecisionTree:
+    """Prefix tree of controllerbase.InputDecisionTree before user-023."""
+    def __init__(self, default_function=None):
+        self._prefix = ''
+        self._function = default_function
+        self._children = []
+
+    def _node_create(prefix, function):
+        node = InputDecisionTree.__new__(InputDecisionTree)
+        node._prefix = prefix
+        node._function = function
+        node._children = []
+        return node
+
+    def append_node(self, prefix, function):
+        node = InputDecisionTree._node_create(prefix, function)
+        pos = self
+        pos_changed = True
+        while pos_changed:
+            pos_changed = False
+            for child in pos._children:
+                if node._prefix.startswith(child._prefix):
+                    pos = child
+                    pos_changed = True
+                    break
+        node_children = [index for index, child in enumerate(pos._children)
+                         if child._prefix.startswith(node._prefix)]
+        for index in sorted(node_children, reverse=True):
+            node._children.append(pos._children.pop(index))
+        pos._children.append(node)
+
+    def process_input(self, input):
+        pos = self
+        pos_changed = True
+        while pos_changed:
+            pos_changed = False
+            for child in pos._children:
+                if input.startswith(child._prefix):
+                    pos = child
+                    pos_changed = True
+                    break
+        if pos._function is not None:
+            pos._function(input)
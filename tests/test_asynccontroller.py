@@ -0,0 +1,154 @@
+import os
+import select
+import threading
+import time
+import pytest
+
+from fakes import FakePostProcessor, FakeProject
+from job import Job
+from klippercontroller import AsyncKlipperController
+
+def wait_for(condition, timeout=5.):
+    end = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > end:
+            raise AssertionError('timed out')
+        time.sleep(.005)
+
+class Machine:
+    """Far end of a pty, recording received lines and answering them on
+    demand, or right away if auto_ack.
+    """
+    def __init__(self, auto_ack=False):
+        self.master, slave = os.openpty()
+        self.path = os.ttyname(slave)
+        self._slave = slave
+        self.auto_ack = auto_ack
+        self.lines = []
+        self._buffer = b''
+        self._unplugged = False
+        self._thread = threading.Thread(target=self._read, daemon=True)
+        self._thread.start()
+
+    def _read(self):
+        while not self._unplugged:
+            if not select.select([self.master], [], [], .02)[0]:
+                continue
+            try:
+                data = os.read(self.master, 4096)
+            except OSError:
+                return
+            if not data:
+                return
+            lines = (self._buffer + data).split(b'\n')
+            self._buffer = lines.pop()
+            for line in lines:
+                self.lines.append(line.decode('ascii'))
+                if self.auto_ack:
+                    self.write('ok')
+
+    def write(self, *lines):
+        os.write(self.master, b''.join(l.encode('ascii') + b'\n'
+                                       for l in lines))
+
+    def ack(self, count):
+        self.write(*['ok'] * count)
+
+    def unplug(self):
+        # a read blocked on master would keep the link open
+        self._unplugged = True
+        self._thread.join()
+        os.close(self.master)
+        os.close(self._slave)
+
+@pytest.fixture
+def machine():
+    return Machine()
+
+@pytest.fixture
+def controller(machine):
+    controller = AsyncKlipperController(FakeProject(), FakePostProcessor())
+    controller.printer_path = machine.path
+    controller.connect()
+    assert controller.is_inactive()
+    yield controller
+    if not controller.is_unconnected():
+        controller.abort()
+        machine.auto_ack = True
+        machine.ack(controller.window_commands)
+        wait_for(controller.is_inactive)
+        assert controller.disconnect()
+
+def test_commands_arrive_in_order(controller, machine):
+    machine.auto_ack = True
+    controller.run(False)
+    commands = sum(controller.project.cmd_lists, [])
+    wait_for(lambda: len(machine.lines) == len(commands))
+    wait_for(controller.is_inactive)
+    assert machine.lines == commands
+    assert controller.project.job.states == {0: Job.DONE, 1: Job.DONE,
+                                             2: Job.DONE}
+    # tasks are generated off the loop thread
+    assert controller.project.threads == [threading.current_thread()]
+
+def test_window_limits_commands_in_flight(controller, machine):
+    controller.run(False)
+    wait_for(lambda: len(machine.lines) == controller.window_commands)
+    time.sleep(.05)
+    assert len(machine.lines) == controller.window_commands
+    machine.ack(4)
+    wait_for(lambda: len(machine.lines) == controller.window_commands + 4)
+    assert controller.project.job.states == {0: Job.RUNNING,
+                                             1: Job.RUNNING}
+
+def test_error_mid_window(controller, machine):
+    job = controller.project.job
+    controller.run(False)
+    wait_for(lambda: len(machine.lines) == controller.window_commands)
+    # commands 4 to 9 of task 0 and the whole task 1 in flight, task 2
+    # waits for the window
+    machine.ack(4)
+    wait_for(lambda: len(machine.lines) == 20)
+    machine.write('!! Move out of range')
+    wait_for(controller.in_safe_mode)
+    assert job.states == {0: Job.FAILED, 1: Job.FAILED}
+    # commands in flight are still answered, the emergency task follows
+    machine.ack(16)
+    wait_for(lambda: len(machine.lines) == 22)
+    assert machine.lines[20:] == FakePostProcessor.emergency
+    machine.ack(2)
+    wait_for(controller.is_inactive)
+    assert job.states == {0: Job.FAILED, 1: Job.FAILED}
+
+def test_link_loss_fails_started_tasks(controller, machine):
+    job = controller.project.job
+    controller.run(False)
+    wait_for(lambda: len(machine.lines) == controller.window_commands)
+    machine.unplug()
+    wait_for(controller.is_unconnected)
+    assert job.states == {0: Job.FAILED, 1: Job.FAILED}
+    controller._loop_thread.join(5.)
+    assert not controller._loop_thread.is_alive()
+
+def test_disconnect_from_another_thread(controller):
+    results = []
+    thread = threading.Thread(target=lambda: results.append(
+                              controller.disconnect()))
+    thread.start()
+    thread.join(5.)
+    assert results == [True]
+    assert controller.is_unconnected()
+    assert not controller._loop_thread.is_alive()
+
+def test_disconnect_after_queued_command(controller, machine):
+    controller.send_manual_cmd('G28')
+    # the command makes the controller active before the disconnection
+    thread = threading.Thread(target=controller.disconnect)
+    thread.start()
+    thread.join(5.)
+    assert not thread.is_alive()
+    wait_for(lambda: machine.lines == ['G28'])
+    machine.ack(1)
+    wait_for(controller.is_inactive)
+    assert controller.disconnect()
+    assert controller.is_unconnected()
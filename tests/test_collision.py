@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+import polyline as pl
+from job import Job
+from project import Project
+from test_job import settle
+
+KERF = Job.default_kerf_width
+
+@pytest.fixture(autouse=True)
+def app(qapp):
+    yield qapp
+    settle(qapp)
+
+def disc(radius, position):
+    job = Job('disc', [pl.circle2polyline([0., 0.], radius)])
+    job.position = position
+    return job
+
+def ring(outer, inner):
+    return Job('ring', [pl.circle2polyline([0., 0.], inner),
+                        pl.circle2polyline([0., 0.], outer)])
+
+def project_of(app, *jobs):
+    project = Project()
+    updates = []
+    project.collision_detector.collision_update.connect(
+        lambda: updates.append(True))
+    project.jobs = list(jobs)
+    project.job_update.emit()
+    settle(app)
+    return project, updates
+
+def pairs(project):
+    return {frozenset(pair) for pair in project.collision_detector.collisions()}
+
+# cut contours of discs of radius 20 are kerf / 2 wider
+@pytest.mark.parametrize('distance, colliding', [
+    (30., True),                      # overlapping
+    (40. + KERF, True),               # cut contours touching
+    (40. + KERF + 1e-2, False),       # separate
+    (200., False),                    # in cells far apart
+])
+def test_discs(app, distance, colliding):
+    a, b = disc(20., [0., 0.]), disc(20., [distance, 0.])
+    project, updates = project_of(app, a, b)
+    detector = project.collision_detector
+    assert detector.colliding(a) == detector.colliding(b) == colliding
+    assert pairs(project) == ({frozenset((a, b))} if colliding else set())
+    assert bool(updates) == colliding
+
+@pytest.mark.parametrize('position, colliding', [
+    ([0., 0.], False),                # in the hole
+    ([32.5, 0.], True),               # in the material, no contour crossing
+    ([25., 0.], True),                # across the hole contour
+])
+def test_part_in_ring(app, position, colliding):
+    outer, small = ring(40., 25.), disc(5., position)
+    project, _ = project_of(app, outer, small)
+    assert project.collision_detector.colliding(small) == colliding
+    assert project.collision_detector.colliding(outer) == colliding
+
+def test_collisions_follow_moves_and_removals(app):
+    a, b, c = (disc(20., [0., 0.]), disc(20., [30., 0.]),
+               disc(20., [100., 0.]))
+    project, updates = project_of(app, a, b, c)
+    assert pairs(project) == {frozenset((a, b))}
+    del updates[:]
+    # moved over c, away from a
+    b.position = [70., 0.]
+    settle(app)
+    assert pairs(project) == {frozenset((b, c))}
+    assert not project.collision_detector.colliding(a)
+    assert updates
+    del updates[:]
+    # unchanged collisions are not signalled again
+    b.position = [71., 0.]
+    settle(app)
+    assert pairs(project) == {frozenset((b, c))}
+    assert not updates
+    project.remove_jobs([c])
+    settle(app)
+    assert pairs(project) == set()
+    assert updates
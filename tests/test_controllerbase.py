@@ -0,0 +1,152 @@
+import queue
+import random
+import pytest
+
+import former
+from controllerbase import CommandStream, CommunicationLogger, InputDecisionTree
+from fakes import FakePostProcessor, FakeProject
+from job import Job
+
+KLIPPER_PREFIXES = ['ok', '!!', '// echo: THC_error']
+KLIPPER_LINES = ['ok', 'ok 12', '!! Move out of range', '!!',
+                 '// echo: THC_error 1.234 5.678 142.1 4998.0',
+                 '// echo: THC_', '// Klipper state: Ready', '', 'o', '!']
+
+def dispatch(tree_type, prefixes, lines, default=True):
+    """Return (function, line) of each call made by a tree of prefixes."""
+    calls = []
+    tree = tree_type((lambda l: calls.append((None, l))) if default else None)
+    for k, prefix in enumerate(prefixes):
+        tree.append_node(prefix, lambda l, k=k: calls.append((k, l)))
+    for line in lines:
+        tree.process_input(line)
+    return calls
+
+def test_klipper_dispatch():
+    calls = dispatch(InputDecisionTree, KLIPPER_PREFIXES, KLIPPER_LINES)
+    assert [k for k, _ in calls] == [0, 0, 1, 1, 2, None, None, None, None,
+                                     None]
+    assert calls == dispatch(former.InputDecisionTree, KLIPPER_PREFIXES,
+                             KLIPPER_LINES)
+
+def random_strings(rng, count, max_length):
+    return [''.join(rng.choice('ab/') for _ in range(rng.randint(0, max_length)))
+            for _ in range(count)]
+
+@pytest.mark.parametrize('seed', range(200))
+def test_same_dispatch_as_prefix_tree(seed):
+    rng = random.Random(seed)
+    # duplicates and the empty prefix included, the last one appended wins
+    prefixes = random_strings(rng, rng.randint(0, 12), 4)
+    lines = random_strings(rng, 100, 6)
+    default = seed % 2 == 0
+    assert (dispatch(InputDecisionTree, prefixes, lines, default) ==
+            dispatch(former.InputDecisionTree, prefixes, lines, default))
+
+class Stream(CommandStream):
+    """Command stream over a fake link, sending when asked to."""
+    window_commands = 4
+    window_bytes = 1024
+
+    def __init__(self, tasks=3, count=3):
+        self.project = FakeProject(tasks, count)
+        self.post_processor = FakePostProcessor()
+        self.manual_cmd_queue = queue.Queue()
+        self.com_logger = CommunicationLogger()
+        self.state = self.ST_INAC
+        self._reset_stream()
+        self.sent = []
+
+    def _wake_sender(self):
+        pass
+
+    def send(self):
+        """Send commands while the window allows it."""
+        while self.next_cmd is not None and not self._window_full():
+            self.sent.append(self.next_cmd)
+            self._sent()
+            assert len(self.in_flight) <= self.window_commands
+            assert (len(self.in_flight) == 1 or
+                    self.in_flight_bytes <= self.window_bytes)
+
+    def ack(self, count):
+        for _ in range(count):
+            self._complete_cmd()
+            self.send()
+
+def test_window_commands():
+    stream = Stream(3, 5)
+    stream._run(False)
+    stream.send()
+    assert stream.sent == stream.project.cmd_lists[0][:4]
+    stream.ack(1)
+    assert len(stream.sent) == 5 and len(stream.in_flight) == 4
+    stream.ack(11)
+    assert stream.sent == sum(stream.project.cmd_lists, [])
+    stream.ack(4)
+    assert stream.is_inactive()
+
+def test_window_bytes():
+    stream = Stream(1, 4)
+    stream.window_commands = 16
+    # commands take 9 bytes with their line end
+    stream.window_bytes = 20
+    stream._run(False)
+    stream.send()
+    assert len(stream.sent) == 2 and stream.in_flight_bytes == 18
+    stream.ack(1)
+    assert len(stream.sent) == 3
+
+def test_command_larger_than_byte_window_is_sent_alone():
+    stream = Stream(1, 3)
+    stream.window_bytes = 4
+    stream._run(False)
+    stream.send()
+    assert len(stream.sent) == 1
+    stream.ack(1)
+    assert len(stream.sent) == 2
+
+def test_task_closes_on_its_last_ack():
+    stream = Stream(2, 3)
+    stream.window_commands = 16
+    stream._run(False)
+    stream.send()
+    states = stream.project.job.states
+    assert len(stream.sent) == 6
+    assert states == {0: Job.RUNNING, 1: Job.RUNNING}
+    stream.ack(2)
+    assert states == {0: Job.RUNNING, 1: Job.RUNNING}
+    stream.ack(1)
+    assert states == {0: Job.DONE, 1: Job.RUNNING}
+    stream.ack(3)
+    assert states == {0: Job.DONE, 1: Job.DONE}
+    assert stream.is_inactive()
+
+def test_error_fails_in_flight_tasks_then_runs_emergency():
+    stream = Stream(3, 3)
+    stream._run(False)
+    stream.send()
+    states = stream.project.job.states
+    # three commands of task 0 and the first of task 1 in flight
+    stream._abort_internal('!! Move out of range')
+    assert stream.in_safe_mode()
+    assert states == {0: Job.FAILED, 1: Job.FAILED}
+    # the emergency task waits for the window, after commands in flight
+    stream.send()
+    assert len(stream.sent) == 4
+    stream.ack(4)
+    assert stream.sent[4:] == FakePostProcessor.emergency
+    stream.ack(2)
+    assert stream.is_inactive()
+    assert states == {0: Job.FAILED, 1: Job.FAILED}
+
+def test_error_keeps_task_waiting_for_window():
+    stream = Stream(2, 4)
+    stream._run(False)
+    stream.send()
+    states = stream.project.job.states
+    # the first command of task 1 is popped, the window is full
+    assert stream.next_task.task_id == 1
+    assert states == {0: Job.RUNNING}
+    stream._abort_internal('!! Move out of range')
+    assert states == {0: Job.FAILED}
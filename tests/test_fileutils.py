@@ -0,0 +1,79 @@
+import os
+import numpy as np
+import pytest
+
+import fileutils
+from test_job import settle
+
+@pytest.fixture(autouse=True)
+def app(qapp):
+    yield qapp
+    settle(qapp)
+
+def plates(rows, cols):
+    """Return entities of square plates drawn as lines, each with a round
+    hole and a slot, in shuffled drawing order.
+    """
+    entities = []
+    for row in range(rows):
+        for col in range(cols):
+            x, y = 60. * col, 60. * row
+            corners = [(x, y), (x + 50., y), (x + 50., y + 50.), (x, y + 50.)]
+            for start, end in zip(corners, corners[1:] + corners[:1]):
+                entities.append(('LINE', start, end))
+            entities.append(('CIRCLE', (x + 15., y + 25.), 5.))
+            slot = np.array([[x + 30., x + 40., x + 40., x + 30.],
+                             [y + 20., y + 20., y + 30., y + 30.],
+                             [0., 1., 0., 1.]])
+            entities.append(('LWPOLYLINE', slot, True))
+    order = np.random.default_rng(0).permutation(len(entities))
+    return [entities[i] for i in order]
+
+def shared_blocks():
+    return {name for name in os.listdir('/dev/shm') if name.startswith('psm_')}
+
+def test_parallel_build_matches_serial(monkeypatch):
+    entities = plates(4, 5)
+    monkeypatch.setattr(fileutils, 'PARALLEL_MIN_ENTITIES', len(entities) + 1)
+    serial = fileutils._build_jobs('plate', entities)
+    monkeypatch.setattr(fileutils, 'PARALLEL_MIN_ENTITIES', 0)
+    blocks = shared_blocks()
+    parallel = fileutils._build_jobs('plate', entities)
+    assert shared_blocks() == blocks
+    assert len(serial) == len(parallel) == 20
+    for s, p in zip(serial, parallel):
+        assert s.name == p.name
+        assert np.array_equal(s.position, p.position)
+        assert len(s._source) == len(p._source) == 3
+        for a, b in zip(s._source, p._source):
+            assert np.array_equal(a.raw, b.raw)
+            assert a.is_closed() == b.is_closed()
+
+def test_map_collects_every_block_when_a_worker_raises():
+    square = np.array([[0., 50., 50., 0.], [0., 0., 50., 50.], [0.] * 4])
+    bowtie = np.array([[0., 50., 0., 50.], [0., 50., 50., 0.], [0.] * 4])
+    args_list = [([(square, True)], 1.5, True)] * 3
+    args_list.insert(1, ([(bowtie, True)], 1.5, True))
+    blocks = shared_blocks()
+    with pytest.raises(Exception, match='Self crossing'):
+        fileutils._map(fileutils._prepare_component, args_list, True)
+    assert shared_blocks() == blocks
+
+def test_shared_results_match_direct_call():
+    square = np.array([[0., 50., 50., 0.], [0., 0., 50., 50.], [0.] * 4])
+    args = ([(square, True)], 1.5, True)
+    expected = fileutils._prepare_component(*args)
+    result = fileutils._collect_shared(
+        fileutils.workers.pool().submit(fileutils._run_shared,
+                                        fileutils._prepare_component, *args))
+    (pos, contours), = result
+    (expected_pos, expected_contours), = expected
+    assert np.array_equal(pos, expected_pos)
+    for (v, c, key, offsets), (ev, ec, ekey, eoffsets) in zip(
+            contours, expected_contours):
+        assert np.array_equal(v, ev)
+        assert (c, key) == (ec, ekey)
+        assert len(offsets) == len(eoffsets)
+        for (ov, oc), (eov, eoc) in zip(offsets, eoffsets):
+            assert np.array_equal(ov, eov)
+            assert oc == eoc
@@ -0,0 +1,303 @@
+import gc
+import threading
+import numpy as np
+import pytest
+from PyQt5 import QtCore
+
+import job as jb
+import polyline as pl
+
+@pytest.fixture(autouse=True)
+def app(qapp):
+    yield qapp
+    settle(qapp)
+
+def settle(app):
+    """Run scheduled evaluations and deliver their signals."""
+    for _ in range(3):
+        app.processEvents()
+        QtCore.QThreadPool.globalInstance().waitForDone()
+    app.processEvents()
+
+def square_job(app, holes=2):
+    """Return an evaluated job, a 50 mm high plate with a row of holes."""
+    width = 10. * holes + 10.
+    exterior = pl.Polyline([[0., width, width, 0.], [0., 0., 50., 50.],
+                            [0., 0., 0., 0.]], True)
+    holes = [pl.circle2polyline([10. + 10. * i, 25.], 2.)
+             for i in range(holes)]
+    job = jb.Job('job', holes + [exterior])
+    settle(app)
+    return job
+
+def test_bounds_and_centroid_follow_scale(app):
+    job = square_job(app)
+    job.scale = 2.
+    job.position = [10., 0.]
+    scaled = job._pull(job.instance_node).scaled()[-1]
+    assert np.allclose(job.get_bounds(), scaled.bounds)
+    assert np.allclose(job.get_centroid(), scaled.centroid + [10., 0.])
+
+def test_centroid_does_not_wait_for_pipeline(app):
+    job = square_job(app)
+    acquired, release = threading.Event(), threading.Event()
+    def hold():
+        with job._lock:
+            acquired.set()
+            release.wait(5.)
+    worker = threading.Thread(target=hold)
+    worker.start()
+    acquired.wait(5.)
+    result = []
+    getter = threading.Thread(target=lambda: result.append(job.get_centroid()))
+    getter.start()
+    getter.join(1.)
+    release.set()
+    worker.join()
+    assert result and np.allclose(result[0], [15., 25.])
+
+def test_cut_count_synced_on_job_thread(app):
+    job = square_job(app)
+    assert job.cut_count == 3
+    assert job.cut_state == [jb.Job.TODO] * 3
+    job.set_cut_state(1, jb.Job.DONE)
+    # states of cuts renumbered in between are dropped
+    job.set_cut_state(7, jb.Job.DONE)
+    assert job.cut_state_indices(jb.Job.DONE) == [1]
+
+def test_cut_count_synced_from_worker_evaluation(app):
+    job = square_job(app)
+    job.set_cut_state(0, jb.Job.DONE)
+    threads = []
+    sync = job._sync_cut_count
+    def record(count):
+        threads.append(threading.current_thread())
+        sync(count)
+    job._sync_cut_count = record
+    # holes vanish with a kerf wider than them
+    job.kerf_width = 5.
+    worker = threading.Thread(target=job.evaluate)
+    worker.start()
+    worker.join()
+    assert len(job.evaluation.cut_plines) == 1
+    assert job.cut_count == 3
+    assert job.cut_state_indices(jb.Job.DONE) == [0]
+    settle(app)
+    assert job.cut_count == 1
+    assert job.cut_state == [jb.Job.TODO]
+    assert threads and all(t is threading.main_thread() for t in threads)
+
+def test_cut_paths_states_are_a_snapshot(app):
+    job = square_job(app)
+    paths, states = job.get_cut_paths()
+    assert len(paths) == len(states) == 3
+    job.set_cut_state(0, jb.Job.DONE)
+    assert states == [jb.Job.TODO] * 3
+    assert job.get_cut_paths()[1] == [jb.Job.DONE] + [jb.Job.TODO] * 2
+
+def test_cut_states_wait_for_state_changes(app):
+    job = square_job(app)
+    acquired, release = threading.Event(), threading.Event()
+    def renumber():
+        # states are reset in two steps while the lock is held
+        with job._state_lock:
+            job.cut_state = []
+            acquired.set()
+            release.wait(5.)
+            job.cut_state = [jb.Job.DONE] * 3
+    worker = threading.Thread(target=renumber)
+    worker.start()
+    acquired.wait(5.)
+    result = []
+    getter = threading.Thread(target=lambda: result.append(job.get_cut_paths()))
+    getter.start()
+    getter.join(.2)
+    assert not result
+    release.set()
+    worker.join()
+    getter.join(5.)
+    assert result and result[0][1] == [jb.Job.DONE] * 3
+
+# CANCELLATION #################################################################
+class Counter:
+    def __init__(self, cancel_after=None):
+        self.calls = []
+        self.cancel_after = cancel_after
+
+    def fun(self, indices, elements):
+        self.calls += indices
+        return [e * 2 for e in elements]
+
+    def outdated(self):
+        return (self.cancel_after is not None and
+                len(self.calls) >= self.cancel_after)
+
+def element_node(counter, count):
+    root = jb.PipelineNode(None, None)
+    root._data = list(range(100, 100 + count))
+    return jb.ElementPipelineNode(counter.fun, root)
+
+def test_element_node_stops_between_chunks_and_resumes():
+    chunk = jb.ElementPipelineNode.CHUNK
+    counter = Counter(cancel_after=chunk)
+    node = element_node(counter, 3 * chunk)
+    jb._running.outdated = counter.outdated
+    try:
+        with pytest.raises(jb.EvaluationCancelled):
+            node._update()
+    finally:
+        jb._running.outdated = None
+    assert counter.calls == list(range(chunk))
+    assert not node.up_to_date
+
+    # the next update only computes elements left
+    counter.cancel_after = None
+    assert node.data == [2 * e for e in range(100, 100 + 3 * chunk)]
+    assert counter.calls == list(range(3 * chunk))
+
+def test_element_node_keeps_dirty_elements_after_cancel():
+    chunk = jb.ElementPipelineNode.CHUNK
+    counter = Counter()
+    node = element_node(counter, 2 * chunk)
+    node.data
+    counter.calls = []
+    for i in range(2 * chunk):
+        node.notify_change(i)
+    counter.cancel_after = 1
+    jb._running.outdated = counter.outdated
+    try:
+        with pytest.raises(jb.EvaluationCancelled):
+            node._update()
+    finally:
+        jb._running.outdated = None
+    counter.cancel_after = None
+    counter.calls = []
+    node.data
+    assert counter.calls == list(range(chunk, 2 * chunk))
+
+def test_evaluation_abandoned_inside_stage(app, monkeypatch):
+    chunk = jb.ElementPipelineNode.CHUNK
+    job = square_job(app, holes=3 * chunk)
+    version = job.evaluation.version
+    calls = []
+    apply_offset = jb.GeometryInstance._apply_offset
+    def offset(instance, indices, polylines):
+        calls.append(indices)
+        # an invalidation lands while the first chunk is offset
+        if len(calls) == 1:
+            job.kerf_width = 3.
+        return apply_offset(instance, indices, polylines)
+    monkeypatch.setattr(jb.GeometryInstance, '_apply_offset', offset)
+    job.kerf_width = 2.
+    assert not job.evaluate()
+    assert len(calls) == 1
+    assert job.evaluation.version == version
+    assert job.evaluate()
+    assert job.cut_count == 3 * chunk + 1
+
+# !CANCELLATION ################################################################
+
+# BATCHES ######################################################################
+def count_signals(job):
+    counts = {'shape_update': 0, 'param_update': 0, 'evaluation': 0}
+    for name in ('shape_update', 'param_update'):
+        def count(name=name):
+            counts[name] += 1
+        getattr(job, name).connect(count)
+    schedule = job._schedule
+    def record(version):
+        counts['evaluation'] += 1
+        schedule(version)
+    job._schedule = record
+    return counts
+
+def test_batch_emits_once_at_the_end(app):
+    job = square_job(app)
+    counts = count_signals(job)
+    with job.batch():
+        job.position = [10., 0.]
+        job.angle = 30.
+        job.scale = 2.
+        job.kerf_width = 2.
+        # nothing leaves the batch even when events are processed
+        settle(app)
+        assert counts == {'shape_update': 0, 'param_update': 0,
+                          'evaluation': 0}
+    settle(app)
+    assert counts == {'shape_update': 1, 'param_update': 1, 'evaluation': 1}
+    assert np.allclose(job.get_centroid(),
+                       job.evaluation.cut_plines[-1].centroid, atol=1.)
+
+def test_nested_batches_emit_at_the_outermost_end(app):
+    job = square_job(app)
+    counts = count_signals(job)
+    with job.batch():
+        with job.batch():
+            job.position = [10., 0.]
+        settle(app)
+        assert counts['shape_update'] == 0
+        job.position = [20., 0.]
+    settle(app)
+    assert counts == {'shape_update': 1, 'param_update': 0, 'evaluation': 1}
+    assert np.allclose(job.position, [20., 0.])
+
+def test_changes_of_one_event_loop_iteration_are_coalesced(app):
+    job = square_job(app)
+    counts = count_signals(job)
+    for x in range(10):
+        job.position = [x, 0.]
+    settle(app)
+    assert counts == {'shape_update': 1, 'param_update': 0, 'evaluation': 1}
+# !BATCHES #####################################################################
+
+# GEOMETRY INSTANCES ###########################################################
+def plate_polylines(noise=0.):
+    exterior = pl.Polyline([[0., 30., 30., 0.], [0., 0., 50., 50. + noise],
+                            [0., 0., 0., 0.]], True)
+    return [pl.circle2polyline([10., 25.], 2.), exterior]
+
+def collect(app):
+    settle(app)
+    gc.collect()
+
+def test_copies_share_an_instance_until_parameters_differ(app):
+    collect(app)
+    count = jb.instance_count()
+    first = jb.Job('first', plate_polylines())
+    # copies from another file carry floating point noise
+    second = jb.Job('second', plate_polylines(1e-12))
+    settle(app)
+    assert second._instance is first._instance
+    assert jb.instance_count() == count + 1
+
+    second.kerf_width = 3.
+    settle(app)
+    assert second._instance is not first._instance
+    assert jb.instance_count() == count + 2
+    # the derived instance reuses the geometry its parameters don't change
+    assert second._instance.scaled() is first._instance.scaled()
+    assert (abs(second.evaluation.cut_plines[0].area) <
+            abs(first.evaluation.cut_plines[0].area))
+
+    second.kerf_width = first.kerf_width
+    settle(app)
+    assert second._instance is first._instance
+    collect(app)
+    assert jb.instance_count() == count + 1
+
+def test_instance_released_with_last_job(app):
+    collect(app)
+    count = jb.instance_count()
+    jobs = [jb.Job('copy %i' % i, plate_polylines()) for i in range(3)]
+    settle(app)
+    instance = jobs[0]._instance
+    assert all(j._instance is instance for j in jobs)
+    assert jb.instance_count() == count + 1
+    instance = None
+    del jobs[:2]
+    collect(app)
+    assert jb.instance_count() == count + 1
+    del jobs[:]
+    collect(app)
+    assert jb.instance_count() == count
+# !GEOMETRY INSTANCES ##########################################################
@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+
+from job import JobTask, Task
+from klippercontroller import KlipperController, QTHCLogger, decimate
+
+@pytest.fixture
+def controller(qapp):
+    controller = KlipperController(None, None)
+    controller._reset_stream()
+    controller.state = controller.ST_INAC
+    for k in range(10):
+        controller.thc_logger.log_thc_data(k, 100. + k, 5000.)
+    return controller
+
+def test_job_task_clears_thc_samples(controller):
+    cleared = []
+    controller.thc_logger.thc_update.connect(lambda: cleared.append(True))
+    version = controller.thc_logger.version
+    controller._kickstart(JobTask(['G0 X1', 'G0 X2'], None, 0, True))
+    assert controller.next_cmd == 'G0 X1'
+    # cleared once the first command is sent
+    assert controller.thc_logger.count == 10
+    controller._sent()
+    assert controller.thc_logger.count == 0
+    assert not controller.thc_logger.thc_data.any()
+    assert controller.thc_logger.version > version
+    assert cleared == [True]
+
+def test_manual_task_keeps_thc_samples(controller):
+    controller._kickstart(Task(['G0 X1']))
+    controller._sent()
+    assert controller.thc_logger.count == 10
+
+def test_logging_does_not_signal(qapp):
+    logger = QTHCLogger(100)
+    signals = []
+    logger.thc_update.connect(lambda: signals.append(True))
+    for k in range(10):
+        logger.log_thc_data(k, 0., 0.)
+    assert signals == []
+    assert logger.version == 10
+    assert np.array_equal(logger.view(10)[:,0], np.arange(10))
+
+def spike_logger(capacity, written, position):
+    """Return a logger fed written samples, the one at position of thc_data
+    being a spike."""
+    logger = QTHCLogger(capacity)
+    spike = written - capacity + position
+    for k in range(written):
+        logger.log_thc_data(0., 190. if k == spike else 100., 0.)
+    return logger
+
+@pytest.mark.parametrize('n', [7, 64, 1000, 1001, 4099])
+def test_decimate_keeps_every_sample(n):
+    data = np.zeros((n, 3))
+    data[0] = data[-1] = 1.
+    data[n // 3] = -1.
+    x, samples = decimate(data, 3)
+    assert samples.shape[0] == x.size <= max(n, 6)
+    assert np.all(np.diff(x) >= 0) and 0 <= x[0] and x[-1] <= n - 1
+    # spikes at both ends are in the first and last buckets
+    assert samples[:2,0].max() == samples[-2:,0].max() == 1.
+    assert samples[:,0].min() == -1.
+
+def test_decimate_keeps_spike_at_index_0():
+    data = np.full((1000, 3), 100.)
+    data[0,1] = 190.
+    x, samples = decimate(data, 300)
+    assert samples.shape == (600, 3)
+    assert samples[1,1] == 190. and x[1] < 3
+    assert np.all(samples[2:,1] == 100.)
+
+@pytest.mark.parametrize('n', [7, 4099])
+def test_decimate_copies_samples(n):
+    data = np.zeros((n, 3))
+    x, samples = decimate(data, 4)
+    data[:] = 1.
+    assert not np.shares_memory(samples, data)
+    assert not samples.any()
+
+@pytest.mark.parametrize('capacity', [100, 1100])
+def test_envelope_not_changed_by_later_samples(capacity):
+    logger = QTHCLogger(capacity)
+    for k in range(capacity // 2):
+        logger.log_thc_data(0., 100., 0.)
+    x, samples = logger.envelope(64)
+    expected = samples.copy()
+    for k in range(capacity):
+        logger.log_thc_data(1., 190., 1.)
+    assert not np.shares_memory(samples, logger._buffer)
+    assert np.array_equal(samples, expected)
+
+@pytest.mark.parametrize('capacity,written', [(100, 37), (100, 250),
+                                              (1100, 1100), (1100, 1137),
+                                              (1100, 3000)])
+def test_envelope_keeps_every_sample(capacity, written):
+    positions = list(range(70)) + list(range(capacity - 70, capacity))
+    for position in positions:
+        if position < capacity - written:
+            continue
+        logger = spike_logger(capacity, written, position)
+        x, samples = logger.envelope(4)
+        assert samples[:,1].max() == 190.
+        # the spike is plotted in the bucket around its position
+        spike = x[np.argmax(samples[:,1])]
+        assert abs(spike - position) <= capacity / 4
+        assert np.all(np.diff(x) >= 0)
+        assert 0 <= x[0] and x[-1] <= capacity - 1
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+import job as jb
+import leads
+import polyline as pl
+import sequencer
+from test_job import settle
+
+def rect(x, y, w, h):
+    return pl.Polyline([[x, x + w, x + w, x], [y, y, y + h, y + h],
+                        [0., 0., 0., 0.]], True)
+
+@pytest.fixture
+def plate(qapp):
+    """Return an evaluated job, a plate with two square holes."""
+    job = jb.Job('plate', [rect(20., 20., 30., 30.), rect(70., 20., 30., 30.),
+                           rect(0., 0., 120., 70.)])
+    settle(qapp)
+    yield job
+    settle(qapp)
+
+def chosen_pierces(job):
+    plines = job.get_cut_plines()
+    pierces = job.get_pierces()
+    _, entries = sequencer.sequence(plines, pierces=pierces)
+    for p, (ids, _, points), e in zip(plines, pierces, entries):
+        yield p.raw[:2,e], points[:,np.flatnonzero(ids == e)[0]]
+
+def corner_distance(point, corners):
+    return np.min(np.hypot(*(np.array(corners).T - point[:,None])))
+
+def test_pierces_in_scrap_away_from_corners(plate):
+    holes = [(20., 20., 50., 50.), (70., 20., 100., 50.)]
+    exterior = (0., 0., 120., 70.)
+    for k, (start, pierce) in enumerate(chosen_pierces(plate)):
+        x0, y0, x1, y1 = holes[k] if k < 2 else exterior
+        inside = x0 < pierce[0] < x1 and y0 < pierce[1] < y1
+        # holes are scrap inside, the exterior outside
+        assert inside == (k < 2)
+        corners = [(x0, y0), (x1, y0), (x1, y1), (x0, y1)]
+        assert corner_distance(start, corners) > leads.LEAD_LENGTH
+        assert np.hypot(*(pierce - start)) == pytest.approx(leads.LEAD_LENGTH)
+
+def test_corner_cost_parameter(plate):
+    costs = [c for _, c, _ in plate.get_pierces()]
+    plate.corner_cost = 0.
+    assert plate.corner_cost == 0.
+    free = [c for _, c, _ in plate.get_pierces()]
+    assert any(np.any(f < c) for f, c in zip(free, costs))
+    plate.corner_cost = 2 * leads.CORNER_COST
+    doubled = [c for _, c, _ in plate.get_pierces()]
+    # corner cost is linear in the weight, short lead cost does not change
+    assert all(np.allclose(d - c, c - f)
+               for d, c, f in zip(doubled, costs, free))
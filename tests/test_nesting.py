@@ -0,0 +1,101 @@
+import itertools
+import math
+import numpy as np
+import pytest
+from shapely.geometry import LinearRing, Polygon
+from shapely.ops import polygonize, unary_union
+
+import nesting
+import polyline as pl
+from job import Job
+from test_job import settle
+
+@pytest.fixture(autouse=True)
+def app(qapp):
+    yield qapp
+    settle(qapp)
+
+def plate(width, height):
+    return pl.Polyline([[0., width, width, 0.], [0., 0., height, height],
+                        [0., 0., 0., 0.]], True)
+
+def parts(app):
+    """Return jobs of plates, rings and L shapes, some of them copies."""
+    jobs = []
+    for k in range(3):
+        jobs.append(Job('plate', [pl.circle2polyline([15., 10.], 4.),
+                                  plate(40., 20.)]))
+        jobs.append(Job('ring', [pl.circle2polyline([0., 0.], 8.),
+                                 pl.circle2polyline([0., 0.], 15.)]))
+    jobs.append(Job('L', [pl.Polyline([[0., 60., 60., 15., 15., 0.],
+                                       [0., 0., 15., 15., 45., 45.],
+                                       [0.] * 6], True)]))
+    for job in jobs:
+        # placed apart so that moves are seen
+        job.position = [-500., -500.]
+    settle(app)
+    return jobs
+
+def region(pline):
+    """Return the area enclosed by a closed cut, its corner loops included."""
+    return unary_union(list(polygonize(unary_union(
+        LinearRing(pline.to_lines().T)))))
+
+def material(job):
+    """Return the area enclosed by the cut contours of job."""
+    plines = job.evaluation.cut_plines
+    shape = region(plines[-1])
+    for hole in plines[:-1]:
+        shape = shape.difference(region(hole))
+    return shape
+
+def nest(app, jobs, sheet, **kwargs):
+    placements = nesting.nest(jobs, sheet, time_budget=.3, **kwargs)
+    nesting.apply(jobs, placements)
+    settle(app)
+    return placements
+
+def assert_valid(jobs, placements, sheet, spacing=0.):
+    sheet_shape = Polygon(sheet.to_lines().T)
+    placed = [material(j) for j, p in zip(jobs, placements) if p is not None]
+    for shape in placed:
+        assert shape.difference(sheet_shape).area < 1e-6
+    for a, b in itertools.combinations(placed, 2):
+        assert a.distance(b) >= spacing - 1e-6
+        assert a.intersection(b).area < 1e-6
+
+@pytest.mark.parametrize('processes', [0, 2])
+def test_placements_stay_on_sheet_without_overlap(app, processes):
+    jobs = parts(app)
+    sheet = nesting.rect_sheet(10., 20., 150., 100.)
+    placements = nest(app, jobs, sheet, processes=processes)
+    assert all(p is not None for p in placements)
+    assert_valid(jobs, placements, sheet)
+    # jobs moved to their placements
+    for job, (angle, position) in zip(jobs, placements):
+        assert math.isclose(job.angle, angle)
+        assert np.allclose(job.position, position)
+
+def test_placements_keep_spacing(app):
+    jobs = parts(app)
+    sheet = nesting.rect_sheet(0., 0., 200., 120.)
+    placements = nest(app, jobs, sheet, spacing=4., processes=0)
+    assert all(p is not None for p in placements)
+    assert_valid(jobs, placements, sheet, spacing=4.)
+
+def test_placements_on_round_sheet(app):
+    jobs = parts(app)
+    sheet = pl.circle2polyline([0., 0.], 90.)
+    placements = nest(app, jobs, sheet, processes=0)
+    assert any(p is not None for p in placements)
+    assert_valid(jobs, placements, sheet)
+
+def test_parts_too_large_are_left_alone(app):
+    jobs = parts(app)
+    sheet = nesting.rect_sheet(0., 0., 50., 50.)
+    placements = nest(app, jobs, sheet, processes=0)
+    # the L shape never fits, rings and plates partly
+    assert placements[-1] is None
+    assert np.allclose(jobs[-1].position, [-500., -500.])
+    assert placements.count(None) > 1
+    assert_valid(jobs, placements, sheet)
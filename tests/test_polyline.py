@@ -0,0 +1,507 @@
+import math
+import random
+import numpy as np
+import pytest
+from geomdl import BSpline, utilities
+from shapely.geometry import LineString, Polygon
+
+import former
+import polyline as pl
+
+def random_vertices(rng, n, bulges):
+    angles = np.sort(rng.uniform(0, 2 * math.pi, n))
+    radii = rng.uniform(50, 100, n)
+    return np.vstack((radii * np.cos(angles), radii * np.sin(angles), bulges))
+
+def assert_same_lines(vertices, closed, precision=1e-3):
+    expected = former.tessellate(vertices, closed, precision)
+    lines = pl._tessellate(vertices, closed, precision)
+    assert lines.shape == expected.shape
+    assert np.allclose(lines, expected, rtol=0., atol=1e-9)
+
+# TESSELLATION #################################################################
+@pytest.mark.parametrize('closed', [False, True])
+@pytest.mark.parametrize('sign', [1., -1., 0.])
+def test_tessellate_matches_former_loop(closed, sign):
+    rng = np.random.default_rng(1)
+    for _ in range(50):
+        n = rng.integers(2, 30)
+        if sign:
+            bulges = sign * rng.uniform(1e-3, 1.5, n)
+        else:
+            bulges = rng.uniform(-1.5, 1.5, n)
+        bulges[rng.random(n) < .3] = 0.
+        assert_same_lines(random_vertices(rng, n, bulges), closed)
+
+@pytest.mark.parametrize('bulge', [1e-6, -1e-6, 1e-4, -1e-4])
+def test_tessellate_matches_former_loop_near_zero_bulges(bulge):
+    vertices = np.array([[0., 100., 100., 0.],
+                         [0., 0., 50., 50.],
+                         [bulge, -bulge, bulge, 0.]])
+    assert_same_lines(vertices, True)
+    assert_same_lines(vertices, False)
+
+@pytest.mark.parametrize('bulge', [1., -1.])
+@pytest.mark.parametrize('precision', pl.LOD_PRECISIONS)
+def test_tessellate_matches_former_loop_full_circles(bulge, precision):
+    vertices = np.array([[-10., 10.], [0., 0.], [bulge, bulge]])
+    assert_same_lines(vertices, True, precision)
+    lines = pl._tessellate(vertices, True, precision)
+    radii = np.hypot(*lines)
+    assert np.allclose(radii, 10.)
+    assert np.allclose(lines[:,0], lines[:,-1])
+
+def test_tessellate_keeps_degenerate_arc_as_line():
+    # sweep too small to tell start and end angles apart, the former loop
+    # dropped the segment start
+    vertices = np.array([[0., 100.], [0., 0.], [1e-12, 0.]])
+    lines = pl._tessellate(vertices, False, 1e-3)
+    assert np.allclose(lines, vertices[:2])
+
+def test_tessellate_chord_error_within_precision():
+    rng = np.random.default_rng(2)
+    for precision in pl.LOD_PRECISIONS:
+        bulges = rng.uniform(-1.5, 1.5, 20)
+        vertices = random_vertices(rng, 20, bulges)
+        center, radius, _, _ = pl._arc_geometry(
+            vertices[:2], np.roll(vertices[:2], -1, axis=1), bulges)
+        points, counts, ends = pl._tessellate_segments(
+            vertices[:2], np.roll(vertices[:2], -1, axis=1), bulges, precision)
+        seg = np.repeat(np.arange(20), counts)
+        following = np.hstack((points[:,1:], ends[:,-1:]))
+        middles = (points + following) / 2
+        sagitta = radius[seg] - np.hypot(*(middles - center[:,seg]))
+        assert np.all(sagitta <= precision + 1e-9)
+# !TESSELLATION ################################################################
+
+# AGGREGATOR ###################################################################
+def segment_soup(seed):
+    """Shuffled lines and arcs of closed contours, open chains, a complex
+    joint of three ends and a lone segment.
+    """
+    rng = np.random.default_rng(seed)
+    parts = []
+    for c in range(12):
+        center = np.array([(c % 4) * 30., (c // 4) * 30.])
+        angles = np.linspace(0, 2 * math.pi, 9)
+        points = center + 10 * np.vstack((np.cos(angles), np.sin(angles))).T
+        points[-1] = points[0]
+        # chains end up open when a segment is left out
+        for i in range(8 - (c % 3 == 0)):
+            if i % 3:
+                parts.append(pl.line2polyline(points[i], points[i+1]))
+            else:
+                parts.append(pl.arc2polyline(center, 10., angles[i],
+                                             angles[i+1]))
+    for end in ([200., 0.], [200., 20.], [220., 10.]):
+        parts.append(pl.line2polyline([210., 10.], end))
+    parts.append(pl.line2polyline([300., 0.], [310., 5.]))
+    order = rng.permutation(len(parts))
+    return [parts[i] for i in order]
+
+def canonical(polylines):
+    """Return contours as sorted (closed, undirected segments), independent
+    of their start and way.
+    """
+    contours = []
+    for p in polylines:
+        v = np.round(p.raw, 6) + 0.
+        n = v.shape[1] - int(not p.is_closed())
+        segments = []
+        for i in range(n):
+            a = tuple(v[:2,i])
+            b = tuple(v[:2,(i+1)%v.shape[1]])
+            segments.append((min(a, b), max(a, b), abs(v[2,i])))
+        contours.append((p.is_closed(), tuple(sorted(segments))))
+    return sorted(contours)
+
+def test_aggregate_matches_former_kdtree():
+    for seed in range(5):
+        expected = former.aggregate(segment_soup(seed),
+                                    random.Random(seed).shuffle)
+        result = pl.aggregate(segment_soup(seed))
+        assert canonical(result) == canonical(expected)
+        assert sum(p.is_closed() for p in result) == 8
+
+def test_aggregate_is_deterministic():
+    first = pl.aggregate(segment_soup(0))
+    second = pl.aggregate(segment_soup(0))
+    assert len(first) == len(second)
+    for a, b in zip(first, second):
+        assert a.is_closed() == b.is_closed()
+        assert np.array_equal(a.raw, b.raw)
+
+def test_joint_grid_snaps_within_precision():
+    a = pl.line2polyline([0., 0.], [10., 0.])
+    b = pl.line2polyline([10.009, -.009], [20., 0.])
+    c = pl.line2polyline([20.02, 0.], [30., 0.])
+    result = pl.aggregate([a, b, c])
+    assert canonical(result) == canonical(
+        [pl.Polyline(np.hstack((a.raw[:,:1], b.raw)), False), c])
+# !AGGREGATOR ##################################################################
+
+# SPLINES ######################################################################
+def spline_points(degree, control_points, closed, n=4000):
+    """Return (2, n) points of the spline evaluated by geomdl."""
+    curve = BSpline.Curve()
+    curve.degree = degree
+    curve.ctrlpts = [list(p) for p in control_points]
+    if closed:
+        curve.ctrlpts = curve.ctrlpts + curve.ctrlpts[:degree]
+        m = degree + len(curve.ctrlpts)
+        curve.knotvector = [i / m for i in range(m + 1)]
+        curve_range = (curve.knotvector[degree],
+                       curve.knotvector[len(curve.ctrlpts)])
+    else:
+        curve.knotvector = utilities.generate_knot_vector(degree,
+                                                          len(curve.ctrlpts))
+        curve_range = (0., 1.)
+    t = np.linspace(*curve_range, n)
+    return np.array(curve.evaluate_list(list(t)))[:,:2].T
+
+def distance_to_polyline(points, polyline):
+    """Return distances from (2, n) points to the segments of polyline."""
+    v = polyline.raw
+    n = v.shape[1] - int(not polyline.is_closed())
+    distances = np.full(points.shape[1], np.inf)
+    for i in range(n):
+        a, b = v[:2,i], v[:2,(i+1)%v.shape[1]]
+        chord = b - a
+        angle = math.atan2(chord[1], chord[0]) - 2 * math.atan(v[2,i])
+        tangent = np.array((math.cos(angle), math.sin(angle)))
+        distances = np.minimum(distances, pl._arc_distance(points, a, tangent, b))
+    return distances
+
+@pytest.mark.parametrize('closed', [False, True])
+def test_spline_degree_one_is_control_polygon(closed):
+    control_points = [[0., 0.], [10., 0.], [10., 10.], [5., 20.]]
+    polyline = pl.spline2polyline(1, control_points, closed)
+    assert polyline.is_closed() == closed
+    assert np.array_equal(polyline.raw[:2], np.array(control_points).T)
+    assert not np.any(polyline.raw[2])
+
+@pytest.mark.parametrize('seed', range(6))
+def test_spline_within_tolerance(seed):
+    rng = np.random.default_rng(seed)
+    degree = 2 + seed % 3
+    closed = bool(seed % 2)
+    tolerance = (1e-1, 1e-2)[seed % 2]
+    control_points = rng.uniform(-100, 100, (int(rng.integers(6, 16)), 2))
+    polyline = pl.spline2polyline(degree, control_points, closed, tolerance)
+    points = spline_points(degree, control_points, closed)
+    assert distance_to_polyline(points, polyline).max() <= tolerance
+
+def test_spline_keeps_corners():
+    # a control point repeated degree times makes a corner of the curve
+    control_points = [[0., 0.], [20., 0.], [40., 0.], [40., 0.], [40., 0.],
+                      [40., 20.], [40., 40.]]
+    polyline = pl.spline2polyline(3, control_points, False)
+    points = spline_points(3, control_points, False)
+    assert distance_to_polyline(points, polyline).max() <= 1e-1
+    assert np.any(np.all(np.isclose(polyline.raw[:2], [[40.], [0.]]), axis=0))
+# !SPLINES #####################################################################
+
+# LOOPS ########################################################################
+KERF = 1.
+LOOP_ANGLE = 121 * math.pi / 180
+LOOP_RADIUS = 1.5
+
+def comb(teeth):
+    x = np.repeat(np.arange(2 * teeth) * 2., 2)
+    y = np.tile([0., 10., 10., 0.], teeth)
+    x = np.concatenate((x, [x[-1], 0.]))
+    y = np.concatenate((y, [-5., -5.]))
+    return np.vstack((x, y, np.zeros_like(x)))
+
+def star(spikes):
+    angles = np.linspace(0, 2 * math.pi, 2 * spikes, endpoint=False)
+    radii = np.tile([100., 20.], spikes)
+    return np.vstack((radii * np.cos(angles), radii * np.sin(angles),
+                      np.zeros_like(angles)))
+
+def square():
+    return np.array([[0., 50., 50., 0.], [0., 0., 50., 50.], [0., 0., 0., 0.]])
+
+@pytest.mark.parametrize('vertices', [comb(1), comb(50), star(5), star(40),
+                                      square()])
+@pytest.mark.parametrize('offset', [KERF / 2, -KERF / 2])
+def test_loop_matches_former_insert(vertices, offset):
+    for contour in pl.Polyline(vertices, True).offset(offset):
+        # start on every vertex, looped corners at both ends included
+        for start in (0, 1, contour.raw.shape[1] - 1):
+            shifted = contour.shift_start(start) if start else contour
+            expected = former.loop(shifted, LOOP_ANGLE, KERF / 2, LOOP_RADIUS)
+            looped = shifted.loop(LOOP_ANGLE, KERF / 2, LOOP_RADIUS)
+            assert np.array_equal(looped.raw, expected.raw)
+            assert looped.is_closed() == expected.is_closed()
+
+def test_loop_without_corners_keeps_vertices():
+    contour = pl.circle2polyline([0., 0.], 10.)
+    looped = contour.loop(LOOP_ANGLE, KERF / 2, LOOP_RADIUS)
+    assert np.array_equal(looped.raw, contour.raw)
+# !LOOPS #######################################################################
+
+# SELF INTERSECTIONS ###########################################################
+QUARTER = math.tan(math.pi / 8)
+
+def assert_same_points(points, expected):
+    expected = np.array(expected, dtype=float).reshape(-1, 2).T
+    assert points.shape == expected.shape
+    for p in expected.T:
+        assert np.any(np.all(np.isclose(points.T, p, atol=1e-6), axis=1))
+
+def self_intersections(vertices, closed=False):
+    """Return self intersections of the polyline in both directions, checked
+    to be the same.
+    """
+    polyline = pl.Polyline(np.array(vertices, dtype=float).T, closed)
+    points = polyline.self_intersections()
+    assert_same_points(polyline.reverse().self_intersections(), points.T)
+    return points
+
+def test_candidate_pairs_match_brute_force():
+    rng = np.random.default_rng(0)
+    lo = rng.uniform(0, 100, (2, 300))
+    hi = lo + rng.uniform(0, 10, (2, 300))
+    i, j = pl._candidate_pairs(lo, hi)
+    assert np.all(i < j)
+    overlap = np.all((lo[:,:,None] <= hi[:,None,:]) &
+                     (lo[:,None,:] <= hi[:,:,None]), axis=0)
+    expected = set(zip(*np.nonzero(np.triu(overlap, 1))))
+    assert len(i) == len(expected)
+    assert set(zip(i, j)) == expected
+
+def test_self_intersections_crossing_lines():
+    points = self_intersections([[0, 0, 0], [10, 10, 0], [10, 0, 0],
+                                 [0, 10, 0]])
+    assert_same_points(points, [5, 5])
+
+def test_self_intersections_arc_crossing_line():
+    # lower half circle of center (5, 0) crossed by the vertical x = 5
+    points = self_intersections([[0, 0, 1], [10, 0, 0], [10, -10, 0],
+                                 [5, -10, 0], [5, 2, 0]])
+    assert_same_points(points, [5, -5])
+
+def test_self_intersections_tangent_arcs():
+    # half circles of centers (5, 0) and (5, -10) touching at (5, -5)
+    points = self_intersections([[0, 0, 1], [10, 0, 0], [10, -10, 1],
+                                 [0, -10, 0]])
+    assert_same_points(points, [5, -5])
+
+def test_self_intersections_collinear_overlap():
+    # last segment runs back over the first one between x = 5 and x = 10
+    points = self_intersections([[0, 0, 0], [10, 0, 0], [10, 1, 0],
+                                 [5, 1, 0], [5, 0, 0], [15, 0, 0]])
+    assert_same_points(points, [[5, 0], [10, 0]])
+
+def test_self_intersections_same_circle_arcs_overlap():
+    # quarter arc running again over the half circle of center (5, 0)
+    points = self_intersections([[0, 0, 1], [10, 0, 0], [20, -20, 0],
+                                 [5, -5, QUARTER], [10, 0, 0]])
+    assert_same_points(points, [[5, -5], [10, 0]])
+    # the arcs alone, their circles have no crossing to tell the overlap
+    a = np.array([[0., 5.], [0., -5.]])
+    b = np.array([[10., 10.], [0., 0.]])
+    bulge = np.array([1., QUARTER])
+    points, pair_ids = pl._intersect_pairs(a, b, bulge, np.array([0]),
+                                           np.array([1]))
+    assert np.array_equal(pair_ids, [0] * points.shape[1])
+    assert_same_points(pl._unique_points(points), [[5, -5], [10, 0]])
+
+@pytest.mark.parametrize('vertices', [
+    [[0, 0, 0], [50, 0, 0], [50, 50, 0], [0, 50, 0]],
+    [[0, 0, 0], [10, 0, 0], [0, 0.01, 0]],
+    [[0, 0, 1], [10, 0, -1], [20, 0, 0], [20, 10, 0]],
+])
+@pytest.mark.parametrize('closed', [False, True])
+def test_self_intersections_ignore_shared_vertices(vertices, closed):
+    assert self_intersections(vertices, closed).size == 0
+
+def test_self_intersections_ignore_shared_vertex_only():
+    assert pl.circle2polyline([0., 0.], 10.).self_intersections().size == 0
+    # the arc following the line comes back on it away from their vertex
+    points = self_intersections([[0, 0, 0], [10, 0, 1], [5, 0, 0]])
+    assert_same_points(points, [5, 0])
+# !SELF INTERSECTIONS ##########################################################
+
+# AREAS AND CENTROIDS ##########################################################
+def bulge_polygons():
+    rng = np.random.default_rng(2)
+    polygons = [pl.circle2polyline([3., -7.], 12.),
+                # rounded rectangle, clockwise
+                pl.Polyline([[0., 40., 45., 45., 40., 0.],
+                             [0., 0., 5., 25., 30., 30.],
+                             [0., -QUARTER, 0., -QUARTER, 0., 0.]], True),
+                # near zero bulges, areas from the series expansion
+                pl.Polyline(random_vertices(rng, 40, rng.uniform(-1e-4, 1e-4,
+                                                                  40)), True)]
+    while len(polygons) < 8:
+        vertices = random_vertices(rng, 12, rng.uniform(-0.4, 0.4, 12))
+        polygon = pl.Polyline(vertices, True)
+        if polygon.is_simple():
+            polygons.append(polygon)
+    return polygons
+
+# shapely gets tessellations, areas differ by less than the chord error times
+# the perimeter
+PRECISION = 1e-5
+
+def shapely_of(polyline):
+    lines = polyline.to_lines(PRECISION).T
+    return Polygon(lines) if polyline.is_closed() else LineString(lines)
+
+@pytest.mark.parametrize('polygon', bulge_polygons())
+def test_area_and_centroid_match_shapely(polygon):
+    shape = shapely_of(polygon)
+    assert polygon.is_ccw() == shape.exterior.is_ccw
+    assert math.isclose(abs(polygon.area), shape.area,
+                        abs_tol=shape.length * PRECISION)
+    assert np.allclose(polygon.centroid, shape.centroid.coords[0], atol=1e-4)
+    assert np.allclose(polygon.bounds.ravel(), shape.bounds, atol=1e-4)
+
+@pytest.mark.parametrize('polygon', bulge_polygons())
+def test_open_polyline_centroid_matches_shapely(polygon):
+    vertices = polygon.raw.copy()
+    vertices[2,-1] = 0.
+    polyline = pl.Polyline(vertices, False)
+    shape = shapely_of(polyline)
+    assert polyline.area == 0.
+    assert np.allclose(polyline.centroid, shape.centroid.coords[0], atol=1e-4)
+    assert np.allclose(polyline.bounds.ravel(), shape.bounds, atol=1e-4)
+
+def test_polyline_set_matches_polylines():
+    polygons = bulge_polygons()
+    polyline_set = pl.PolylineSet(polygons)
+    assert np.allclose(polyline_set.areas, [p.area for p in polygons])
+    assert np.allclose(polyline_set.bounds, [p.bounds for p in polygons])
+# !AREAS AND CENTROIDS #########################################################
+
+# OFFSET CACHE #################################################################
+@pytest.fixture
+def offset_cache():
+    pl.offset_cache.clear()
+    yield pl.offset_cache
+    pl.offset_cache.clear()
+
+def test_offset_cache_hit_shares_read_only_results(offset_cache):
+    first = pl.Polyline(star(5), True).offset(KERF / 2)
+    assert offset_cache.stats()['misses'] == 1
+    # same content from another polyline
+    second = pl.Polyline(star(5), True).offset(KERF / 2)
+    assert offset_cache.stats()['hits'] == 1
+    assert len(first) == len(second)
+    for a, b in zip(first, second):
+        assert a is not b
+        assert np.shares_memory(a.raw, b.raw)
+        assert a.is_closed() == b.is_closed()
+        with pytest.raises(ValueError):
+            a.raw[0,0] = 0.
+    # results are still usable to build new polylines
+    assert np.array_equal(second[0].reverse().reverse().raw, second[0].raw)
+
+def test_offset_cache_misses_on_other_keys(offset_cache):
+    pl.Polyline(star(5), True).offset(KERF / 2)
+    pl.Polyline(star(5), True).offset(-KERF / 2)
+    pl.Polyline(star(5), False).offset(KERF / 2)
+    pl.Polyline(star(6), True).offset(KERF / 2)
+    stats = offset_cache.stats()
+    assert (stats['hits'], stats['misses'], stats['entries']) == (0, 4, 4)
+
+def test_offset_cache_evicts_least_recently_used():
+    results = [(np.zeros((3, 10)), True)]
+    size = results[0][0].nbytes
+    cache = pl.OffsetCache(max_bytes=3 * size)
+    keys = [pl.OffsetCache.key(star(5), True, offset)
+            for offset in range(4)]
+    for key in keys[:3]:
+        cache.put(key, results)
+    # touch the oldest entry so that the second one goes first
+    assert cache.get(keys[0]) is results
+    cache.put(keys[3], results)
+    assert cache.get(keys[1]) is None
+    assert all(cache.get(key) is results for key in (keys[0], keys[2],
+                                                     keys[3]))
+    assert cache.stats()['bytes'] == 3 * size
+    # replacing an entry does not count it twice
+    cache.put(keys[3], results)
+    assert cache.stats()['bytes'] == 3 * size
+    # results larger than the whole cache are not kept
+    cache.put(keys[1], [(np.zeros((3, 40)), True)])
+    assert cache.get(keys[1]) is None
+    assert cache.stats()['entries'] == 3
+# !OFFSET CACHE ################################################################
+
+# HIERARCHY ####################################################################
+def rect(x, y, width, height):
+    return pl.Polyline([[x, x + width, x + width, x], [y, y, y + height,
+                        y + height], [0., 0., 0., 0.]], True)
+
+def nested_plates():
+    """Return plates with holes holding parts with holes of their own, three
+    levels deep, engravings and a bare plate, by name.
+    """
+    return {'plate': rect(0., 0., 200., 200.),
+            'square hole': rect(20., 20., 100., 100.),
+            'round hole': pl.circle2polyline([160., 50.], 20.),
+            'engraving': pl.line2polyline([150., 150.], [180., 150.]),
+            'part': rect(30., 30., 80., 80.),
+            'part hole': pl.circle2polyline([70., 70.], 25.),
+            'part engraving': pl.line2polyline([35., 35.], [40., 100.]),
+            'washer': pl.circle2polyline([70., 70.], 10.),
+            'washer hole': pl.circle2polyline([70., 70.], 3.),
+            'tab': rect(152., 42., 16., 16.),
+            'bare plate': rect(300., 0., 100., 100.)}
+
+def named_groups(groups, names):
+    """Return groups as a set of (exterior, interiors) of names."""
+    return {(names[id(g[-1])], frozenset(names[id(p)] for p in g[:-1]))
+            for g in groups}
+
+def test_find_parents_of_nested_plates():
+    plates = nested_plates()
+    names = list(plates)
+    parents = pl.find_parents(list(plates.values()))
+    assert {n: None if p is None else names[p]
+            for n, p in zip(names, parents)} == {
+        'plate': None, 'square hole': 'plate', 'round hole': 'plate',
+        'engraving': 'plate', 'part': 'square hole', 'part hole': 'part',
+        'part engraving': 'part', 'washer': 'part hole',
+        'washer hole': 'washer', 'tab': 'round hole', 'bare plate': None}
+
+@pytest.mark.parametrize('seed', range(3))
+def test_group_as_contours_of_nested_plates(seed):
+    plates = nested_plates()
+    polylines = list(plates.values())
+    random.Random(seed).shuffle(polylines)
+    names = {id(p): n for n, p in plates.items()}
+    groups = pl.group_as_contours(polylines)
+    assert named_groups(groups, names) == {
+        ('plate', frozenset(('square hole', 'round hole', 'engraving'))),
+        ('part', frozenset(('part hole', 'part engraving'))),
+        ('washer', frozenset(('washer hole',))),
+        ('tab', frozenset()),
+        ('bare plate', frozenset())}
+    assert named_groups(former.group_as_contours(polylines), names) == \
+        named_groups(groups, names)
+
+@pytest.mark.parametrize('seed', range(3))
+def test_group_as_contours_matches_former_builder(seed):
+    rng = random.Random(seed)
+    polylines = []
+    for k in range(12):
+        x, y = 120. * (k % 4), 120. * (k // 4)
+        polylines += [rect(x, y, 100., 100.),
+                      pl.circle2polyline([x + 25., y + 25.], 8.),
+                      rect(x + 50., y + 50., 40., 40.)]
+        if rng.random() < .5:
+            polylines += [rect(x + 55., y + 55., 30., 30.),
+                          pl.circle2polyline([x + 70., y + 70.], 5.)]
+            if rng.random() < .5:
+                polylines.append(pl.circle2polyline([x + 70., y + 70.], 2.))
+        polylines.append(pl.line2polyline([x + 5., y + rng.uniform(5., 95.)],
+                                          [x + 15., y + 50.]))
+    rng.shuffle(polylines)
+    names = {id(p): i for i, p in enumerate(polylines)}
+    assert named_groups(pl.group_as_contours(polylines), names) == \
+        named_groups(former.group_as_contours(polylines), names)
+# !HIERARCHY ###################################################################
@@ -0,0 +1,111 @@
+import math
+import random
+import numpy as np
+import pytest
+
+import polyline as pl
+import sequencer
+from job import Job
+from postprocessor import PostProcessor
+from project import Project
+from test_job import settle
+
+def square(x, y, side):
+    return pl.Polyline([[x, x + side, x + side, x], [y, y, y + side, y + side],
+                        [0., 0., 0., 0.]], True)
+
+def circle(x, y, radius):
+    return pl.circle2polyline([x, y], radius)
+
+def open_cut(x, y, length):
+    return pl.Polyline([[x, x + length], [y, y], [0., 0.]], False)
+
+def sheet(seed, plates=12):
+    """Return shuffled cuts of plates with holes, parts nested in some
+    holes with holes of their own, and open cuts between plates.
+    """
+    rng = random.Random(seed)
+    cuts = []
+    for k in range(plates):
+        x, y = 120. * (k % 4), 120. * (k // 4)
+        cuts.append(square(x, y, 100.))
+        cuts.append(circle(x + 25., y + 25., 8.))
+        cuts.append(square(x + 50., y + 50., 40.))
+        if rng.random() < .5:
+            # a part in the square hole, with its own hole
+            cuts.append(square(x + 55., y + 55., 30.))
+            cuts.append(circle(x + 70., y + 70., 5.))
+        cuts.append(open_cut(x + 102., y + rng.uniform(0., 100.), 15.))
+    rng.shuffle(cuts)
+    return cuts
+
+def check_containment(plines, order):
+    pos = {c: k for k, c in enumerate(order)}
+    parents = pl.find_parents(plines)
+    for c, parent in enumerate(parents):
+        if parent is not None:
+            assert pos[c] < pos[parent]
+    return parents
+
+def test_holes_before_exterior():
+    plines = [square(0., 0., 100.), circle(20., 20., 5.), circle(80., 80., 5.)]
+    order, entries = sequencer.sequence(plines)
+    assert sorted(order) == [0, 1, 2]
+    assert order[-1] == 0
+
+def test_nested_parts_before_their_hole():
+    plines = [square(0., 0., 100.), square(20., 20., 60.),
+              square(30., 30., 40.), circle(50., 50., 5.)]
+    order, entries = sequencer.sequence(plines, origin=(200., 200.))
+    # part hole, part exterior, plate hole, plate exterior
+    assert order == [3, 2, 1, 0]
+
+@pytest.mark.parametrize('seed', range(5))
+def test_sheet_order(seed):
+    plines = sheet(seed)
+    order, entries = sequencer.sequence(plines)
+    assert sorted(order) == list(range(len(plines)))
+    parents = check_containment(plines, order)
+    assert sum(p is not None for p in parents) > len(plines) // 3
+    for c, p in enumerate(plines):
+        if not p.is_closed():
+            assert entries[c] == 0
+    n = len(plines)
+    assert (sequencer.travel(plines, order, entries) <
+            sequencer.travel(plines, range(n), [0] * n))
+
+@pytest.mark.parametrize('seed', range(5))
+def test_moves_never_lengthen_tour(seed):
+    plines = sheet(seed)
+    s = sequencer._Sequencer(plines, (0., 0.), None)
+    s.order = s._nearest_neighbour()
+    s._select_entries()
+    s._update_positions(0, s.n - 1)
+    s.neighbours = s._neighbours()
+    def length():
+        return sequencer.travel(plines, s.order, s.entries)
+    before = length()
+    moves = 0
+    for move in (s._two_opt, s._or_opt):
+        for c in list(s.order):
+            if move(s.pos[c]):
+                after = length()
+                assert after < before + 1e-9
+                before = after
+                moves += 1
+                check_containment(plines, s.order)
+    assert moves > 0
+
+def test_generate_tasks_reports_travel(qapp):
+    project = Project()
+    job = Job('plate', [square(0., 0., 100.), circle(80., 20., 5.),
+                        circle(20., 80., 5.), circle(80., 80., 5.)])
+    job.position = [50., 50.]
+    project.jobs.append(job)
+    settle(qapp)
+    reports = []
+    project.travel_update.connect(lambda *r: reports.append(r))
+    tasks = project.generate_tasks(PostProcessor(), True)
+    assert len(tasks) == 5
+    assert reports == [(project.travel, project.travel_saved)]
+    assert project.travel > 0. and project.travel_saved >= 0.
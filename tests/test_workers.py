@@ -0,0 +1,9 @@
+import fileutils
+import nesting
+import workers
+
+
+def test_single_pool():
+    pool = workers.pool()
+    assert workers.pool() is pool
+    assert fileutils.workers.pool() is nesting.workers.pool() is pool